@@ -27,9 +27,64 @@ CREATE TABLE IF NOT EXISTS tests (
     type_id INT REFERENCES test_types(type_id) ON DELETE CASCADE,
     score INT CHECK (score BETWEEN 1 AND 100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    difficulty VARCHAR(20)
+    difficulty VARCHAR(20),
+    idempotency_key UUID UNIQUE
 );
 
+-- Ключ идемпотентности: повторная доставка результата не создаёт дубликат
+ALTER TABLE tests ADD COLUMN IF NOT EXISTS idempotency_key UUID UNIQUE;
+
+-- Тесты пользователя за период: поиск по (user_id, created_at) без обращения к таблице
+CREATE INDEX IF NOT EXISTS tests_user_created_idx ON tests (user_id, created_at) INCLUDE (type_id, score, difficulty);
+
+-- Дневные агрегаты результатов: статистика читает их, а не все тесты пользователя
+CREATE TABLE IF NOT EXISTS test_daily_stats (
+    user_id INT REFERENCES users(user_id) ON DELETE CASCADE,
+    day DATE,
+    type_id INT REFERENCES test_types(type_id) ON DELETE CASCADE,
+    difficulty VARCHAR(20) DEFAULT '',
+    tests_count INT NOT NULL,
+    score_sum BIGINT NOT NULL,
+    score_min INT,
+    score_max INT,
+    PRIMARY KEY (user_id, day, type_id, difficulty)
+);
+
+-- Агрегаты обновляются триггером на уровне оператора: пачка результатов - один UPSERT
+CREATE OR REPLACE FUNCTION rollup_test_daily_stats() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO test_daily_stats AS s (user_id, day, type_id, difficulty, tests_count, score_sum, score_min, score_max)
+    SELECT user_id, created_at::date, type_id, COALESCE(difficulty, ''), COUNT(*), COALESCE(SUM(score), 0), MIN(score), MAX(score)
+    FROM new_tests
+    WHERE user_id IS NOT NULL AND type_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    ORDER BY 1, 2, 3, 4  -- Одинаковый порядок блокировок у параллельных вставок
+    ON CONFLICT (user_id, day, type_id, difficulty) DO UPDATE SET
+        tests_count = s.tests_count + EXCLUDED.tests_count,
+        score_sum = s.score_sum + EXCLUDED.score_sum,
+        score_min = LEAST(s.score_min, EXCLUDED.score_min),
+        score_max = GREATEST(s.score_max, EXCLUDED.score_max);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер и первичное заполнение в одной транзакции: CREATE TRIGGER блокирует вставки
+-- в tests до фиксации, поэтому ни один результат не будет пропущен или учтён дважды
+BEGIN;
+-- DROP + CREATE вместо CREATE OR REPLACE TRIGGER (только с PostgreSQL 14): версия образа не закреплена
+DROP TRIGGER IF EXISTS tests_daily_stats ON tests;
+CREATE TRIGGER tests_daily_stats
+    AFTER INSERT ON tests
+    REFERENCING NEW TABLE AS new_tests
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_test_daily_stats();
+
+INSERT INTO test_daily_stats (user_id, day, type_id, difficulty, tests_count, score_sum, score_min, score_max)
+SELECT user_id, created_at::date, type_id, COALESCE(difficulty, ''), COUNT(*), COALESCE(SUM(score), 0), MIN(score), MAX(score)
+FROM tests
+WHERE user_id IS NOT NULL AND type_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM test_daily_stats)
+GROUP BY 1, 2, 3, 4;
+COMMIT;
+
 --CREATE TABLE IF NOT EXISTS confirmation_tokens (
 --    id SERIAL PRIMARY KEY,
 --    username VARCHAR(255) NOT NULL,
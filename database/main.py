@@ -1,23 +1,31 @@
 import os
-from datetime import datetime
+from datetime import date, datetime
 
-from fastapi import FastAPI, HTTPException, Body, Query
+from fastapi import FastAPI, HTTPException, Body, Query, Request, Response
 from typing import List
-import psycopg2
 import sys
 from pydantic import BaseModel
 #import bcrypt
 
-from manager import PostgresDBManager  # Подключаем ваш класс для работы с БД
+from manager import PostgresDBManager, ReferenceData, CONNECTION_ERRORS, DATA_ERRORS, CommitError  # Подключаем ваш класс для работы с БД
 from utils.shemas import User, Test, UserUpdate, TestCategory, TestType
 
 app = FastAPI()
 
-def fatal_db_error(e: Exception):
-    """Фатальная ошибка работы с БД — аварийное завершение приложения."""
-    if isinstance(e, psycopg2.InterfaceError) or isinstance(e, psycopg2.OperationalError):
-        print(f"Fatal database error detected: {str(e)}", file=sys.stderr)
-        os._exit(1)
+def db_error(e: Exception):
+    """
+    Ошибка работы с БД. Потерянные соединения менеджер уже переоткрыл, поэтому процесс
+    продолжает работу: если БД недоступна и после переподключения - 503, если данные нарушают
+    ограничения БД (например, внешний ключ на удалённого пользователя) - 422, иначе 500.
+    """
+    if isinstance(e, HTTPException):
+        raise e
+    print(f"Database error: {e!r}", file=sys.stderr)
+    if isinstance(e, DATA_ERRORS):
+        raise HTTPException(status_code=422, detail=f"Rejected by database constraints: {e}")
+    if isinstance(e, CONNECTION_ERRORS + (CommitError,)):
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    raise HTTPException(status_code=500, detail="Database error")
 
 db = PostgresDBManager(
     db_name=os.getenv("POSTGRES_DB", "test_db"),
@@ -29,21 +37,21 @@ db = PostgresDBManager(
 
 
 @app.post("/users/")
-def add_user(user: User):
+async def add_user(user: User):
     """Добавляет нового пользователя в БД."""
     try:
-        db.add_user(user)
+        await db.add_user(user)
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
     return {"message": "User added successfully"}
 
 @app.post("/users/register")
-def register_user(user: User):
+async def register_user(user: User):
     """Регистрация нового пользователя. Проверяет, существует ли пользователь с таким именем или email."""
     try:
-        success = db.add_user(user)
+        success = await db.add_user(user)
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
     if success:
         return {"message": "User registered successfully"}
     raise HTTPException(status_code=400, detail="User already exists")
@@ -54,29 +62,37 @@ class ChangePasswordRequest(BaseModel):
 
 @app.post("/users/change_password")
 async def change_password(request: ChangePasswordRequest):
-    user = db.fetch_one("SELECT * FROM users WHERE username = %s", (request.username,))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     new_hashed_password = request.new_password#bcrypt.hashpw(request.new_password.encode("utf-8"), bcrypt.gensalt()).decode()
 
+    # Проверка существования и обновление - один запрос
     try:
-        db.update_password(request.username, new_hashed_password)
-        return {"message": "Password updated successfully"}
+        updated = await db.update_password(request.username, new_hashed_password)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        db_error(e)
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "Password updated successfully"}
 
 @app.post("/tests/")
-def add_test(test: Test):
+async def add_test(test: Test):
     """Добавляет новый тест в БД."""
     try:
-        db.add_test(test)
+        await db.add_test(test)
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
     return {"message": "Test added successfully"}
 
+@app.post("/tests/batch")
+async def add_tests(tests: List[Test]):
+    """Добавляет пачку тестов одной транзакцией. Повторная отправка с теми же idempotency_key не создаёт дубликатов."""
+    try:
+        inserted = await db.add_tests(tests) if tests else 0
+    except Exception as e:
+        db_error(e)
+    return {"message": "Tests added successfully", "received": len(tests), "inserted": inserted}
+
 @app.get("/user_tests/")
-def get_user_tests(
+async def get_user_tests(
     username: str = Query(..., description="Имя пользователя"),
     time_after: str = Query(..., description="Временная метка в формате ISO (например, 2023-01-01T00:00:00)")
 ):
@@ -86,35 +102,57 @@ def get_user_tests(
         raise HTTPException(status_code=400, detail="Invalid datetime format")
 
     try: 
-        tests = db.get_tests_by_user(username=username, time_after=time_after_dt)
+        tests = await db.get_tests_by_user(username=username, time_after=time_after_dt)
         #print(tests)
         return {"tests": tests or []}  # Возвращаем пустой список вместо None
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
 
 
+@app.get("/user_stats/daily")
+async def get_user_daily_stats(
+    username: str = Query(..., description="Имя пользователя"),
+    since: date = Query(..., description="Первый день периода (например, 2023-01-01)")
+):
+    """Дневные агрегаты результатов пользователя: день, тип, сложность, число тестов, сумма/среднее/мин/макс баллов."""
+    try:
+        return {"stats": await db.get_daily_stats(username=username, since=since)}
+    except Exception as e:
+        db_error(e)
+
+@app.get("/user_stats/summary")
+async def get_user_stats_summary(
+    username: str = Query(..., description="Имя пользователя"),
+    since: date = Query(..., description="Первый день периода (например, 2023-01-01)")
+):
+    """Итоги пользователя по типам тестов за период."""
+    try:
+        return {"summary": await db.get_stats_summary(username=username, since=since)}
+    except Exception as e:
+        db_error(e)
+
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int):
+async def delete_user(user_id: int):
     """Удаляет пользователя по `user_id`."""
     try:
-        db.delete_user(user_id)
+        await db.delete_user(user_id)
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
     return {"message": "User deleted successfully"}
 
 @app.put("/users/{username}")
-def update_user(username: str, user: UserUpdate = Body(...)):
+async def update_user(username: str, user: UserUpdate = Body(...)):
     """Обновляет данные пользователя (без изменения пароля)."""
     try:
         print(user, username)
-        success = db.update_user(username, user)
+        success = await db.update_user(username, user)
         print(success)
         if success:
             return {"message": "User updated successfully"}
     except Exception as e:
         print(e)
-        fatal_db_error(e)
+        db_error(e)
     
     raise HTTPException(status_code=400, detail="Invalid update parameters")
 
@@ -130,72 +168,85 @@ async def confirm_update(token: str):
         else:
             raise HTTPException(status_code=400, detail="Invalid or expired confirmation token")
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
 
 @app.post("/users/authenticate")
-def authenticate_user(data: dict):
+async def authenticate_user(data: dict):
     """Проверяет соответствие хэша пароля и имени пользователя"""
     username = data.get("username")
     password_hash = data.get("password_hash")
     
-    query = "SELECT * FROM users WHERE username = %s AND password_hash = %s"
     try:
-        user = db.fetch_one(query, (username, password_hash))
+        user = await db.verify_user_credentials(username, password_hash)
         if user:
             return {"username": user["username"], "email": user["email"], "role": user["role"]}
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
 
 
 
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @app.get("/users/{username}")
-def get_user(username: str):
+async def get_user(username: str):
     """Возвращает данные пользователя по `username`"""
     try:
-        user = db.get_user_by_username(username)
+        user = await db.get_user_by_username(username)
         if user:
             return user
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
 
     raise HTTPException(status_code=404, detail="User not found")
 
 @app.get("/users/get_password_hash/{username}")
-def get_password_hash(username: str):
+async def get_password_hash(username: str):
     """Возвращает хеш пароля пользователя"""
-    query = "SELECT password_hash FROM users WHERE username = %s"
     try:
-        db.cursor.execute(query, (username,))
-        result = db.cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-        #print(result, username)
+        password_hash = await db.get_password_hash(username)
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
+    if not password_hash:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    return {"password_hash": result["password_hash"]}
+    return {"password_hash": password_hash}
+
+def reference_response(request: Request, data: ReferenceData) -> Response:
+    """Ответ со справочником: готовое тело из кэша или 304, если у клиента та же версия (If-None-Match)."""
+    headers = {"ETag": data.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == data.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data.body, media_type="application/json", headers=headers)
 
 @app.get("/test_categories/", response_model=List[TestCategory])
-def get_all_test_categories():
+async def get_all_test_categories(request: Request):
     """Возвращает все категории тестов."""
     try:
-        return db.get_all_test_categories()
+        return reference_response(request, await db.get_reference_data("test_categories"))
     except Exception as e:
-        fatal_db_error(e)
-    
-
+        db_error(e)
 
 @app.get("/test_types/", response_model=List[TestType])
-def get_all_test_types():
+async def get_all_test_types(request: Request):
     """Возвращает все типы тестов."""
     try:
-        return db.get_all_test_types()
+        return reference_response(request, await db.get_reference_data("test_types"))
     except Exception as e:
-        fatal_db_error(e)
+        db_error(e)
+
+@app.delete("/reference_cache/")
+async def invalidate_reference_cache(name: str | None = Query(None, description="test_categories или test_types, по умолчанию все")):
+    """Сбрасывает кэш справочников: следующий запрос перечитает их из БД."""
+    if name is not None and name not in db.REFERENCE_QUERIES:
+        raise HTTPException(status_code=404, detail="Unknown reference table")
+    db.invalidate_reference_data(name)
+    return {"message": "Reference cache invalidated"}
+
 
+@app.on_event("startup")
+async def startup():
+    await db.connect()
 
 @app.on_event("shutdown")
-def shutdown():
-    db.close()
+async def shutdown():
+    await db.close()
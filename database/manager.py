@@ -1,130 +1,285 @@
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable
 
-from psycopg2.extras import RealDictCursor
-import psycopg2
+import asyncpg
 
 from utils.shemas import User, Test, TestCategory, TestType
 
+logger = logging.getLogger(__name__)
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_RECONNECT_ATTEMPTS = int(os.getenv("DB_RECONNECT_ATTEMPTS", 3))
+DB_RECONNECT_BACKOFF = float(os.getenv("DB_RECONNECT_BACKOFF", 0.2))  # Секунды, удваивается с каждой попыткой
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 10))  # Секунды
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", 600))  # Секунды
+
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError)
+# Данные, которые БД не примет и при повторе (нарушение ограничений, неверные значения)
+DATA_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+class CommitError(Exception):
+    """Соединение потеряно во время фиксации транзакции: результат неизвестен, повторять нельзя."""
+
+class ReferenceData:
+    """Справочник в памяти: готовое JSON-тело ответа и его ETag."""
+
+    def __init__(self, items: list[dict], ttl: float):
+        self.body = json.dumps(items, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self.items = items
+        self.expires = time.monotonic() + ttl
+
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
 # Класс для работы с БД
 class PostgresDBManager:
-    def __init__(self, db_name: str, user: str, password: str, host: str = "localhost", port: int = 5432):
-        self.connection = psycopg2.connect(
-            dbname=db_name,
-            user=user,
-            password=password,
-            host=host,
-            port=port
+    """
+    Асинхронный пул соединений с PostgreSQL (asyncpg).
+
+    Каждая операция берёт соединение из пула и выполняется в своей транзакции
+    (одиночные чтения - без явной транзакции), так что запрос к API = одна транзакция.
+    asyncpg сам готовит запросы на сервере и кэширует их на соединении, поэтому
+    горячие запросы разбираются и планируются один раз.
+    Если соединение потеряно до фиксации, операция повторяется на новом соединении.
+    """
+
+    def __init__(self, db_name: str, user: str, password: str, host: str = "localhost", port: int = 5432,
+                 min_connections: int = DB_POOL_MIN, max_connections: int = DB_POOL_MAX):
+        self.connect_params = {"database": db_name, "user": user, "password": password, "host": host, "port": port}
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.pool: asyncpg.Pool | None = None
+        self._reference: dict[str, ReferenceData] = {}
+        self._reference_locks: dict[str, asyncio.Lock] = {}
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            min_size=self.min_connections,
+            max_size=self.max_connections,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            **self.connect_params,
         )
-        self.cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-
-    def _execute(self, query: str, params: tuple = ()):
-        """Частный метод для выполнения SQL-запросов."""
-        try:
-            self.cursor.execute(query, params)
-            self.connection.commit()
-        except psycopg2.Error as e:
-            self.connection.rollback()
-            raise e
-
-    def fetch_one(self, query: str, params: tuple = ()):
+
+    async def _run(self, work: Callable[[asyncpg.Connection], Awaitable[Any]], transaction: bool = True):
+        """Выполняет `work(connection)` (в транзакции), переподключаясь при потере соединения."""
+        for attempt in range(DB_RECONNECT_ATTEMPTS + 1):
+            try:
+                async with self.pool.acquire() as connection:
+                    if not transaction:
+                        return await work(connection)
+
+                    tx = connection.transaction()
+                    await tx.start()
+                    try:
+                        result = await work(connection)
+                    except BaseException:
+                        try:
+                            await tx.rollback()
+                        except CONNECTION_ERRORS:
+                            pass
+                        raise
+                    try:
+                        await tx.commit()
+                    except CONNECTION_ERRORS as e:
+                        raise CommitError(f"Commit failed: {e}") from e
+                    return result
+            except CONNECTION_ERRORS as e:
+                if attempt == DB_RECONNECT_ATTEMPTS:
+                    raise
+                logger.warning(f"Database connection lost ({e!r}), reconnecting")
+                await asyncio.sleep(DB_RECONNECT_BACKOFF * 2 ** attempt)
+
+    async def fetch_one(self, query: str, *params) -> dict | None:
         """Выполняет SQL-запрос и возвращает одну запись."""
-        self.cursor.execute(query, params)
-        return self.cursor.fetchone()
+        row = await self._run(lambda connection: connection.fetchrow(query, *params), transaction=False)
+        return dict(row) if row else None
 
-    def user_exists(self, username: str, email: str) -> bool:
-        """Проверяет, существует ли пользователь с таким username или email."""
-        query = "SELECT user_id FROM users WHERE username = %s OR email = %s"
-        self.cursor.execute(query, (username, email))
-        return bool(self.cursor.fetchone())
+    async def fetch_all(self, query: str, *params) -> list[dict]:
+        """Выполняет SQL-запрос и возвращает все записи."""
+        rows = await self._run(lambda connection: connection.fetch(query, *params), transaction=False)
+        return [dict(row) for row in rows]
 
-    def add_user(self, user: User):
-        """Добавляет нового пользователя, если он не существует."""
-        if self.user_exists(user.username, user.email):
-            return False  # Пользователь уже существует
+    async def _execute(self, query: str, *params) -> str:
+        """Выполняет изменяющий SQL-запрос в транзакции, возвращает статус команды."""
+        return await self._run(lambda connection: connection.execute(query, *params))
 
+    async def add_user(self, user: User) -> bool:
+        """
+        Добавляет нового пользователя, если пользователя с таким username или email нет.
+        Проверка и вставка - один запрос: ON CONFLICT срабатывает на уникальных username и email.
+        """
         query = """
         INSERT INTO users (username, password_hash, first_name, last_name, email, phone_number, role)
-        VALUES (%s, %s, %s, %s, %s, %s, %s);
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT DO NOTHING
+        RETURNING user_id;
         """
-        self._execute(query, (user.username, user.password_hash, user.first_name, user.last_name, user.email, user.phone_number, user.role))
-        return True  # Пользователь успешно добавлен
+        user_id = await self._run(lambda connection: connection.fetchval(
+            query, user.username, user.password_hash, user.first_name, user.last_name, user.email, user.phone_number, user.role
+        ))
+        return user_id is not None
 
-    def verify_user_credentials(self, username: str, password_hash: str) -> dict | None:
+    async def verify_user_credentials(self, username: str, password_hash: str) -> dict | None:
         """Проверяет существование пользователя с данным логином и хэшем пароля."""
-        query = "SELECT username, email, role FROM users WHERE username = %s AND password_hash = %s"
-        return self.fetch_one(query, (username, password_hash))
+        query = "SELECT username, email, role FROM users WHERE username = $1 AND password_hash = $2"
+        return await self.fetch_one(query, username, password_hash)
 
-    def get_user_by_username(self, username: str):
+    async def get_user_by_username(self, username: str) -> dict | None:
         """Получает данные пользователя по его `username`"""
-        query = "SELECT user_id, username, first_name, last_name, email, phone_number, role FROM users WHERE username = %s;"
-        self.cursor.execute(query, (username,))
-        user = self.cursor.fetchone()
-        return user if user else None
-    
-    def get_tests_by_user(self, username: str, time_after: datetime):
+        query = "SELECT user_id, username, first_name, last_name, email, phone_number, role FROM users WHERE username = $1;"
+        return await self.fetch_one(query, username)
+
+    async def get_password_hash(self, username: str) -> str | None:
+        """Получает хэш пароля пользователя по его `username`"""
+        query = "SELECT password_hash FROM users WHERE username = $1"
+        return await self._run(lambda connection: connection.fetchval(query, username), transaction=False)
+
+    async def get_tests_by_user(self, username: str, time_after: datetime) -> list[dict] | None:
         """Получает данные о тестах, пройденных пользователем, по его `username` и за указанное время"""
-        query = "SELECT type_id, score, t.created_at, difficulty FROM tests t, users u WHERE u.user_id = t.user_id AND u.username = %s AND t.created_at > %s;"
-        self.cursor.execute(query, (username, time_after))
-        tests = self.cursor.fetchall()
-        return tests if tests else None        
-    
-    def update_user(self, username: str, user: User) -> bool:
-        """Обновляет данные пользователя, кроме пароля."""
-        fields = []
-        values = []
+        query = """
+        SELECT t.type_id, t.score, t.created_at, t.difficulty
+        FROM users u JOIN tests t ON t.user_id = u.user_id
+        WHERE u.username = $1 AND t.created_at > $2
+        ORDER BY t.created_at;
+        """
+        tests = await self.fetch_all(query, username, time_after)
+        return tests if tests else None
 
-        if user.first_name is not None:
-            fields.append("first_name = %s")
-            values.append(user.first_name)
+    async def get_daily_stats(self, username: str, since: date) -> list[dict]:
+        """
+        Дневные агрегаты результатов пользователя начиная с `since`: по одной записи
+        на день, тип теста и сложность. Читаются из test_daily_stats, поэтому время
+        ответа не зависит от числа пройденных тестов.
+        """
+        query = """
+        SELECT s.day, s.type_id, NULLIF(s.difficulty, '') AS difficulty, s.tests_count, s.score_sum,
+               s.score_sum::float / s.tests_count AS avg_score, s.score_min, s.score_max
+        FROM users u JOIN test_daily_stats s ON s.user_id = u.user_id
+        WHERE u.username = $1 AND s.day >= $2
+        ORDER BY s.day, s.type_id, s.difficulty;
+        """
+        return await self.fetch_all(query, username, since)
 
-        if user.last_name is not None:
-            fields.append("last_name = %s")
-            values.append(user.last_name)
+    async def get_stats_summary(self, username: str, since: date) -> list[dict]:
+        """Итоги пользователя по типам тестов начиная с `since` (из дневных агрегатов)."""
+        query = """
+        SELECT s.type_id, SUM(s.tests_count) AS tests_count, SUM(s.score_sum)::float / SUM(s.tests_count) AS avg_score,
+               MIN(s.score_min) AS score_min, MAX(s.score_max) AS score_max, MAX(s.day) AS last_day
+        FROM users u JOIN test_daily_stats s ON s.user_id = u.user_id
+        WHERE u.username = $1 AND s.day >= $2
+        GROUP BY s.type_id
+        ORDER BY s.type_id;
+        """
+        return await self.fetch_all(query, username, since)
 
-        if user.email is not None:
-            fields.append("email = %s")
-            values.append(user.email)
+    async def update_user(self, username: str, user: User) -> bool:
+        """Обновляет данные пользователя, кроме пароля."""
+        fields = []
+        values = []
 
-        if user.phone_number is not None:
-            fields.append("phone_number = %s")
-            values.append(user.phone_number)
+        for column in ("first_name", "last_name", "email", "phone_number"):
+            value = getattr(user, column)
+            if value is not None:
+                values.append(value)
+                fields.append(f"{column} = ${len(values)}")
 
         if not fields:
             return False  # Если нет данных для обновления
 
-        query = f"UPDATE users SET {', '.join(fields)} WHERE username = %s;"
         values.append(username)
+        query = f"UPDATE users SET {', '.join(fields)} WHERE username = ${len(values)};"
 
-        self._execute(query, tuple(values))
+        await self._execute(query, *values)
         return True  # Пользователь успешно обновлен
 
-    def update_password(self, username: str, new_password_hash: str):
-        query = "UPDATE users SET password_hash = %s WHERE username = %s"
-        self._execute(query, (new_password_hash, username))
+    async def update_password(self, username: str, new_password_hash: str) -> bool:
+        """Меняет хэш пароля, возвращает False, если пользователя нет."""
+        query = "UPDATE users SET password_hash = $1 WHERE username = $2"
+        return await self._execute(query, new_password_hash, username) != "UPDATE 0"
+
+    async def add_test(self, test: Test):
+        query = """
+        INSERT INTO tests (user_id, type_id, score, difficulty, idempotency_key) VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (idempotency_key) DO NOTHING;
+        """
+        await self._execute(query, test.user_id, test.type_id, test.score, test.difficulty, test.idempotency_key)
+
+    async def add_tests(self, tests: list[Test]) -> int:
+        """
+        Добавляет результаты пачкой в одной транзакции: COPY во временную таблицу
+        и один INSERT ... SELECT. Результаты с уже записанным ключом идемпотентности
+        пропускаются. Возвращает число добавленных записей.
+        """
+        records = [(test.user_id, test.type_id, test.score, test.difficulty, test.idempotency_key) for test in tests]
+
+        async def work(connection: asyncpg.Connection) -> int:
+            await connection.execute("""
+            CREATE TEMP TABLE tests_incoming (user_id INT, type_id INT, score INT, difficulty VARCHAR(20), idempotency_key UUID)
+            ON COMMIT DROP;
+            """)
+            await connection.copy_records_to_table("tests_incoming", records=records)
+            status = await connection.execute("""
+            INSERT INTO tests (user_id, type_id, score, difficulty, idempotency_key)
+            SELECT user_id, type_id, score, difficulty, idempotency_key FROM tests_incoming
+            ON CONFLICT (idempotency_key) DO NOTHING;
+            """)
+            return int(status.split()[-1])
+
+        return await self._run(work)
 
-    def add_test(self, test: Test):
-        query = "INSERT INTO tests (user_id, type_id, score, difficulty) VALUES (%s, %s, %s, %s);"
-        self._execute(query, (test.user_id, test.type_id, test.score, test.difficulty))
+    async def delete_user(self, user_id: int):
+        query = "DELETE FROM users WHERE user_id = $1;"
+        await self._execute(query, user_id)
 
-    def delete_user(self, user_id: int):
-        query = "DELETE FROM users WHERE user_id = %s;"
-        self._execute(query, (user_id,))
+    # Справочники: таблица -> запрос. Данные почти не меняются, поэтому держатся в памяти
+    REFERENCE_QUERIES = {
+        "test_categories": "SELECT category_id, category_name FROM test_categories ORDER BY category_id",
+        "test_types": "SELECT type_id, type_name, category_id FROM test_types ORDER BY type_id",
+    }
 
-    def get_all_test_categories(self) -> list[TestCategory]:
+    async def get_reference_data(self, name: str) -> ReferenceData:
+        """
+        Справочник `name` из кэша в памяти. По истечении REFERENCE_CACHE_TTL перечитывается
+        из БД одним запросом, даже если его ждут несколько обращений сразу.
+        """
+        cached = self._reference.get(name)
+        if cached is not None and cached.fresh():
+            return cached
+
+        lock = self._reference_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            cached = self._reference.get(name)
+            if cached is None or not cached.fresh():
+                cached = ReferenceData(await self.fetch_all(self.REFERENCE_QUERIES[name]), REFERENCE_CACHE_TTL)
+                self._reference[name] = cached
+            return cached
+
+    def invalidate_reference_data(self, name: str | None = None):
+        """Сбрасывает кэш справочника `name` (или всех), например после ручного изменения таблиц."""
+        if name is None:
+            self._reference.clear()
+        else:
+            self._reference.pop(name, None)
+
+    async def get_all_test_categories(self) -> list[TestCategory]:
         """Получает список всех категорий тестов"""
-        query = "SELECT * FROM test_categories"
-        self.cursor.execute(query)
-        categories = self.cursor.fetchall()
-        return [TestCategory(**category) for category in categories]
+        categories = await self.get_reference_data("test_categories")
+        return [TestCategory(**category) for category in categories.items]
 
-    def get_all_test_types(self) -> list[TestType]:
+    async def get_all_test_types(self) -> list[TestType]:
         """Получает список всех типов тестов"""
-        query = "SELECT * FROM test_types"
-        self.cursor.execute(query)
-        test_types = self.cursor.fetchall()
-        return [TestType(**test_type) for test_type in test_types]
-    
-    def close(self):
-        """Закрытие соединения с базой данных."""
-        self.cursor.close()
-        self.connection.close()
\ No newline at end of file
+        test_types = await self.get_reference_data("test_types")
+        return [TestType(**test_type) for test_type in test_types.items]
+
+    async def close(self):
+        """Закрытие всех соединений пула."""
+        if self.pool is not None:
+            await self.pool.close()
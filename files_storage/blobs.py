@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from os import getenv
+from pathlib import Path
+from typing import BinaryIO
+
+from streaming import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIRNAME = ".blobs"  # Внутри хранилища; каталоги пропускают скрытые имена
+BLOB_GC_INTERVAL = float(getenv("BLOB_GC_INTERVAL", 3600))  # Секунды между полными сборками мусора
+
+class BlobStore:
+    """
+    Контентно-адресуемое хранилище: содержимое лежит один раз в .blobs/ab/cd/<sha256>,
+    а файлы в папках - жёсткие ссылки на блоб. Одинаковые загрузки не занимают места повторно,
+    отдача (Range, sendfile) и каталоги работают с обычными путями.
+
+    Индекс sqlite хранит имя -> хэш (счётчик ссылок блоба - число имён) и следующий
+    свободный номер для каждого имени, поэтому уникальное имя выбирается за O(1).
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.blobs_dir = self.root / BLOBS_DIRNAME
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.blobs_dir / "index.db", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS names (
+                directory TEXT NOT NULL,
+                name TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (directory, name)
+            );
+            CREATE INDEX IF NOT EXISTS names_hash_idx ON names (hash);
+            CREATE TABLE IF NOT EXISTS name_counters (
+                directory TEXT NOT NULL,
+                name TEXT NOT NULL,
+                next INTEGER NOT NULL,
+                PRIMARY KEY (directory, name)
+            );
+        """)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs_dir / digest[:2] / digest[2:4] / digest
+
+    def _spool(self, source: BinaryIO) -> tuple[str, str]:
+        """Копирует содержимое кусками во временный файл, считая sha256 на лету: (хэш, временный файл)."""
+        digest = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=self.blobs_dir, prefix=".upload-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp:
+            while chunk := source.read(STREAM_CHUNK_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+        return digest.hexdigest(), tmp_name
+
+    def _link(self, blob_path: Path, file_path: Path, overwrite: bool) -> bool:
+        """Создаёт имя - жёсткую ссылку на блоб. Без overwrite не трогает существующий файл."""
+        if not overwrite:
+            try:
+                os.link(blob_path, file_path)
+                return True
+            except FileExistsError:
+                return False
+        tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        os.link(blob_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        return True
+
+    def _next_name(self, directory: str, filename: str) -> str:
+        """Следующее кандидатное имя (name_1.ext, name_2.ext, ...) по счётчику из индекса."""
+        row = self._db.execute(
+            "INSERT INTO name_counters (directory, name, next) VALUES (?, ?, 2) "
+            "ON CONFLICT (directory, name) DO UPDATE SET next = next + 1 RETURNING next - 1",
+            (directory, filename),
+        ).fetchone()
+        base_name, ext = os.path.splitext(filename)
+        return f"{base_name}_{row[0]}{ext}"
+
+    def save(self, source: BinaryIO, directory: str, filename: str, overwrite: bool) -> tuple[Path, str]:
+        """
+        Сохраняет загрузку под именем в папке.
+
+        :param overwrite: Заменить существующий файл, иначе взять свободное имя. Если под этим
+                          именем уже лежит то же содержимое, возвращается существующий файл.
+        :return: (путь к файлу, sha256 содержимого).
+        """
+        dir_path = self.root / directory
+        dir_path.mkdir(parents=True, exist_ok=True)
+        digest, tmp_name = self._spool(source)
+        try:
+            return self._publish(digest, tmp_name, directory, filename, overwrite)
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+
+    def _publish(self, digest: str, tmp_name: str, directory: str, filename: str, overwrite: bool) -> tuple[Path, str]:
+        dir_path = self.root / directory
+        blob_path = self.blob_path(digest)
+        # Блоб появляется и получает имя под одной блокировкой: сборщик мусора не увидит его без ссылок
+        with self._lock:
+            if not blob_path.exists():
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                os.chmod(tmp_name, 0o444)  # Блоб общий для всех имён: менять его на месте нельзя
+                os.replace(tmp_name, blob_path)
+
+            name = filename
+            while True:
+                file_path = dir_path / name
+                known = self._lookup(directory, name, file_path)
+                if known == digest:
+                    return file_path, digest
+                if self._link(blob_path, file_path, overwrite):
+                    break
+                # Имя занято другим содержимым (в том числе файлом, положенным мимо хранилища)
+                name = self._next_name(directory, filename)
+            self._db.execute(
+                "INSERT INTO names (directory, name, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (directory, name) DO UPDATE SET hash = excluded.hash",
+                (directory, name, digest),
+            )
+            if known is not None:
+                self._release(known)
+        return file_path, digest
+
+    def _is_linked(self, file_path: Path, digest: str) -> bool:
+        """Файл могли заменить или удалить в обход хранилища: имя действительно, пока это та же inode."""
+        try:
+            return os.stat(file_path).st_ino == os.stat(self.blob_path(digest)).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _lookup(self, directory: str, name: str, file_path: Path) -> str | None:
+        """Хэш имени из индекса; устаревшая запись удаляется вместе с освободившимся блобом."""
+        row = self._db.execute("SELECT hash FROM names WHERE directory = ? AND name = ?", (directory, name)).fetchone()
+        if row is None:
+            return None
+        if self._is_linked(file_path, row[0]):
+            return row[0]
+        self._db.execute("DELETE FROM names WHERE directory = ? AND name = ?", (directory, name))
+        self._release(row[0])
+        return None
+
+    def lookup(self, directory: str, name: str) -> str | None:
+        """sha256 файла, сохранённого через хранилище, или None (O(1): запрос по ключу и два stat)."""
+        with self._lock:
+            return self._lookup(directory, name, self.root / directory / name)
+
+    def delete(self, directory: str, name: str) -> bool:
+        """Удаляет имя; блоб удаляется вместе с последней ссылкой на него."""
+        file_path = self.root / directory / name
+        with self._lock:
+            digest = self._lookup(directory, name, file_path)
+            try:
+                file_path.unlink()
+            except FileNotFoundError:
+                return False
+            if digest is not None:
+                self._db.execute("DELETE FROM names WHERE directory = ? AND name = ?", (directory, name))
+                self._release(digest)
+        return True
+
+    def _release(self, digest: str) -> bool:
+        """Удаляет блоб, если на него не осталось имён ни в индексе, ни на диске."""
+        if self._db.execute("SELECT 1 FROM names WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+            return False
+        blob_path = self.blob_path(digest)
+        try:
+            if os.stat(blob_path).st_nlink == 1:
+                blob_path.unlink()
+                return True
+        except FileNotFoundError:
+            pass
+        return False
+
+    def gc(self) -> int:
+        """
+        Сверяет индекс с диском и удаляет блобы без ссылок
+        (например, если файлы удалили в обход хранилища).
+
+        :return: Число удалённых блобов.
+        """
+        with self._lock:
+            for directory, name, digest in self._db.execute("SELECT directory, name, hash FROM names").fetchall():
+                if not self._is_linked(self.root / directory / name, digest):
+                    self._db.execute("DELETE FROM names WHERE directory = ? AND name = ?", (directory, name))
+
+        removed = 0
+        for shard in self.blobs_dir.glob("??/??"):
+            for blob_path in shard.iterdir():
+                with self._lock:
+                    removed += self._release(blob_path.name)
+        return removed
+
+    def start(self, interval: float = BLOB_GC_INTERVAL):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._gc_loop, args=(interval,), name="blob-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _gc_loop(self, interval: float):
+        while True:
+            try:
+                removed = self.gc()
+                if removed:
+                    logger.info(f"Blob GC removed {removed} unreferenced blobs")
+            except Exception as e:
+                logger.warning(f"Blob GC failed: {e!r}")
+            if self._stop.wait(interval):
+                return
@@ -0,0 +1,322 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import wave
+from dataclasses import dataclass, field, asdict
+from os import getenv
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CATALOG_POLL_INTERVAL = float(getenv("CATALOG_POLL_INTERVAL", 10))  # Секунды между полными проверками каталогов
+# Время изменения папки хранится с точностью до тика ядра: изменения в пределах окна
+# могут не сдвинуть mtime, поэтому недавно изменённая папка перечитывается при каждом обращении
+CATALOG_RACY_WINDOW_NS = 2_000_000_000
+INDEX_FILENAME = ".catalog.json"  # Метаданные и хэши, сохранённые между перезапусками
+
+TAG_SEPARATORS = re.compile(r"[\W_]+")
+
+@dataclass
+class TrackInfo:
+    name: str
+    size: int
+    mtime_ns: int
+    duration: float | None = None
+    sample_rate: int | None = None
+    channels: int | None = None
+    sha256: str | None = None
+    tags: list[str] = field(default_factory=list)
+
+def name_tags(name: str) -> list[str]:
+    """Теги из имени файла: буквенные части имени без расширения (bass_guitar_01.wav -> bass, guitar)."""
+    stem = os.path.splitext(name)[0].lower()
+    return sorted({token for token in TAG_SEPARATORS.split(stem) if token and not token.isdigit()})
+
+def read_audio_info(path: Path) -> tuple[float | None, int | None, int | None]:
+    """Длительность, частота дискретизации и число каналов WAV-файла (для других форматов - None)."""
+    try:
+        with wave.open(str(path), "rb") as audio:
+            sample_rate = audio.getframerate()
+            return audio.getnframes() / sample_rate, sample_rate, audio.getnchannels()
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None, None, None
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IndexedSet:
+    """Множество со случайным выбором за O(1): элементы в списке, позиции в словаре, удаление обменом с последним."""
+
+    def __init__(self):
+        self.items: list[str] = []
+        self._positions: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item: str):
+        if item not in self._positions:
+            self._positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: str):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self._positions[last] = position
+
+class DirectoryCatalog:
+    """
+    Каталог файлов одной папки хранилища: имя, размер, время изменения, параметры аудио,
+    sha256 и теги.
+
+    Случайный файл выбирается за O(1), по префиксу - за O(log n) (бинарный поиск по
+    отсортированным именам), по тегу - за O(1). На запросе проверяется только mtime папки
+    (добавление и удаление файлов), полная сверка и вычисление метаданных идут в фоне.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._tracks: dict[str, TrackInfo] = {}
+        self._pool = IndexedSet()
+        self._sorted: list[str] = []
+        self._tags: dict[str, IndexedSet] = {}
+        self._dir_mtime_ns: int | None = None
+        self._index = self._load_index()
+
+    def _load_index(self) -> dict[str, TrackInfo]:
+        try:
+            with open(self.path / INDEX_FILENAME) as f:
+                return {item["name"]: TrackInfo(**item) for item in json.load(f)}
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def _save_index(self):
+        with self._lock:
+            items = [asdict(track) for track in self._tracks.values() if track.sha256 is not None]
+        tmp_path = self.path / f"{INDEX_FILENAME}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(items, f)
+            os.replace(tmp_path, self.path / INDEX_FILENAME)
+        except OSError as e:
+            logger.warning(f"Failed to save catalog index for {self.path}: {e}")
+
+    def _add(self, track: TrackInfo):
+        self._tracks[track.name] = track
+        self._pool.add(track.name)
+        bisect.insort(self._sorted, track.name)
+        for tag in track.tags:
+            self._tags.setdefault(tag, IndexedSet()).add(track.name)
+
+    def _remove(self, name: str):
+        track = self._tracks.pop(name, None)
+        if track is None:
+            return
+        self._pool.discard(name)
+        del self._sorted[bisect.bisect_left(self._sorted, name)]
+        for tag in track.tags:
+            tagged = self._tags.get(tag)
+            if tagged is not None:
+                tagged.discard(name)
+                if not tagged:
+                    del self._tags[tag]
+
+    def invalidate(self):
+        """Требует перечитать папку при следующем обращении (например, после загрузки файла)."""
+        self._dir_mtime_ns = None
+
+    def refresh(self, full: bool = False) -> bool:
+        """
+        Приводит каталог в соответствие с папкой.
+
+        :param full: Сверить размер и время изменения каждого файла (перезапись содержимого
+                     не меняет mtime папки), иначе папка перечитывается, только если она изменилась.
+        :return: False, если папки больше нет.
+        """
+        try:
+            dir_mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        racy = time.time_ns() - dir_mtime_ns < CATALOG_RACY_WINDOW_NS
+        if not full and not racy and dir_mtime_ns == self._dir_mtime_ns:
+            return True
+
+        found = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            for name in [name for name in self._tracks if name not in found]:
+                self._remove(name)
+            for name, (size, mtime_ns) in found.items():
+                track = self._tracks.get(name)
+                if track is not None and (track.size, track.mtime_ns) == (size, mtime_ns):
+                    continue
+                if track is not None:
+                    self._remove(name)
+                known = self._index.get(name)
+                if known is not None and (known.size, known.mtime_ns) == (size, mtime_ns):
+                    self._add(known)
+                else:
+                    self._add(TrackInfo(name=name, size=size, mtime_ns=mtime_ns, tags=name_tags(name)))
+            self._dir_mtime_ns = dir_mtime_ns
+        return True
+
+    def enrich(self):
+        """Дочитывает параметры аудио и sha256 новых файлов (в фоне: для больших файлов это дорого)."""
+        with self._lock:
+            pending = [track for track in self._tracks.values() if track.sha256 is None]
+        for track in pending:
+            path = self.path / track.name
+            try:
+                sha256 = file_sha256(path)
+            except OSError:
+                continue
+            duration, sample_rate, channels = read_audio_info(path)
+            with self._lock:
+                # Файл мог смениться, пока считался хэш: тогда метаданные посчитаются заново
+                if self._tracks.get(track.name) is track:
+                    track.duration, track.sample_rate, track.channels = duration, sample_rate, channels
+                    track.sha256 = sha256
+        if pending:
+            self._index = {}
+            self._save_index()
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._sorted)
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        """Диапазон имён с префиксом в отсортированном списке (бинарный поиск)."""
+        return bisect.bisect_left(self._sorted, prefix), bisect.bisect_left(self._sorted, prefix + "\U0010ffff")
+
+    def _candidates(self, prefix: str | None, tag: str | None) -> list[str]:
+        """Имена, подходящие под префикс и тег; без фильтров - пул случайного выбора."""
+        if prefix:
+            start, end = self._prefix_range(prefix)
+            names = self._sorted[start:end]
+            return [name for name in names if tag in self._tracks[name].tags] if tag else names
+        if tag:
+            tagged = self._tags.get(tag)
+            return tagged.items if tagged is not None else []
+        return self._pool.items
+
+    def sample(self, count: int = 1, prefix: str | None = None, tag: str | None = None) -> list[TrackInfo]:
+        """До `count` разных случайных файлов; без префикса выбор не зависит от числа файлов в папке."""
+        with self._lock:
+            if prefix and not tag:
+                # Индексы из диапазона без копирования списка имён
+                start, end = self._prefix_range(prefix)
+                indices = random.sample(range(start, end), min(count, end - start))
+                return [self._tracks[self._sorted[index]] for index in indices]
+            names = self._candidates(prefix, tag)
+            return [self._tracks[name] for name in random.sample(names, min(count, len(names)))]
+
+    def random(self, prefix: str | None = None, tag: str | None = None) -> TrackInfo | None:
+        tracks = self.sample(1, prefix, tag)
+        return tracks[0] if tracks else None
+
+    def page(self, prefix: str | None = None, tag: str | None = None, offset: int = 0, limit: int = 100) -> tuple[int, list[TrackInfo]]:
+        """Страница файлов в порядке имён: (всего подходящих, файлы страницы)."""
+        with self._lock:
+            if tag and not prefix:
+                names = sorted(self._candidates(None, tag))
+            elif prefix or tag:
+                names = self._candidates(prefix, tag)
+            else:
+                names = self._sorted
+            return len(names), [self._tracks[name] for name in names[offset:offset + limit]]
+
+class TrackCatalogs:
+    """Каталоги папок хранилища: создаются при первом обращении, фоновый поток сверяет их с диском."""
+
+    def __init__(self, root: str, poll_interval: float = CATALOG_POLL_INTERVAL):
+        self.root = Path(root).resolve()
+        self.poll_interval = poll_interval
+        self._catalogs: dict[Path, DirectoryCatalog] = {}
+        self._paths: dict[str, Path] = {}  # Имя папки из запроса -> путь без "..", разрешается один раз
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def get(self, directory: str) -> DirectoryCatalog | None:
+        """Каталог папки `directory` (актуальный на момент вызова) или None, если папки нет."""
+        path = self._paths.get(directory)
+        if path is None:
+            path = (self.root / directory).resolve()
+            if not path.is_relative_to(self.root):
+                return None
+        with self._lock:
+            catalog = self._catalogs.get(path)
+            if catalog is None:
+                if not path.is_dir():
+                    return None
+                catalog = self._catalogs[path] = DirectoryCatalog(path)
+            # Запоминаем только существующие папки: имена приходят из запросов
+            self._paths[directory] = path
+        if not catalog.refresh():
+            with self._lock:
+                self._catalogs.pop(path, None)
+                self._paths.pop(directory, None)
+            return None
+        return catalog
+
+    def invalidate(self, directory: str):
+        with self._lock:
+            catalog = self._catalogs.get((self.root / directory).resolve())
+        if catalog is not None:
+            catalog.invalidate()
+
+    def start(self, preload: list[str]):
+        for directory in preload:
+            self.get(directory)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, name="track-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                catalogs = list(self._catalogs.items())
+            for path, catalog in catalogs:
+                try:
+                    if catalog.refresh(full=True):
+                        catalog.enrich()
+                    else:
+                        with self._lock:
+                            self._catalogs.pop(path, None)
+                except Exception as e:
+                    logger.warning(f"Catalog refresh failed for {path}: {e!r}")
+            if self._stop.wait(self.poll_interval):
+                return
@@ -1,113 +1,212 @@
-from fastapi import FastAPI, UploadFile, HTTPException, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from dataclasses import asdict
+from os import getenv
 from pathlib import Path
-import random
-import os
+
+from blobs import BlobStore
+from catalog import TrackCatalogs
+from streaming import TRACK_FRAMING, stream_tracks
+from utils.http_range import RangeFileResponse
+from track_store import TrackStore
 
 app = FastAPI()
 
 STORAGE_DIR = "fs"  # Базовая директория для файлового хранилища
 TESTING_TRACKS_DIR = "fs/testing_tracks"  # Директория для тестовых треков
+# Папки, в которых загрузка перезаписывает файл: аватары и их варианты размеров (avatar_variants/{username})
+OVERWRITE_DIRS = {"avatars", "avatar_variants"}
+# Треки из testing_tracks после загрузки предобрабатываются в fs/track_store (см. track_store.py)
+TRACK_STORE_AUTO_INGEST = getenv("TRACK_STORE_AUTO_INGEST", "1") == "1"
 
 # Создаём базовые директории, если их нет
 Path(STORAGE_DIR).mkdir(parents=True, exist_ok=True)
 Path(TESTING_TRACKS_DIR).mkdir(parents=True, exist_ok=True)
 
+# Каталоги папок вместо чтения директории на каждый запрос
+catalogs = TrackCatalogs(STORAGE_DIR)
+# Содержимое загрузок хранится один раз, файлы в папках - жёсткие ссылки на него
+blob_store = BlobStore(STORAGE_DIR)
+track_store = TrackStore()
+
+@app.on_event("startup")
+def start_catalogs():
+    catalogs.start(preload=["testing_tracks"])
+    blob_store.start()
+    if TRACK_STORE_AUTO_INGEST:
+        # Треки, добавленные или изменённые, пока сервис не работал
+        track_store.sync(Path(TESTING_TRACKS_DIR))
+
+@app.on_event("shutdown")
+def stop_catalogs():
+    catalogs.stop()
+    blob_store.stop()
+    track_store.shutdown()
+
+
+def check_path(directory: str, filename: str = ""):
+    """
+    Запрещает пути вне хранилища и скрытые имена (в том числе служебную папку блобов).
+    Вызывается во всех обработчиках, которые принимают папку или имя файла.
+    """
+    path = Path(directory, filename)
+    if path.is_absolute() or any(part.startswith(".") for part in path.parts):
+        raise HTTPException(status_code=400, detail="Invalid path")
 
 
 @app.post("/upload/")
 async def upload_file(directory: str, file: UploadFile):
     """
     Загружает файл в указанную директорию.
-    В папке avatars файл перезаписывается,
+    В папках OVERWRITE_DIRS (и их подпапках) файл перезаписывается,
     в других папках создается уникальное имя при необходимости.
+    Повторная загрузка того же содержимого под тем же именем возвращает существующий файл.
     """
-    dir_path = Path(STORAGE_DIR) / directory
-    dir_path.mkdir(parents=True, exist_ok=True)  # Создание директории, если отсутствует
-
-    file_path = dir_path / file.filename
-    base_name, ext = os.path.splitext(file.filename)
-    counter = 1
-
-    if directory == "avatars":
-        # В avatars всегда перезаписываем
-        pass
-    else:
-        # Генерация уникального имени файла
-        while file_path.exists():
-            file_path = dir_path / f"{base_name}_{counter}{ext}"
-            counter += 1
-
-    # Сохраняем файл
-    content = await file.read()
-    with file_path.open("wb") as f:
-        f.write(content)
-
-    return {"message": "File uploaded successfully", "path": str(file_path)}
-
+    check_path(directory, file.filename)
+    # Аватары всегда перезаписываем
+    overwrite = directory.split("/", 1)[0] in OVERWRITE_DIRS
+    file_path, sha256 = await run_in_threadpool(blob_store.save, file.file, directory, file.filename, overwrite)
+    catalogs.invalidate(directory)
+    if TRACK_STORE_AUTO_INGEST and directory == "testing_tracks":
+        track_store.submit(file_path)
+
+    return {"message": "File uploaded successfully", "path": str(file_path), "sha256": sha256}
+
+
+def file_response(request: Request, directory: str, file_path: Path) -> RangeFileResponse:
+    """Ответ с файлом; для файлов, сохранённых через хранилище блобов, ETag сильный - sha256 содержимого."""
+    sha256 = blob_store.lookup(directory, file_path.name)
+    return RangeFileResponse(
+        file_path,
+        range_header=request.headers.get("range"),
+        if_range=request.headers.get("if-range"),
+        if_none_match=request.headers.get("if-none-match"),
+        etag=f'"{sha256}"' if sha256 is not None else None,
+        filename=file_path.name,
+    )
 
 @app.get("/file/")
-def get_file(directory: str, filename: str):
+def get_file(request: Request, directory: str, filename: str):
     """
-    Отправляет конкретный файл из указанной директории.
+    Отправляет конкретный файл из указанной директории (поддерживается Range).
     """
+    check_path(directory, filename)
     file_path = Path(STORAGE_DIR) / directory / filename
-    if not file_path.exists():
+    if not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
+    return file_response(request, directory, file_path)
+
+
+@app.delete("/file/")
+def delete_file(directory: str, filename: str):
+    """
+    Удаляет файл из указанной директории; содержимое удаляется вместе с последним файлом, ссылающимся на него.
+    """
+    check_path(directory, filename)
+    if not blob_store.delete(directory, filename):
+        raise HTTPException(status_code=404, detail="File not found")
+    catalogs.invalidate(directory)
+    if directory == "testing_tracks":
+        track_store.remove(filename)
+    return {"message": "File deleted successfully"}
 
 
 @app.get("/random-file/")
-def get_random_file(directory: str):
+def get_random_file(
+    request: Request,
+    directory: str,
+    prefix: str = Query(None, description="Только файлы, имя которых начинается с префикса"),
+    tag: str = Query(None, description="Только файлы с тегом (часть имени, например 'bass')")
+):
     """
     Отправляет случайный файл из указанной директории.
     """
-    dir_path = Path(STORAGE_DIR) / directory
-    if not dir_path.exists() or not dir_path.is_dir():
+    check_path(directory)
+    catalog = catalogs.get(directory)
+    if catalog is None:
         raise HTTPException(status_code=404, detail="Directory not found")
 
-    files = list(dir_path.iterdir())
-    if not files:
+    track = catalog.random(prefix, tag)
+    if track is None:
+        raise HTTPException(status_code=404, detail="No files in directory")
+
+    try:
+        return file_response(request, directory, catalog.path / track.name)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="No files in directory")
 
-    random_file = random.choice(files)
-    return FileResponse(random_file, media_type="application/octet-stream", filename=random_file.name)
+@app.get("/list-files/")
+def list_files(directory: str):
+    """
+    Возвращает имена всех файлов в указанной директории.
+    """
+    check_path(directory)
+    catalog = catalogs.get(directory)
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    return {"files": catalog.names()}
+
+@app.get("/tracks/")
+def list_tracks(
+    directory: str = "testing_tracks",
+    prefix: str = Query(None, description="Префикс имени файла"),
+    tag: str = Query(None, description="Тег (часть имени, например 'bass')"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Страница каталога: файлы в порядке имён с размером, длительностью, частотой дискретизации,
+    числом каналов, sha256 и тегами (параметры аудио и хэш появляются после фоновой индексации).
+    """
+    check_path(directory)
+    catalog = catalogs.get(directory)
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    total, tracks = catalog.page(prefix, tag, offset, limit)
+    return {"total": total, "offset": offset, "tracks": [asdict(track) for track in tracks]}
+
+@app.get("/track-store/")
+def list_preprocessed_tracks():
+    """
+    Предобработанные треки с параметрами (длительность, RMS, пик, спектральный центроид).
+    Сжатая копия трека отдаётся через /file/?directory=track_store&filename={name}.flac.
+    """
+    return {"tracks": [asdict(track) for track in track_store.tracks()]}
 
 @app.get("/send-tracks/")
 def send_tracks(
     count: int = Query(1, ge=1, le=10),
-    filter: str = Query(None, description="Фильтр для названия файла (например, 'bass')")
+    filter: str = Query(None, description="Фильтр для названия файла (например, 'bass')"),
+    tag: str = Query(None, description="Тег (часть имени, например 'bass')")
 ):
     """
     Отправляет от 1 до 10 треков из папки `testing_tracks`.
     Если указан фильтр, выбираются только файлы, название которых начинается с указанного фильтра.
+    Треки идут одним потоком в формате X-Track-Framing (см. streaming.iter_tracks).
     """
     try:
-        # Получаем список всех файлов в папке
-        files = list(Path(TESTING_TRACKS_DIR).iterdir())
-        if not files:
+        catalog = catalogs.get("testing_tracks")
+        if catalog is None or len(catalog) == 0:
             raise HTTPException(status_code=404, detail="Треки не найдены.")
 
-        # Если указан фильтр, выбираем только файлы, начинающиеся с фильтра
-        if filter:
-            files = [file for file in files if file.name.startswith(filter)]
-            if not files:
+        # Случайные файлы из каталога; по префиксу - бинарным поиском по отсортированным именам.
+        # Если файлов меньше, чем запрашивается, возвращаются все
+        selected_files = [catalog.path / track.name for track in catalog.sample(count, filter, tag)]
+        if not selected_files:
+            if filter:
                 raise HTTPException(status_code=404, detail=f"Треки, начинающиеся с '{filter}', не найдены.")
-
-        # Если файлов меньше, чем запрашивается, возвращаем их все
-        count = min(count, len(files))
-
-        # Выбираем случайные файлы
-        selected_files = random.sample(files, count)
-
-        # Создаём поток для передачи нескольких файлов
-        def file_stream():
-            for file in selected_files:
-                yield file.read_bytes()
-
-        # Возвращаем поток как ответ
-        return StreamingResponse(file_stream(), media_type="application/octet-stream")
+            raise HTTPException(status_code=404, detail=f"Треки с тегом '{tag}' не найдены.")
+
+        # Возвращаем треки потоком: у каждого заголовок с именем и длиной, содержимое читается кусками
+        return StreamingResponse(
+            stream_tracks(selected_files),
+            media_type="application/octet-stream",
+            headers={"X-Track-Framing": TRACK_FRAMING, "X-Track-Count": str(len(selected_files))},
+        )
 
     except HTTPException as http_exc:
         # Обрабатываем исключения HTTP с кодами ошибок, например, 404
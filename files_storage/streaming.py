@@ -0,0 +1,45 @@
+import os
+import struct
+from os import getenv
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+STREAM_CHUNK_SIZE = int(getenv("STREAM_CHUNK_SIZE", 256 * 1024))  # Байт на чтение/запись
+
+# Несколько треков в одном ответе: для каждого заголовок (длина имени, имя в UTF-8,
+# длина содержимого), затем содержимое. Клиент читает поток последовательно и разбирает его
+# через iter_tracks, не держа треки в памяти целиком
+TRACK_FRAMING = "length-prefixed-v1"
+_NAME_LENGTH = struct.Struct(">H")
+_CONTENT_LENGTH = struct.Struct(">Q")
+
+def stream_tracks(paths: list[Path]) -> Iterator[bytes]:
+    """
+    Поток нескольких файлов в формате TRACK_FRAMING. Каждый файл открывается и измеряется
+    перед отправкой, содержимое читается кусками.
+    """
+    for path in paths:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            continue  # Файл удалили после выбора
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            name = path.name.encode()
+            yield _NAME_LENGTH.pack(len(name)) + name + _CONTENT_LENGTH.pack(size)
+            remaining = size
+            while remaining > 0:
+                chunk = file.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    # Заголовок уже отправлен: добиваем нулями, чтобы не сломать разбор следующих треков
+                    chunk = bytes(min(STREAM_CHUNK_SIZE, remaining))
+                remaining -= len(chunk)
+                yield chunk
+
+def iter_tracks(stream: BinaryIO) -> Iterator[tuple[str, bytes]]:
+    """Разбирает поток TRACK_FRAMING (ответ /send-tracks/) на пары (имя файла, содержимое)."""
+    while header := stream.read(_NAME_LENGTH.size):
+        (name_length,) = _NAME_LENGTH.unpack(header)
+        name = stream.read(name_length).decode()
+        (size,) = _CONTENT_LENGTH.unpack(stream.read(_CONTENT_LENGTH.size))
+        yield name, stream.read(size)
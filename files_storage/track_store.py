@@ -0,0 +1,276 @@
+"""
+Предобработка треков: нормализация громкости, обрезка, fade in/out и приведение к единому
+формату (44.1 кГц, стерео). Каждый трек сохраняется в хранилище треков в двух видах:
+
+- `{name}.npy` - сэмплы float32 формы (кадры, 2), открываются через memmap без декодирования;
+- `{name}.flac` - сжатая копия для отдачи клиентам.
+
+Параметры трека (длительность, RMS, пик, спектральный центроид) лежат в index.json.
+
+Запуск из командной строки (обработка идёт параллельно в пуле процессов):
+    python track_store.py fs/testing_tracks --workers 4
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+logger = logging.getLogger(__name__)
+
+TRACK_STORE_DIR = getenv("TRACK_STORE_DIR", "fs/track_store")
+TRACK_STORE_WORKERS = int(getenv("TRACK_STORE_WORKERS", max((os.cpu_count() or 1) // 2, 1)))
+INDEX_FILENAME = "index.json"
+AUDIO_EXTENSIONS = {".wav", ".flac", ".ogg", ".aiff", ".aif"}
+MIN_DBFS = -120.0  # Уровень тишины: -inf не сериализуется в JSON
+
+@dataclass(frozen=True)
+class PipelineSettings:
+    """Параметры предобработки; при их изменении треки обрабатываются заново."""
+    sample_rate: int = 44100
+    channels: int = 2
+    target_dBFS: float = -14.0
+    duration: float = 15.0  # Секунды
+    fade: float = 0.5  # Секунды fade in и fade out
+    delivery_subtype: str = "PCM_16"  # Формат сэмплов сжатой копии (FLAC)
+
+@dataclass
+class TrackFeatures:
+    name: str
+    source_size: int
+    source_mtime_ns: int
+    settings: dict = field(default_factory=dict)
+    frames: int = 0
+    sample_rate: int = 0
+    channels: int = 0
+    duration: float = 0.0
+    rms_dBFS: float = 0.0
+    peak_dBFS: float = 0.0
+    spectral_centroid: float = 0.0  # Гц
+
+def to_dBFS(value: float) -> float:
+    return max(20 * math.log10(value), MIN_DBFS) if value > 0 else MIN_DBFS
+
+def preprocess(samples: np.ndarray, frame_rate: int, settings: PipelineSettings) -> np.ndarray:
+    """
+    Приводит сэмплы float32 формы (кадры, каналы) к формату хранилища: число каналов,
+    частота дискретизации, громкость target_dBFS (RMS всего трека), длительность и fade.
+    """
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, settings.channels, axis=1)
+    elif samples.shape[1] > settings.channels:
+        samples = samples[:, :settings.channels]
+
+    if frame_rate != settings.sample_rate:
+        divisor = math.gcd(settings.sample_rate, frame_rate)
+        samples = resample_poly(samples, settings.sample_rate // divisor, frame_rate // divisor, axis=0)
+
+    # Громкость считается по всему треку до обрезки - как при ручной подготовке треков
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    if rms > 0:
+        samples = samples * np.float32(10 ** ((settings.target_dBFS - to_dBFS(rms)) / 20))
+
+    samples = np.clip(samples[:round(settings.duration * settings.sample_rate)], -1, 1).astype(np.float32)
+
+    fade_frames = min(round(settings.fade * settings.sample_rate), len(samples) // 2)
+    if fade_frames:
+        ramp = np.linspace(0, 1, fade_frames, dtype=np.float32)[:, None]
+        samples[:fade_frames] *= ramp
+        samples[-fade_frames:] *= ramp[::-1]
+    return samples
+
+def analyze(samples: np.ndarray, frame_rate: int) -> dict:
+    """RMS и пик (дБ относительно полной шкалы) и спектральный центроид моно-сигнала."""
+    mono = samples.mean(axis=1, dtype=np.float64)
+    spectrum = np.abs(np.fft.rfft(mono))
+    total = spectrum.sum()
+    centroid = float((np.fft.rfftfreq(len(mono), 1 / frame_rate) * spectrum).sum() / total) if total > 0 else 0.0
+    return {
+        "rms_dBFS": to_dBFS(float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))),
+        "peak_dBFS": to_dBFS(float(np.abs(samples).max(initial=0))),
+        "spectral_centroid": centroid,
+    }
+
+def samples_path(store_dir: Path, name: str) -> Path:
+    return store_dir / f"{name}.npy"
+
+def delivery_path(store_dir: Path, name: str) -> Path:
+    return store_dir / f"{name}.flac"
+
+def ingest_track(source: str, store_dir: str, settings: PipelineSettings) -> TrackFeatures:
+    """
+    Обрабатывает один трек и записывает его в хранилище (выполняется в процессе пула).
+    Файлы появляются под итоговыми именами целиком, поэтому читатели не видят недописанных треков.
+    """
+    source_path, store_path = Path(source), Path(store_dir)
+    stat = os.stat(source_path)
+    with sf.SoundFile(source_path) as audio_file:
+        samples = audio_file.read(dtype="float32", always_2d=True)
+        samples = preprocess(samples, audio_file.samplerate, settings)
+
+    name = source_path.name
+    tmp_samples = store_path / f".{name}.npy.tmp"
+    tmp_delivery = store_path / f".{name}.flac.tmp"
+    with open(tmp_samples, "wb") as f:
+        np.save(f, samples)
+    sf.write(tmp_delivery, samples, settings.sample_rate, subtype=settings.delivery_subtype, format="FLAC")
+    os.replace(tmp_samples, samples_path(store_path, name))
+    os.replace(tmp_delivery, delivery_path(store_path, name))
+
+    return TrackFeatures(
+        name=name,
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+        settings=asdict(settings),
+        frames=len(samples),
+        sample_rate=settings.sample_rate,
+        channels=samples.shape[1],
+        duration=len(samples) / settings.sample_rate,
+        **analyze(samples, settings.sample_rate),
+    )
+
+class TrackStore:
+    """
+    Хранилище предобработанных треков. Обработка идёт в пуле процессов (spawn: в file-api
+    уже работают потоки каталогов), индекс пишет только этот процесс.
+    """
+
+    def __init__(self, directory: str = TRACK_STORE_DIR, workers: int = TRACK_STORE_WORKERS,
+                 settings: PipelineSettings = PipelineSettings()):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()  # Запись index.json
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: dict[str, Future] = {}
+        self._tracks = self._load_index()
+
+    def _load_index(self) -> dict[str, TrackFeatures]:
+        try:
+            with open(self.directory / INDEX_FILENAME) as f:
+                return {item["name"]: TrackFeatures(**item) for item in json.load(f)}
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def _save_index(self):
+        with self._index_lock:
+            items = [asdict(track) for track in self.tracks()]
+            tmp_path = self.directory / f".{INDEX_FILENAME}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(items, f)
+            os.replace(tmp_path, self.directory / INDEX_FILENAME)
+
+    def tracks(self) -> list[TrackFeatures]:
+        with self._lock:
+            return sorted(self._tracks.values(), key=lambda track: track.name)
+
+    def get(self, name: str) -> TrackFeatures | None:
+        with self._lock:
+            return self._tracks.get(name)
+
+    def is_current(self, source: Path) -> bool:
+        """Трек уже обработан из этого же файла с текущими параметрами."""
+        track = self.get(source.name)
+        if track is None or track.settings != asdict(self.settings):
+            return False
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            return False
+        return (track.source_size, track.source_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+    def submit(self, source: Path) -> Future | None:
+        """Ставит трек в очередь обработки; None, если он уже обработан или в очереди."""
+        if self.is_current(source):
+            return None
+        with self._lock:
+            pending = self._pending.get(source.name)
+            if pending is not None and not pending.done():
+                return None
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            future = self._pool.submit(ingest_track, str(source), str(self.directory), self.settings)
+            self._pending[source.name] = future
+        future.add_done_callback(lambda done: self._finish(source, done))
+        return future
+
+    def _finish(self, source: Path, future: Future):
+        name = source.name
+        with self._lock:
+            if self._pending.get(name) is not future:
+                return  # Трек удалили, пока он обрабатывался
+            del self._pending[name]
+            if not future.cancelled() and future.exception() is None:
+                self._tracks[name] = future.result()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning(f"Track preprocessing failed for {name}: {future.exception()!r}")
+            return
+        self._save_index()
+        logger.info(f"Track {name} is preprocessed")
+        # Файл могли перезаписать во время обработки: тогда обрабатываем новую версию
+        self.submit(source)
+
+    def remove(self, name: str):
+        with self._lock:
+            pending = self._pending.pop(name, None)
+            removed = self._tracks.pop(name, None)
+        if pending is not None:
+            pending.cancel()
+        for path in (samples_path(self.directory, name), delivery_path(self.directory, name)):
+            path.unlink(missing_ok=True)
+        if removed is not None:
+            self._save_index()
+
+    def sync(self, source_dir: Path) -> list[Future]:
+        """Ставит в очередь новые и изменённые треки папки, убирает треки удалённых файлов."""
+        sources = {path.name: path for path in source_dir.iterdir()
+                   if path.suffix.lower() in AUDIO_EXTENSIONS and not path.name.startswith(".")}
+        for name in [track.name for track in self.tracks() if track.name not in sources]:
+            self.remove(name)
+        return [future for future in map(self.submit, sources.values()) if future is not None]
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=not wait)
+
+def main():
+    parser = argparse.ArgumentParser(description="Предобработка треков в хранилище треков")
+    parser.add_argument("sources", nargs="+", type=Path, help="Аудиофайлы или папки с ними")
+    parser.add_argument("--store", default=TRACK_STORE_DIR, help="Папка хранилища треков")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--target-dbfs", type=float, default=PipelineSettings.target_dBFS)
+    parser.add_argument("--duration", type=float, default=PipelineSettings.duration, help="Секунды")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    store = TrackStore(args.store, args.workers, PipelineSettings(target_dBFS=args.target_dbfs, duration=args.duration))
+    futures = []
+    for source in args.sources:
+        if source.is_dir():
+            futures += store.sync(source)
+        else:
+            futures.append(store.submit(source))
+    futures = [future for future in futures if future is not None]
+
+    failed = sum(future.exception() is not None for future in as_completed(futures))
+    store.shutdown(wait=True)
+    print(f"Обработано треков: {len(futures) - failed}, ошибок: {failed}, всего в хранилище: {len(store.tracks())}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from os import getenv
+import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
@@ -8,7 +9,14 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from jose import JWTError, ExpiredSignatureError, jwt
 import logging
 
-from routes.session import SECRET_KEY, ALGORITHM
+from routes.session import SECRET_KEY, ALGORITHM, get_current_user
+from utils.dsp_executor import dsp_executor
+from utils.api_clients import start_api_clients, close_api_clients
+from utils.result_buffer import result_buffer
+from routes.timbre_tests import warm_effects_cache
+from utils.render_cache import render_cache
+from utils.audio_links import audio_links
+from routes.harmonic_tests import prepare_harmonic_audio, harmonic_metrics
 
 # Настройка логгера
 logging.basicConfig(level=logging.INFO)
@@ -54,15 +62,40 @@ class RedirectOnAuthErrorMiddleware(BaseHTTPMiddleware):
 
         return response
 
+RENDER_CACHE_WARM = getenv("RENDER_CACHE_WARM", "0") == "1"
+SAMPLE_BANK_PREPARE = getenv("SAMPLE_BANK_PREPARE", "1") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Пул процессов для обработки аудио и пулы соединений с db-api/file-api живут всё время работы приложения
+    dsp_executor.start()
+    start_api_clients()
+    # Временные рендеры прошлого запуска: ссылки на них потеряны вместе с памятью процесса
+    render_cache.clear_temporary()
+    result_buffer.start()
+    audio_links.start()
+    warm_task = asyncio.create_task(warm_effects_cache()) if RENDER_CACHE_WARM else None
+    # Банк нот собирается в фоне (один раз, дальше лежит в кэше); до готовности ноты синтезируются
+    harmonic_task = asyncio.create_task(prepare_harmonic_audio()) if SAMPLE_BANK_PREPARE else None
+    yield
+    audio_links.stop()
+    for task in (warm_task, harmonic_task):
+        if task is not None:
+            task.cancel()
+    # Последний сброс результатов, пока соединение с db-api ещё открыто
+    await result_buffer.stop()
+    await close_api_clients()
+    dsp_executor.shutdown()
+
 # Создаем FastAPI приложение
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Добавляем middleware
 app.add_middleware(SessionMiddleware, secret_key=getenv("SECRET_KEY", "super"))
 app.add_middleware(RedirectOnAuthErrorMiddleware)
 
 # Подключаем маршруты
-from routes import home, auth, profile, timbre_tests, harmonic_tests, rhythm_tests, select_mode, references, stats
+from routes import home, auth, profile, timbre_tests, harmonic_tests, rhythm_tests, select_mode, references, stats, audio
 app.include_router(home.router)
 app.include_router(auth.router)
 app.include_router(profile.router)
@@ -72,6 +105,17 @@ app.include_router(rhythm_tests.router)
 app.include_router(select_mode.router)
 app.include_router(references.router)
 app.include_router(stats.router)
+app.include_router(audio.router)
 
 # Подключаем статику (CSS, JS)
-app.mount('/static', StaticFiles(directory='static'), 'static')
\ No newline at end of file
+app.mount('/static', StaticFiles(directory='static'), 'static')
+
+@app.get("/dsp/metrics")
+async def dsp_metrics(username: str = Depends(get_current_user)):
+    """Состояние пула обработки аудио: очередь, время ожидания и вычислений."""
+    return dsp_executor.stats()
+
+@app.get("/render-cache/metrics")
+async def render_cache_metrics(username: str = Depends(get_current_user)):
+    """Попадания в кэш рендеров (память/диск) и в кэш аудио гармонических тестов."""
+    return {**render_cache.stats(), "harmonic": harmonic_metrics.snapshot()}
@@ -0,0 +1,82 @@
+import asyncio
+from pathlib import Path
+from fastapi import APIRouter, Request, Depends, HTTPException, Response
+from starlette.concurrency import run_in_threadpool
+
+from utils.audio_buffer import AUDIO_FORMATS, transcode
+from utils.audio_links import audio_links, variant_key, AUDIO_LINK_TTL
+from utils.dsp_executor import dsp_executor
+from utils.http_range import RangeFileResponse
+from utils.render_cache import render_cache
+from routes.session import get_current_user
+
+router = APIRouter()
+
+# Перекодирования в процессе: параллельные запросы одного файла ждут одну задачу
+_transcoding: dict[str, asyncio.Task] = {}
+
+async def get_audio_variant(key: str, audio_format: str) -> Path | None:
+    """Файл аудио в нужном формате: перекодируется один раз и сохраняется в кэше рендеров."""
+    cache_key = variant_key(key, audio_format)
+    path = await run_in_threadpool(render_cache.path, cache_key)
+    if path is not None:
+        return path
+
+    wav_bytes = await run_in_threadpool(render_cache.get, key)
+    if wav_bytes is None:
+        return None
+
+    async def transcode_and_store() -> bytes:
+        try:
+            data = await dsp_executor.run(transcode, wav_bytes, audio_format)
+            # Перекодированная версия временного рендера тоже временная
+            temporary = await run_in_threadpool(render_cache.is_temporary, key)
+            await run_in_threadpool(render_cache.put, cache_key, data, temporary)
+            return data
+        finally:
+            _transcoding.pop(cache_key, None)
+
+    if cache_key not in _transcoding:
+        _transcoding[cache_key] = asyncio.create_task(transcode_and_store())
+    await asyncio.shield(_transcoding[cache_key])
+    return await run_in_threadpool(render_cache.path, cache_key)
+
+@router.get("/audio/{audio_id}")
+async def get_audio(request: Request, audio_id: str, format: str = "wav", username: str = Depends(get_current_user)):
+    """
+    Аудио испытания по id из ответа /generate-test/*. Поддерживает Range (перемотка
+    в <audio>), ETag/If-None-Match и форматы wav, flac, opus.
+    """
+    if format not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    key = audio_links.resolve(audio_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    # Содержимое по id никогда не меняется, поэтому ETag строится из id и формата
+    etag = f'"{audio_id}-{format}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={int(AUDIO_LINK_TTL)}, immutable",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    path = await get_audio_variant(key, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    # Отдаём файл кэша: для Range читаются только запрошенные байты, а не весь рендер
+    try:
+        return await run_in_threadpool(
+            RangeFileResponse, path,
+            media_type=AUDIO_FORMATS[format][0],
+            range_header=request.headers.get("range"),
+            if_range=request.headers.get("if-range"),
+            etag=etag,
+            headers=headers,
+        )
+    except FileNotFoundError:
+        # Запись вытеснили из кэша между поиском и открытием
+        raise HTTPException(status_code=404, detail="Audio not found")
@@ -6,12 +6,11 @@ from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi_login import LoginManager
 from datetime import datetime, timedelta
 import bcrypt
-import httpx
+from starlette.concurrency import run_in_threadpool
 
 from routes.session import create_access_token
 from utils.mails import send_email, generate_code, store_code, verify_code
-
-DB_API_URL = getenv("DB_API_URL", "http://db-server:8000")
+from utils.api_clients import db_api
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -48,13 +47,11 @@ async def end_registration(
     if not await verify_code(username, verification_code):
         return JSONResponse({"detail": "Invalid or expired verification code"}, status_code=400)
         
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode()
+    # bcrypt намеренно медленный: считаем в потоке, чтобы не блокировать event loop
+    hashed_password = (await run_in_threadpool(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())).decode()
     user_data = {"username": username, "password_hash": hashed_password, "email": email}
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{DB_API_URL}/users/register", json=user_data)
-
-    if response.status_code == 200:
+    if await db_api.register_user(user_data):
         return RedirectResponse(url="/login", status_code=303)
     return templates.TemplateResponse("register.html", {"request": request, "error": "Ошибка регистрации"})
 
@@ -68,18 +65,16 @@ async def login(
     username: str = Form(...),
     password: str = Form(...)):
     # Параметры пользователя
-    db_response = httpx.get(f"{DB_API_URL}/users/get_password_hash/{username}")
-
-    if db_response.status_code != 200:
-        return JSONResponse({"detail": "Invalid credentials"}, status_code=400)
-
-    password_hash = db_response.json().get("password_hash")
+    password_hash = await db_api.get_password_hash(username)
     
-    if not password_hash or not bcrypt.checkpw(password.encode(), password_hash.encode()):
+    if not password_hash or not await run_in_threadpool(bcrypt.checkpw, password.encode(), password_hash.encode()):
         return JSONResponse({"detail": "Invalid credentials"}, status_code=400)
 
-    # Генерация токена
-    access_token = create_access_token(data={"sub": username})
+    # Генерация токена: id и роль пользователя хранятся в нём, чтобы не запрашивать их у db-api
+    user = await db_api.get_user(username)
+    if user is None:
+        return JSONResponse({"detail": "Invalid credentials"}, status_code=400)
+    access_token = create_access_token(data={"sub": username, "uid": user["user_id"], "role": user.get("role")})
     response = RedirectResponse(url="/profile", status_code=303)
     response.set_cookie("auth", access_token, httponly=True, secure=False, samesite="Lax")
 
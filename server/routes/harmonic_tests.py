@@ -1,71 +1,155 @@
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, Response, Body
 from fastapi.templating import Jinja2Templates
-import httpx
-import base64
-
-from utils.harmonic_processor import get_notes_wav, get_chords_wav
-from utils.structures import Chord, Note, generate_chord_progression, generate_random_interval
-from utils.user_id import get_user_id, DB_API_URL
+import asyncio
+import logging
+import time
+from os import getenv
+from starlette.concurrency import run_in_threadpool
+
+from utils.harmonic_processor import notes_events, chords_events, render_wav, prepare_sample_bank, sample_bank
+from utils.structures import Chord, Note, all_intervals, generate_chord_progression, generate_random_interval
+from utils.result_buffer import result_buffer
+from utils.user_id import get_user_id
 from utils.mongo import get_user_difficulty
-from routes.session import get_current_user
+from utils.render_cache import render_cache, make_key
+from utils.challenge_batch import Challenge, challenge_batches, challenge_response
+from routes.session import get_current_user, get_current_user_id
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
+logger = logging.getLogger(__name__)
+
+HARMONIC_CACHE_WARM = getenv("HARMONIC_CACHE_WARM", "0") == "1"  # Рендерить все интервалы при старте
+
+class HarmonicAudioMetrics:
+    """
+    Попадания в кэш аудио interval/chords, ожидания уже идущего рендера тех же нот
+    и время рендера при промахах.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+        self.render_total = 0.0
+
+    def snapshot(self) -> dict:
+        requests = self.hits + self.joined + self.misses
+        return {
+            "hits": self.hits,
+            "joined": self.joined,
+            "misses": self.misses,
+            # Доля запросов, обслуженных без собственного рендера
+            "hit_rate": (self.hits + self.joined) / requests if requests else 0.0,
+            "render_avg_ms": self.render_total / (self.misses or 1) * 1000,
+        }
+
+harmonic_metrics = HarmonicAudioMetrics()
+
+# Рендеры в процессе: одинаковые ноты, запрошенные одновременно, рендерятся один раз
+_rendering: dict[str, asyncio.Task] = {}
+
+def chord_count(difficulty: str) -> int:
+    return 3 if difficulty == 'easy' else 4 if difficulty == 'medium' else 5
+
+def notes_cache_key(events: list[tuple[int, float, float]], use_bank: bool) -> str:
+    """
+    Ключ аудио по каноническому набору нот (отсортированные MIDI-номер, начало, конец),
+    источнику рендера (банк нот или синтезатор) и версии банка: пространство интервалов
+    и прогрессий конечно, и одинаковые испытания делят один рендер. Рендеры синтезатором,
+    сделанные до готовности банка, не выдаются после неё под ключом банка.
+    """
+    return make_key("notes", sorted(events), "bank" if use_bank else "synth", sample_bank.version)
+
+async def notes_audio(events: list[tuple[int, float, float]]) -> str:
+    """
+    Возвращает ключ WAV с нотами в кэше рендеров, рендеря его при первом обращении.
+    Рендеры занимают место в общем бюджете диска кэша и вытесняются, если давно не нужны.
+    """
+    use_bank = sample_bank.covers(events)
+    key = notes_cache_key(events, use_bank)
+    if await run_in_threadpool(render_cache.contains, key):
+        harmonic_metrics.hits += 1
+        return key
+
+    async def render_and_store():
+        try:
+            started = time.perf_counter()
+            audio = await run_in_threadpool(render_wav, events, use_bank)
+            harmonic_metrics.render_total += time.perf_counter() - started
+            await run_in_threadpool(render_cache.put, key, audio)
+        finally:
+            _rendering.pop(key, None)
+
+    if key in _rendering:
+        harmonic_metrics.joined += 1
+    else:
+        harmonic_metrics.misses += 1
+        _rendering[key] = asyncio.create_task(render_and_store())
+    await asyncio.shield(_rendering[key])
+    return key
+
+async def prepare_harmonic_audio(warm: bool = HARMONIC_CACHE_WARM):
+    """
+    Фоновая подготовка при старте: банк нот, затем (если включено) рендер всех испытаний interval.
+    Прогрессии аккордов не прогреваются - их тысячи, они кэшируются по мере выдачи.
+    """
+    await run_in_threadpool(prepare_sample_bank)
+    if not warm:
+        return
+    try:
+        count = 0
+        for notes, _ in all_intervals():
+            await notes_audio(notes_events(notes))
+            count += 1
+        logger.info(f"Harmonic audio cache warmed: {count} intervals")
+    except Exception as e:
+        logger.warning(f"Harmonic audio warm-up failed: {e!r}")
+
+async def build_interval_challenge(difficulty: str) -> Challenge:
+    """Готовит испытание interval, аудио берёт из кэша рендеров или рендерит."""
+    notes, interval = generate_random_interval()
+    audio_key = await notes_audio(notes_events(notes))
+    return Challenge(
+        fields={"interval": interval},
+        audio={"interval_audio": audio_key},
+        test_data={"interval": interval},
+    )
+
+async def build_chords_challenge(difficulty: str) -> Challenge:
+    """Готовит испытание chords, аудио берёт из кэша рендеров или рендерит."""
+    chords, steps = generate_chord_progression(chord_count(difficulty))
+    audio_key = await notes_audio(chords_events(chords))
+    return Challenge(
+        fields={"steps": steps},
+        audio={"chords_audio": audio_key},
+        test_data={"steps": steps},
+    )
     
 async def do_generate_interval_test(request: Request, difficulty: str = "medium"):
-    """Общие действия для генерации тестов: bandpass-gain и bandstop."""
+    """Генерирует испытание interval (или отдаёт подготовленное пакетом)."""
     username = get_user_id(request)
+    prepared = await challenge_batches.take(username, "interval")
+    if prepared is None:
+        user_id = await get_current_user_id(request)
+        challenge = await build_interval_challenge(difficulty)
+        prepared = challenge_response(challenge, owned=True), {"user_id": user_id, **challenge.test_data}
 
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"]
-    
-    # Обрабатываем фильтр в зависимости от типа (bandpass или bandstop)
-    notes, interval = generate_random_interval()
-    interval_audio = get_notes_wav(notes)
-
-    interval_audio_base64 = base64.b64encode(interval_audio).decode('utf-8')
-    
-    request.session["test_data"] = {
-        "user_id": user_id,
-        "interval": interval
-    }
-    
-    return {
-        "interval_audio": interval_audio_base64,
-        "interval": interval
-    }
+    response, request.session["test_data"] = prepared
+    return response
 
 async def do_generate_chords_test(request: Request, difficulty: str = "medium"):
-    """Общие действия для генерации тестов: bandpass-gain и bandstop."""
+    """Генерирует испытание chords (или отдаёт подготовленное пакетом)."""
     username = get_user_id(request)
-    difficulty = await get_user_difficulty(username)
+    prepared = await challenge_batches.take(username, "chords")
+    if prepared is None:
+        difficulty = await get_user_difficulty(username)
+        user_id = await get_current_user_id(request)
+        challenge = await build_chords_challenge(difficulty)
+        prepared = challenge_response(challenge, owned=True), {"user_id": user_id, **challenge.test_data}
 
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"]
-    
-    # Обрабатываем фильтр в зависимости от типа (bandpass или bandstop)
-    chords, steps = generate_chord_progression(3 if difficulty=='easy' else 4 if difficulty=='medium' else 5)
-    chords_audio = get_chords_wav(chords)
-
-    chords_audio_base64 = base64.b64encode(chords_audio).decode('utf-8')
-    
-    request.session["test_data"] = {
-        "user_id": user_id,
-        "steps": steps
-    }
-    
-    return {
-        "chords_audio": chords_audio_base64,
-        "steps": steps
-    }
+    response, request.session["test_data"] = prepared
+    return response
 
 @router.get("/tests/interval")
 async def get_interval_test_page(request: Request, username: str = Depends(get_current_user)):
@@ -118,13 +202,7 @@ async def do_submit_interval_test(request: Request, selected_interval: int):
     elif difficulty == "easy":
         score *= 0.8
     
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": test_data["user_id"],
-            "type_id": 4,  # В зависимости от типа фильтра
-            "score": int(score),
-            "difficulty": difficulty
-        })
+    await result_buffer.add(test_data["user_id"], 4, int(score), difficulty)
     
     return {"score": int(score), "real_interval": real_interval, "selected_interval": selected_interval}
 
@@ -159,13 +237,7 @@ async def do_submit_chords_test(request: Request, selected_steps: list[int]):
     print(f"Real steps: {real_steps}, Selected steps: {selected_steps}, Correct: {correct_count}/{total_steps}, Score: {score}")
     
     # Отправляем результат в базу данных
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": test_data["user_id"],
-            "type_id": 5,  # В зависимости от типа фильтра
-            "score": int(score),
-            "difficulty": difficulty
-        })
+    await result_buffer.add(test_data["user_id"], 5, int(score), difficulty)
     
     # Возвращаем результат
     return {
@@ -5,14 +5,13 @@ from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse, JSONResponse, Response
 from fastapi_login import LoginManager
 from jose import JWTError, jwt
-import httpx
 import bcrypt
+from starlette.concurrency import run_in_threadpool
  
 from routes.session import *
 from utils.mails import send_email, generate_code, store_code, verify_code
-
-DB_API_URL = getenv("DB_API_URL", "http://db-api:8000")
-FILE_API_URL = getenv("FILE_API_URL", "http://file-api:8000")
+from utils.api_clients import db_api
+from utils.avatars import AVATAR_SIZES, avatars
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -32,14 +31,12 @@ async def profile(request: Request):
             raise JWTError
         
         # Запрос данных пользователя
-        user_response = httpx.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
+        user_data = await db_api.get_user(username)
+        if user_data is None:
             return JSONResponse({"detail": "User not found"}, status_code=404)
-        
-        user_data = user_response.json()
 
-        # Новый путь, через который FastAPI отдаст файл
-        avatar_url = f"/avatar/{username}"
+        # Версионированный URL (кэшируется браузером навсегда) или старый путь, если аватара нет
+        avatar_url = await avatars.current_url(username) or f"/avatar/{username}"
 
     except JWTError:
         return JSONResponse({"detail": "Unauthorized"}, status_code=401)
@@ -50,16 +47,43 @@ async def profile(request: Request):
         "avatar_url": avatar_url
     })
 
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 @router.get("/avatar/{username}")
 async def proxy_avatar(username: str):
-    """Проксирование запроса к файловому серверу."""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FILE_API_URL}/file/", params={"directory": "avatars", "filename": f"{username}.jpg"})
-    
-    if response.status_code != 200:
+    """Перенаправляет на URL текущей версии аватара."""
+    avatar_url = await avatars.current_url(username)
+    if avatar_url is None:
         raise HTTPException(status_code=404, detail="Avatar not found")
-    
-    return Response(content=response.content, media_type="image/jpeg")
+
+    return RedirectResponse(url=avatar_url, headers={"Cache-Control": "no-cache"})
+
+@router.get("/avatar/{username}/{version}/{size}.jpg")
+async def get_avatar(request: Request, username: str, version: str, size: int):
+    """
+    Вариант аватара заданной версии и размера. Содержимое по такому URL никогда не меняется,
+    поэтому повторные запросы обслуживаются из кэша браузера или ответом 304.
+    """
+    if size not in AVATAR_SIZES:
+        raise HTTPException(status_code=404, detail="Avatar size not found")
+
+    etag = avatars.etag(version, size)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": AVATAR_CACHE_CONTROL})
+
+    variant = await avatars.get(username, version, size)
+    if variant is None:
+        # Устаревшая версия: отправляем на актуальную
+        avatar_url = await avatars.current_url(username, size)
+        if avatar_url is None:
+            raise HTTPException(status_code=404, detail="Avatar not found")
+        return RedirectResponse(url=avatar_url, headers={"Cache-Control": "no-cache"})
+
+    return Response(content=variant.content, media_type="image/jpeg", headers={
+        "ETag": variant.etag,
+        "Last-Modified": variant.last_modified,
+        "Cache-Control": AVATAR_CACHE_CONTROL,
+    })
 
 @router.post("/update_profile")
 async def update_profile(
@@ -87,9 +111,7 @@ async def update_profile(
             "phone_number": phone_number
         }.items() if value is not None}
 
-        response = httpx.put(f"{DB_API_URL}/users/{username}", json=user_data)
-
-        if response.status_code == 200:
+        if await db_api.update_user(username, user_data):
             return {"message": "Profile updated successfully"}
         return JSONResponse({"detail": "Update failed"}, status_code=400)
 
@@ -110,11 +132,12 @@ async def upload_avatar(request: Request, file: UploadFile):
         if username is None:
             raise JWTError
 
-        files = {"file": (f"{username}.jpg", await file.read(), file.content_type)}
-        response = httpx.post(f"{FILE_API_URL}/upload/", params={"directory": "avatars"}, files=files)
-
-        if response.status_code == 200:
-            return {"message": "Avatar uploaded successfully"}
+        try:
+            version = await avatars.upload(username, await file.read(), file.content_type)
+        except ValueError:
+            return JSONResponse({"detail": "Invalid image"}, status_code=400)
+        if version is not None:
+            return {"message": "Avatar uploaded successfully", "avatar_url": avatars.url(username, version)}
         return JSONResponse({"detail": "Upload failed"}, status_code=400)
 
     except JWTError:
@@ -135,11 +158,11 @@ async def request_email_verification(request: Request):
             raise JWTError
 
         # Получение email пользователя
-        user_response = httpx.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
+        user_data = await db_api.get_user(username)
+        if user_data is None:
             return JSONResponse({"detail": "User not found"}, status_code=404)
 
-        email = user_response.json().get("email")
+        email = user_data.get("email")
         if not email:
             return JSONResponse({"detail": "Email not found"}, status_code=404)
 
@@ -181,12 +204,8 @@ async def confirm_change_password(
             return JSONResponse({"detail": "Invalid or expired verification code"}, status_code=400)
 
         # Отправка запроса на смену пароля в API БД
-        response = httpx.post(f"{DB_API_URL}/users/change_password", json={
-            "username": username,
-            "new_password": bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt()).decode()
-        })
-
-        if response.status_code == 200:
+        password_hash = (await run_in_threadpool(bcrypt.hashpw, new_password.encode("utf-8"), bcrypt.gensalt())).decode()
+        if await db_api.change_password(username, password_hash):
             return {"message": "Password changed successfully"}
         else:
             return JSONResponse({"detail": "Password change failed"}, status_code=400)
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, Response, Body
 from fastapi.templating import Jinja2Templates
-import httpx
 import base64
 import numpy as np
 
-from utils.user_id import get_user_id, DB_API_URL
+from utils.result_buffer import result_buffer
+from utils.user_id import get_user_id
 from utils.mongo import get_user_difficulty
-from routes.session import get_current_user
+from routes.session import get_current_user, get_current_user_id
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -38,20 +38,8 @@ async def submit_rhythm_test(request: Request, data: dict = Body(...), username:
     elif difficulty == "easy":
         score *= 0.8
 
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"]
-
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": user_id,
-            "type_id": 6,
-            "score": int(score),
-            "difficulty": difficulty
-        })  
+    user_id = await get_current_user_id(request)
+    await result_buffer.add(user_id, 6, int(score), difficulty)
 
     return {
         "score": int(score),
@@ -86,20 +74,8 @@ async def submit_bpm_test(request: Request, data: dict = Body(...), username: st
     elif difficulty == "easy":
         score *= 0.8
 
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"]
-
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": user_id,
-            "type_id": 7,
-            "score": int(score),
-            "difficulty": difficulty
-        })  
+    user_id = await get_current_user_id(request)
+    await result_buffer.add(user_id, 7, int(score), difficulty)
 
     return {
         "score": int(score),
@@ -2,8 +2,13 @@ from fastapi import APIRouter, Request, Depends, HTTPException, Form, Response,
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
 import random
+from functools import partial
 from utils.mongo import get_user_data, update_user_data, add_score, update_test_index
 from utils.user_id import get_user_id
+from utils.challenge_batch import challenge_batches
+from routes.session import get_current_user, get_current_user_id
+from routes.timbre_tests import build_eq_challenge, build_effects_challenge
+from routes.harmonic_tests import build_interval_challenge, build_chords_challenge
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -27,6 +32,15 @@ MODES = {
     "rhythm": {"rhythm": 3, "bpm": 3},
 }
 
+# Типы тестов, испытания которых готовит сервер: они генерируются пакетом при старте сессии
+CHALLENGE_BUILDERS = {
+    "bandpass-gain": partial(build_eq_challenge, filter_type=1),
+    "bandstop": partial(build_eq_challenge, filter_type=2),
+    "effects": build_effects_challenge,
+    "interval": build_interval_challenge,
+    "chords": build_chords_challenge,
+}
+
 @router.get("/select-mode")
 async def select_mode(request: Request):
     """Страница выбора режима тестирования."""
@@ -67,10 +81,21 @@ async def start_test(
     }
 
     await update_user_data(user_id, user_data)
+
+    # Все испытания сессии готовятся параллельно в фоне, страницы тестов забирают готовые
+    await challenge_batches.start(user_id, await get_current_user_id(req), test_sequence, difficulty, CHALLENGE_BUILDERS)
     
     next_test_type = test_sequence[0]
     return RedirectResponse(url=f"/tests/{next_test_type}", status_code=303)
 
+@router.get("/start-test/progress")
+async def start_test_progress(request: Request, username: str = Depends(get_current_user)):
+    """Прогресс подготовки испытаний текущей сессии тестирования."""
+    batch = challenge_batches.get_batch(get_user_id(request))
+    if batch is None:
+        raise HTTPException(status_code=404, detail="No active test session")
+    return batch.progress()
+
 @router.post("/next-test")
 async def next_test(request: Request, score: int = Form(None)):
     """Переход к следующему тесту."""
@@ -96,6 +121,7 @@ async def next_test(request: Request, score: int = Form(None)):
         # Все тесты пройдены, возвращаем результаты
         scores = user_data["scores"]
         average_score = sum(scores) / len(scores) if scores else 0
+        await challenge_batches.discard(user_id)
         return RedirectResponse(url="/test-results", status_code=303)
     
     # Получаем следующий тест
@@ -14,6 +14,8 @@ import jwt
 from fastapi import Request, HTTPException
 from uuid import uuid4
 
+from utils.api_clients import db_api
+
 
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
@@ -35,20 +37,34 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(request: Request):
+def get_token_payload(request: Request) -> dict:
+    """Проверяет токен из куки auth и возвращает его содержимое."""
     token = request.cookies.get("auth")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+        if payload.get("sub") is None:
             raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Token expired or invalid")
 
-    return username
+    return payload
+
+def get_current_user(request: Request):
+    return get_token_payload(request)["sub"]
+
+async def get_current_user_id(request: Request) -> int:
+    """
+    Числовой id пользователя из токена (uid), без запросов к db-api.
+    Для токенов, выданных до появления uid, - через кэш профилей клиента db-api.
+    """
+    payload = get_token_payload(request)
+    user_id = payload.get("uid")
+    if user_id is None:
+        user_id = await db_api.get_user_id(payload["sub"])
+    return user_id
 
 #def generate_confirmation_token(user_data: dict) -> str:
 #    # Настроим токен, который будет содержать информацию о данных пользователя, которые необходимо обновить
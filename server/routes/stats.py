@@ -1,46 +1,26 @@
-import httpx
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime
 
 from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.templating import Jinja2Templates
 from utils.user_id import get_user_id
-from utils.user_id import DB_API_URL
+from utils.api_clients import db_api
+from utils.result_buffer import result_buffer
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 @router.get("/stats")
 async def stats(request: Request):
-    username = get_user_id(request)
+    get_user_id(request)
 
-    # Получаем данные о тестах
-    async with httpx.AsyncClient() as client:
-        # Получаем тесты за последние 30 дней по умолчанию
-        tests_response = await client.get(
-            f"{DB_API_URL}/user_tests/",
-            params={
-                "username": username,
-                "time_after": datetime.now() - timedelta(days=30)
-            })
-        
-        if tests_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        tests_data = tests_response.json()
-        stats_data = tests_data["tests"]
-        
-        # Получаем категории и типы тестов
-        categories_response = await client.get(f"{DB_API_URL}/test_categories/")
-        types_response = await client.get(f"{DB_API_URL}/test_types/")
-        
-        categories = categories_response.json()
-        types = types_response.json()
+    # График загружается отдельно (/stats/daily), странице нужны только категории и типы тестов
+    categories, types = await asyncio.gather(db_api.get_test_categories(), db_api.get_test_types())
 
     return templates.TemplateResponse(
         "stats.html",
         {
             "request": request,
-            "stats": stats_data,
             "categories": categories,
             "types": types
         }
@@ -53,20 +33,30 @@ async def update_stats(
 ):
     username = get_user_id(request)  # Используйте реальное имя пользователя, не 'test_user'
 
-    async with httpx.AsyncClient() as client:
-        tests_response = await client.get(
-            f"{DB_API_URL}/user_tests/",
-            params={
-                "username": username,  # Используйте полученное имя пользователя
-                "time_after": time_after.isoformat()  # Явное преобразование в строку
-            }
-        )
-        
-        if tests_response.status_code != 200:
-            raise HTTPException(status_code=tests_response.status_code, detail="Error fetching tests")
-            
-        tests_data = tests_response.json()
-        stats_data = tests_data.get("tests", [])
-        print(tests_response)
+    await result_buffer.flush()
+    stats_data = await db_api.get_user_tests(username, time_after)
     
-    return {"stats": stats_data}
\ No newline at end of file
+    return {"stats": stats_data}
+
+@router.get("/stats/daily")
+async def daily_stats(
+    request: Request,
+    time_after: datetime = Query(..., description="Начало периода (например, 2023-01-01T00:00:00), учитывается весь день")
+):
+    """Результаты по дням, типам и сложности: готовые агрегаты из db-api вместо всех тестов за период."""
+    username = get_user_id(request)
+
+    # Записываем отложенные результаты, чтобы статистика включала последние тесты
+    await result_buffer.flush()
+    return {"stats": await db_api.get_user_daily_stats(username, time_after.date())}
+
+@router.get("/stats/summary")
+async def stats_summary(
+    request: Request,
+    time_after: datetime = Query(..., description="Начало периода (например, 2023-01-01T00:00:00), учитывается весь день")
+):
+    """Итоги по типам тестов за период: число тестов, средний, минимальный и максимальный балл."""
+    username = get_user_id(request)
+
+    await result_buffer.flush()
+    return {"summary": await db_api.get_user_stats_summary(username, time_after.date())}
@@ -1,93 +1,176 @@
 from os import getenv
+import asyncio
+import hashlib
+import logging
 import random
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, Response
 from fastapi.templating import Jinja2Templates
 from jose import jwt, JWTError
-import httpx
-import base64
-
-from utils.fx_processor import one_band_eq, apply_random_effect
-from utils.user_id import get_user_id, FILE_API_URL, DB_API_URL
+from starlette.concurrency import run_in_threadpool
+
+from utils.fx_processor import one_band_eq, apply_effect, render_stored_track, get_effect, EFFECT_NAMES, DIFFICULTY_PARAMS, FX_VERSION
+from utils.dsp_executor import dsp_executor
+from utils.render_cache import render_cache, make_key
+from utils.challenge_batch import Challenge, challenge_batches, challenge_response
+from utils.api_clients import file_api
+from utils.track_loader import StoredTrack, track_loader
+from utils.result_buffer import result_buffer
+from utils.user_id import get_user_id
 from utils.mongo import get_user_difficulty
-from routes.session import get_current_user
+from routes.session import get_current_user, get_current_user_id
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
-
-async def generate_eq_test(request: Request, difficulty: str = "medium", filter_type: int = 1):
-    """Общие действия для генерации тестов: bandpass-gain и bandstop."""
-    username = get_user_id(request)
-    difficulty = await get_user_difficulty(username)
-    
-    async with httpx.AsyncClient() as client:
-        file_response = await client.get(f"{FILE_API_URL}/random-file/", params={"directory": "testing_tracks"})
-        if file_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to retrieve test file")
-        original_audio = file_response.content
-
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"]
-        
-    # Определяем параметры фильтра в зависимости от сложности
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_WARM_INTERVAL = float(getenv("RENDER_CACHE_WARM_INTERVAL", 300))  # Секунды между проверками новых треков
+
+def effect_cache_key(track_hash: str, effect_type: str, difficulty: str) -> str:
+    """
+    Ключ рендера эффекта: (хэш трека, эффект, параметры эффекта, версия алгоритмов),
+    поэтому смена параметров или реализации эффектов не отдаёт старый рендер.
+    """
+    if effect_type == "No effect":
+        return track_cache_key(track_hash)
+    _, effect_args = get_effect(effect_type, difficulty)
+    return make_key(track_hash, effect_type, effect_args, FX_VERSION)
+
+def track_cache_key(track_hash: str) -> str:
+    return make_key("track", track_hash)
+
+async def pick_track() -> tuple[bytes | StoredTrack, str]:
+    """
+    Случайный трек и его хэш. Если хранилище треков file-api смонтировано локально, воркеры DSP
+    читают трек через memmap и по сети передаётся только ссылка на него, иначе трек скачивается из file-api.
+    """
+    stored = track_loader.random()
+    if stored is not None:
+        return stored, stored.key
+    original_audio = await file_api.get_random_file("testing_tracks")
+    return original_audio, hashlib.sha256(original_audio).hexdigest()
+
+async def cache_original(source: bytes | StoredTrack, track_hash: str, request: Request | None = None) -> str:
+    """Кладёт исходный трек в кэш рендеров (трек хранилища кодируется в WAV один раз) и возвращает ключ."""
+    track_key = track_cache_key(track_hash)
+    if not isinstance(source, StoredTrack):
+        await run_in_threadpool(render_cache.put, track_key, source)
+    elif not await run_in_threadpool(render_cache.contains, track_key):
+        await run_in_threadpool(render_cache.put, track_key, await dsp_executor.run(render_stored_track, source, request=request))
+    return track_key
+
+async def render_effect(source: bytes | StoredTrack, effect_type: str, difficulty: str, request: Request | None = None,
+                        track_hash: str | None = None):
+    """Рендерит трек с эффектом в пуле процессов и кладёт в кэш рендеров, если его там ещё нет."""
+    if effect_type == "No effect":
+        return
+
+    track_hash = track_hash or hashlib.sha256(source).hexdigest()
+    cache_key = effect_cache_key(track_hash, effect_type, difficulty)
+
+    if not await run_in_threadpool(render_cache.contains, cache_key):
+        processed_audio = await dsp_executor.run(apply_effect, source, effect_type, difficulty, request=request)
+        await run_in_threadpool(render_cache.put, cache_key, processed_audio)
+
+async def warm_effects_cache():
+    """
+    Фоновый прогрев кэша: для каждого нового трека в testing_tracks рендерит
+    все эффекты на всех уровнях сложности. Задачи идут по одной, чтобы не занимать
+    пул, нужный пользователям.
+    """
+    warmed_tracks = set()
+    while True:
+        try:
+            stored_tracks = track_loader.tracks()
+            if stored_tracks:
+                # Треки хранилища: версия известна из индекса, скачивать их не нужно
+                sources = [(track.key, track.name, track) for track in stored_tracks]
+            else:
+                sources = [(track_name, track_name, None) for track_name in await file_api.list_files("testing_tracks")]
+            for warm_key, track_name, source in [item for item in sources if item[0] not in warmed_tracks]:
+                if source is None:
+                    source = await file_api.get_file("testing_tracks", track_name)
+                    if source is None:
+                        continue
+                track_hash = source.key if isinstance(source, StoredTrack) else hashlib.sha256(source).hexdigest()
+
+                await cache_original(source, track_hash)
+                for difficulty in DIFFICULTY_PARAMS:
+                    for effect_type in EFFECT_NAMES:
+                        await render_effect(source, effect_type, difficulty, track_hash=track_hash)
+                warmed_tracks.add(warm_key)
+                logger.info(f"Render cache warmed for {track_name}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Render cache warm-up failed: {e}")
+
+        await asyncio.sleep(RENDER_CACHE_WARM_INTERVAL)
+
+def eq_params(difficulty: str) -> tuple[float, float, float]:
+    """Случайные параметры фильтра (ширина, частота, усиление) в зависимости от сложности."""
     filter_width = random.uniform(1500, 1000) if difficulty == "easy" else random.uniform(700, 1000) if difficulty == "medium" else random.uniform(200, 500)
     filter_freq = random.uniform(1600, 18000)
     gain = 15 if difficulty == "easy" else 10 if difficulty == "medium" else 5
-    
-    # Обрабатываем фильтр в зависимости от типа (bandpass или bandstop)
-    processed_audio = one_band_eq(original_audio, filter_width, filter_freq, gain if filter_type == 1 else -1)
+    return filter_width, filter_freq, gain
 
-    original_audio_base64 = base64.b64encode(original_audio).decode('utf-8')
-    processed_audio_base64 = base64.b64encode(processed_audio).decode('utf-8')
-    
-    request.session["test_data"] = {
-        "user_id": user_id,
-        "filter_freq": filter_freq,
-        "filter_width": filter_width
-    }
-    
-    return {
-        "original_audio": original_audio_base64,
-        "processed_audio": processed_audio_base64,
-        "filter_width": filter_width,
-        "filter_freq": filter_freq,
-    }
+async def build_eq_challenge(difficulty: str, filter_type: int, request: Request | None = None) -> Challenge:
+    """Готовит испытание bandpass-gain/bandstop, аудио кладёт в кэш рендеров."""
+    source, track_hash = await pick_track()
+    filter_width, filter_freq, gain = eq_params(difficulty)
+    # Обрабатываем фильтр в зависимости от типа (bandpass или bandstop)
+    gain = gain if filter_type == 1 else -1
+    processed_audio = await dsp_executor.run(one_band_eq, source, filter_width, filter_freq, gain, request=request)
+
+    track_key = await cache_original(source, track_hash, request=request)
+    processed_key = make_key(track_hash, "eq", filter_width, filter_freq, gain, FX_VERSION)
+    # Параметры случайные и не повторяются: рендер нужен только этому испытанию
+    await run_in_threadpool(render_cache.put, processed_key, processed_audio, True)
+
+    return Challenge(
+        fields={"filter_width": filter_width, "filter_freq": filter_freq},
+        audio={"original_audio": track_key, "processed_audio": processed_key},
+        test_data={"filter_freq": filter_freq, "filter_width": filter_width},
+        owned_keys=[processed_key],
+    )
+
+async def build_effects_challenge(difficulty: str, request: Request | None = None) -> Challenge:
+    """Готовит испытание effects, аудио кладёт в кэш рендеров."""
+    source, track_hash = await pick_track()
+    effect_type = random.choice(EFFECT_NAMES)
+    await render_effect(source, effect_type, difficulty, request=request, track_hash=track_hash)
+    await cache_original(source, track_hash, request=request)
+
+    return Challenge(
+        fields={"effect": effect_type},
+        audio={"original_audio": track_cache_key(track_hash), "processed_audio": effect_cache_key(track_hash, effect_type, difficulty)},
+        test_data={"effect": effect_type},
+    )
 
-async def do_generate_effects_test(request: Request, difficulty: str = "medium"):
+async def generate_eq_test(request: Request, difficulty: str = "medium", filter_type: int = 1):
+    """Общие действия для генерации тестов: bandpass-gain и bandstop."""
     username = get_user_id(request)
-    difficulty = await get_user_difficulty(username)
+    prepared = await challenge_batches.take(username, "bandpass-gain" if filter_type == 1 else "bandstop")
+    if prepared is None:
+        # Испытание не подготовлено заранее (тест вне сессии или ошибка пакета) - генерируем сейчас
+        difficulty = await get_user_difficulty(username)
+        user_id = await get_current_user_id(request)
+        challenge = await build_eq_challenge(difficulty, filter_type, request=request)
+        prepared = challenge_response(challenge, owned=True), {"user_id": user_id, **challenge.test_data}
 
-    async with httpx.AsyncClient() as client:
-        file_response = await client.get(f"{FILE_API_URL}/random-file/", params={"directory": "testing_tracks"})
-        if file_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to retrieve test file")
-        original_audio = file_response.content
+    response, request.session["test_data"] = prepared
+    return response
 
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(f"{DB_API_URL}/users/{username}")
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = user_response.json()
-        user_id = user_data["user_id"] 
-
-    processed_audio, effect_type = apply_random_effect(audio_bytes=original_audio, difficulty=difficulty) 
-
-    original_audio_base64 = base64.b64encode(original_audio).decode('utf-8')
-    processed_audio_base64 = base64.b64encode(processed_audio).decode('utf-8')
-
-    request.session["test_data"] = {
-        "user_id": user_id,
-        "effect": effect_type,
-    }    
+async def do_generate_effects_test(request: Request, difficulty: str = "medium"):
+    username = get_user_id(request)
+    prepared = await challenge_batches.take(username, "effects")
+    if prepared is None:
+        difficulty = await get_user_difficulty(username)
+        user_id = await get_current_user_id(request)
+        challenge = await build_effects_challenge(difficulty, request=request)
+        prepared = challenge_response(challenge, owned=True), {"user_id": user_id, **challenge.test_data}
 
-    return {
-        "original_audio": original_audio_base64,
-        "processed_audio": processed_audio_base64,
-        "effect": effect_type
-    }    
+    response, request.session["test_data"] = prepared
+    return response
 
 
 @router.get("/tests/bandpass-gain")
@@ -146,13 +229,7 @@ async def do_submit_effects_test(request: Request, selected_effect: str):
     real_effect = test_data["effect"]
     score = 100 if real_effect == selected_effect else 1
 
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": test_data["user_id"],
-            "type_id": 3,  # В зависимости от типа фильтра
-            "score": int(score),
-            "difficulty": difficulty
-        })    
+    await result_buffer.add(test_data["user_id"], 3, int(score), difficulty)
 
     return {"score": int(score), "real_effect": real_effect, "selected_effect": selected_effect}    
 
@@ -169,12 +246,6 @@ async def do_submit_eq_test(request: Request, selected_freq: float, filter_type:
     error_percentage = (error / real_freq) * 100
     score = max(100 - (error_percentage / 0.75), 1)  # Линейное уменьшение до 1 при ошибке 80%
     
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DB_API_URL}/tests/", json={
-            "user_id": test_data["user_id"],
-            "type_id": filter_type,  # В зависимости от типа фильтра
-            "score": int(score),
-            "difficulty": difficulty
-        })
+    await result_buffer.add(test_data["user_id"], filter_type, int(score), difficulty)
     
     return {"score": int(score), "real_freq": real_freq, "selected_freq": selected_freq}
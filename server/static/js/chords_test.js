@@ -8,8 +8,7 @@ async function fetchTest() {
     testData = await response.json();
 
     // Воспроизведение аудио
-    const originalBlob = base64ToBlob(testData.chords_audio);
-    document.getElementById("original-audio").src = URL.createObjectURL(originalBlob);
+    document.getElementById("original-audio").src = audioUrl(testData.chords_audio);
 
     // Динамическое создание выпадающих списков
     createSelectElements(testData.steps);
@@ -17,9 +16,9 @@ async function fetchTest() {
     console.log("fetchTest выполнен");
 }
 
-// Преобразование Base64 в Blob
-function base64ToBlob(base64) {
-    return new Blob([new Uint8Array(atob(base64).split("").map(c => c.charCodeAt(0)))], { type: "audio/wav" });
+// Ссылка на аудио испытания: FLAC (без потерь, меньше WAV), если браузер его поддерживает
+function audioUrl(url) {
+    return new Audio().canPlayType("audio/flac") ? `${url}?format=flac` : url;
 }
 
 // Создание выпадающих списков
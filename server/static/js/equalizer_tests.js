@@ -10,19 +10,16 @@ async function fetchTest() {
     const response = await fetch(`/generate-test/${testType}?difficulty=medium`);
     testData = await response.json();
 
-    const originalBlob = base64ToBlob(testData.original_audio);
-    const processedBlob = base64ToBlob(testData.processed_audio);
-
-    document.getElementById("original-audio").src = URL.createObjectURL(originalBlob);
-    document.getElementById("processed-audio").src = URL.createObjectURL(processedBlob);
+    document.getElementById("original-audio").src = audioUrl(testData.original_audio);
+    document.getElementById("processed-audio").src = audioUrl(testData.processed_audio);
 
     document.getElementById("original-analyzer").parentElement.classList.add("show");
     document.getElementById("processed-analyzer").parentElement.classList.add("show");
 }
 
-// Преобразование Base64 в Blob
-function base64ToBlob(base64) {
-    return new Blob([new Uint8Array(atob(base64).split("").map(c => c.charCodeAt(0)))], { type: "audio/wav" });
+// Ссылка на аудио испытания: FLAC (без потерь, меньше WAV), если браузер его поддерживает
+function audioUrl(url) {
+    return new Audio().canPlayType("audio/flac") ? `${url}?format=flac` : url;
 }
 
 // Обновление значения частоты, когда ползунок изменяется
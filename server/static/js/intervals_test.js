@@ -7,14 +7,12 @@ async function fetchTest() {
     const response = await fetch("/generate-test/interval?difficulty=medium");
     testData = await response.json();
 
-    const originalBlob = base64ToBlob(testData.interval_audio);
-
-    document.getElementById("original-audio").src = URL.createObjectURL(originalBlob);
+    document.getElementById("original-audio").src = audioUrl(testData.interval_audio);
 }
 
-// Преобразование Base64 в Blob
-function base64ToBlob(base64) {
-    return new Blob([new Uint8Array(atob(base64).split("").map(c => c.charCodeAt(0)))], { type: "audio/wav" });
+// Ссылка на аудио испытания: FLAC (без потерь, меньше WAV), если браузер его поддерживает
+function audioUrl(url) {
+    return new Audio().canPlayType("audio/flac") ? `${url}?format=flac` : url;
 }
 
 // Отправка результата
@@ -108,7 +108,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const timeAfter = getTimeRange(timeRange);
     
         try {
-            const response = await fetch(`/update_stats?time_after=${encodeURIComponent(timeAfter)}`);
+            // Дневные агрегаты: по записи на день, тип и сложность вместо каждого теста
+            const response = await fetch(`/stats/daily?time_after=${encodeURIComponent(timeAfter)}`);
             if (!response.ok) throw new Error('Ошибка загрузки данных');
     
             const data = await response.json();
@@ -129,13 +130,21 @@ document.addEventListener('DOMContentLoaded', function() {
             const typesMap = window.appData?.typesMap || {};
             const allData = [];
     
-            // Собираем все данные в один массив
+            // Объединяем отфильтрованные агрегаты по дням: средний балл взвешен числом тестов
+            const byDay = new Map();
             filteredTests.forEach(test => {
-                const parsedDate = toISODate(test.created_at);
+                const day = byDay.get(test.day) || { count: 0, sum: 0 };
+                day.count += test.tests_count;
+                day.sum += test.score_sum;
+                byDay.set(test.day, day);
+            });
+            byDay.forEach((day, key) => {
+                const parsedDate = toISODate(key);
                 if (parsedDate) {
                     allData.push({
                         x: parsedDate.toISOString(),
-                        y: test.score
+                        y: day.sum / day.count,
+                        n: day.count
                     });
                 }
             });
@@ -209,16 +218,16 @@ document.addEventListener('DOMContentLoaded', function() {
     
             // Если точка данных находится в пределах интервала времени, добавляем её в группу
             if (timestamp >= timeThreshold) {
-                currentGroup.push(point.y);
+                currentGroup.push(point);
             } else {
                 // Если точка данных вне интервала, усредняем текущую группу и начинаем новую
                 if (currentGroup.length > 0) {
                     grouped.push({
                         x: new Date(timeThreshold).toISOString(),
-                        y: currentGroup.reduce((sum, score) => sum + score, 0) / currentGroup.length
+                        y: weightedAverage(currentGroup)
                     });
                 }
-                currentGroup = [point.y];
+                currentGroup = [point];
                 timeThreshold = timestamp;
             }
         });
@@ -227,7 +236,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (currentGroup.length > 0) {
             grouped.push({
                 x: new Date(timeThreshold).toISOString(),
-                y: currentGroup.reduce((sum, score) => sum + score, 0) / currentGroup.length
+                y: weightedAverage(currentGroup)
             });
         }
     
@@ -244,7 +253,12 @@ document.addEventListener('DOMContentLoaded', function() {
     
         return grouped;
     }
-    
+
+    // Средний балл группы точек с учётом числа тестов в каждой
+    function weightedAverage(points) {
+        const count = points.reduce((total, point) => total + (point.n || 1), 0);
+        return points.reduce((sum, point) => sum + point.y * (point.n || 1), 0) / count;
+    }
     
     function getTimeInterval(timeRange) {
         switch (timeRange) {
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from os import getenv
+
+import httpx
+from fastapi import HTTPException
+
+from utils.user_id import DB_API_URL, FILE_API_URL
+
+logger = logging.getLogger(__name__)
+
+DB_API_TIMEOUT = float(getenv("DB_API_TIMEOUT", 5))  # Секунды
+FILE_API_TIMEOUT = float(getenv("FILE_API_TIMEOUT", 30))  # Секунды: треки весят мегабайты
+HTTP_CONNECT_TIMEOUT = float(getenv("HTTP_CONNECT_TIMEOUT", 2))
+HTTP_MAX_CONNECTIONS = int(getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(getenv("HTTP_MAX_KEEPALIVE", 20))
+HTTP_RETRIES = int(getenv("HTTP_RETRIES", 2))
+HTTP_RETRY_BACKOFF = float(getenv("HTTP_RETRY_BACKOFF", 0.1))  # Секунды, удваивается с каждой попыткой
+REFERENCE_CACHE_TTL = float(getenv("REFERENCE_CACHE_TTL", 60))  # Секунды до проверки справочника в db-api
+USER_CACHE_SIZE = int(getenv("USER_CACHE_SIZE", 1024))  # Профилей в памяти
+USER_CACHE_TTL = float(getenv("USER_CACHE_TTL", 300))  # Секунды
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+RETRY_STATUSES = {502, 503, 504}
+
+class ApiClient:
+    """
+    Клиент внутреннего сервиса поверх общего пула соединений с keep-alive.
+    Пул создаётся в lifespan приложения (`start`) и закрывается при остановке (`close`).
+
+    Повторы с экспоненциальной задержкой: ошибка соединения повторяется для любого
+    метода (запрос не дошёл до сервиса), таймауты и ответы 502/503/504 - только
+    для идемпотентных методов.
+    """
+
+    def __init__(self, base_url: str, timeout: float, retries: int = HTTP_RETRIES):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self._client: httpx.AsyncClient | None = None
+
+    def start(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self._client is None:
+            raise RuntimeError(f"API client for {self.base_url} is not started")
+
+        idempotent = method in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            retry_left = attempt < self.retries
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if not retry_left or not (idempotent or isinstance(e, httpx.ConnectError)):
+                    raise
+                logger.warning(f"{method} {self.base_url}{url} failed ({e!r}), retrying")
+            else:
+                if not (retry_left and idempotent and response.status_code in RETRY_STATUSES):
+                    return response
+                logger.warning(f"{method} {self.base_url}{url} returned {response.status_code}, retrying")
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+class DBApiClient(ApiClient):
+    """
+    Клиент db-api.
+
+    Справочники (категории и типы тестов) кэшируются в памяти: в течение REFERENCE_CACHE_TTL
+    запросов нет вовсе, затем версия проверяется условным запросом (If-None-Match), и db-api
+    отвечает 304 без тела, если справочник не менялся.
+
+    Профили пользователей хранятся в LRU-кэше на USER_CACHE_TTL и сбрасываются
+    при изменении профиля или пароля через этот клиент.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reference: dict[str, tuple[str, list[dict], float]] = {}  # url -> (ETag, данные, срок)
+        self._reference_locks: dict[str, asyncio.Lock] = {}
+        self._users: OrderedDict[str, tuple[dict, float]] = OrderedDict()  # username -> (профиль, срок)
+
+    async def get_reference(self, url: str) -> list[dict]:
+        cached = self._reference.get(url)
+        if cached is not None and time.monotonic() < cached[2]:
+            return cached[1]
+
+        async with self._reference_locks.setdefault(url, asyncio.Lock()):
+            cached = self._reference.get(url)
+            if cached is not None and time.monotonic() < cached[2]:
+                return cached[1]
+
+            headers = {"If-None-Match": cached[0]} if cached is not None and cached[0] else {}
+            try:
+                response = await self.get(url, headers=headers)
+                if response.status_code == 304 and cached is not None:
+                    data = cached[1]
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if cached is None:
+                    raise
+                # db-api недоступен: справочник почти не меняется, отдаём последнюю версию
+                logger.warning(f"Reference data {url} is unavailable ({e!r}), serving cached copy")
+                return cached[1]
+            self._reference[url] = (response.headers.get("etag", ""), data, time.monotonic() + REFERENCE_CACHE_TTL)
+            return data
+
+    def invalidate_reference(self):
+        self._reference.clear()
+
+    async def get_user(self, username: str) -> dict | None:
+        cached = self._users.get(username)
+        if cached is not None:
+            if time.monotonic() < cached[1]:
+                self._users.move_to_end(username)
+                return dict(cached[0])
+            del self._users[username]
+
+        response = await self.get(f"/users/{username}")
+        user = response.json() if response.status_code == 200 else None
+        if user:
+            self._users[username] = (user, time.monotonic() + USER_CACHE_TTL)
+            if len(self._users) > USER_CACHE_SIZE:
+                self._users.popitem(last=False)
+            return dict(user)
+        return None
+
+    def invalidate_user(self, username: str):
+        self._users.pop(username, None)
+
+    async def get_user_id(self, username: str) -> int:
+        """Числовой id пользователя (нужен для записи результатов), 404 если пользователя нет."""
+        user = await self.get_user(username)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user["user_id"]
+
+    async def get_password_hash(self, username: str) -> str | None:
+        response = await self.get(f"/users/get_password_hash/{username}")
+        return response.json().get("password_hash") if response.status_code == 200 else None
+
+    async def register_user(self, user_data: dict) -> bool:
+        response = await self.post("/users/register", json=user_data)
+        return response.status_code == 200
+
+    async def update_user(self, username: str, user_data: dict) -> bool:
+        response = await self.put(f"/users/{username}", json=user_data)
+        self.invalidate_user(username)
+        return response.status_code == 200
+
+    async def change_password(self, username: str, password_hash: str) -> bool:
+        response = await self.post("/users/change_password", json={"username": username, "new_password": password_hash})
+        self.invalidate_user(username)
+        return response.status_code == 200
+
+    async def add_test_results(self, results: list[dict]) -> int:
+        """Записывает пачку результатов (повтор безопасен благодаря idempotency_key), возвращает число новых."""
+        response = await self.post("/tests/batch", json=results)
+        response.raise_for_status()
+        return response.json()["inserted"]
+
+    async def get_user_tests(self, username: str, time_after: datetime) -> list[dict]:
+        response = await self.get("/user_tests/", params={"username": username, "time_after": time_after.isoformat()})
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Error fetching tests")
+        return response.json().get("tests", [])
+
+    async def get_user_daily_stats(self, username: str, since: date) -> list[dict]:
+        """Дневные агрегаты результатов пользователя (день, тип, сложность) начиная с `since`."""
+        response = await self.get("/user_stats/daily", params={"username": username, "since": since.isoformat()})
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Error fetching stats")
+        return response.json()["stats"]
+
+    async def get_user_stats_summary(self, username: str, since: date) -> list[dict]:
+        """Итоги пользователя по типам тестов начиная с `since`."""
+        response = await self.get("/user_stats/summary", params={"username": username, "since": since.isoformat()})
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Error fetching stats")
+        return response.json()["summary"]
+
+    async def get_test_categories(self) -> list[dict]:
+        return await self.get_reference("/test_categories/")
+
+    async def get_test_types(self) -> list[dict]:
+        return await self.get_reference("/test_types/")
+
+class FileApiClient(ApiClient):
+    """Клиент file-api."""
+
+    async def get_random_file(self, directory: str) -> bytes:
+        response = await self.get("/random-file/", params={"directory": directory})
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Failed to retrieve test file")
+        return response.content
+
+    async def get_file(self, directory: str, filename: str) -> bytes | None:
+        response = await self.get("/file/", params={"directory": directory, "filename": filename})
+        return response.content if response.status_code == 200 else None
+
+    async def get_file_etag(self, directory: str, filename: str) -> str | None:
+        """ETag файла без загрузки содержимого (запрашивается один байт); None, если файла нет."""
+        response = await self.get("/file/", params={"directory": directory, "filename": filename},
+                                  headers={"Range": "bytes=0-0"})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.headers.get("etag")
+
+    async def list_files(self, directory: str) -> list[str]:
+        response = await self.get("/list-files/", params={"directory": directory})
+        response.raise_for_status()
+        return response.json()["files"]
+
+    async def upload(self, directory: str, filename: str, content: bytes, content_type: str | None) -> bool:
+        files = {"file": (filename, content, content_type)}
+        response = await self.post("/upload/", params={"directory": directory}, files=files)
+        return response.status_code == 200
+
+db_api = DBApiClient(DB_API_URL, DB_API_TIMEOUT)
+file_api = FileApiClient(FILE_API_URL, FILE_API_TIMEOUT)
+
+def start_api_clients():
+    db_api.start()
+    file_api.start()
+
+async def close_api_clients():
+    await db_api.close()
+    await file_api.close()
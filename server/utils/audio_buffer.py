@@ -0,0 +1,80 @@
+import io
+from dataclasses import dataclass, replace
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+# Наибольшее значение float32 меньше 1: при записи в PCM_32 (1.0 * 0x7FFFFFFF)
+# округляется до 2 ** 31 и переполняет int32, поэтому верхняя граница чуть ниже
+_MAX_SAMPLE = np.float32(1) - np.finfo(np.float32).epsneg
+
+OPUS_FRAME_RATE = 48000  # Opus поддерживает только 8/12/16/24/48 кГц
+
+# Форматы выдачи аудио: формат -> (MIME-тип, format и subtype soundfile)
+AUDIO_FORMATS = {
+    "wav": ("audio/wav", "WAV", None),
+    "flac": ("audio/flac", "FLAC", "PCM_24"),
+    "opus": ("audio/ogg", "OGG", "OPUS"),
+}
+
+@dataclass
+class AudioBuffer:
+    """
+    Декодированное аудио, которое передаётся между стадиями обработки.
+
+    :param samples: Сэмплы float32 формы (кадры, каналы) в диапазоне [-1, 1].
+    :param frame_rate: Частота дискретизации.
+    :param subtype: Формат сэмплов исходного файла (subtype soundfile), в нём же кодируется результат.
+    """
+    samples: np.ndarray
+    frame_rate: int
+    subtype: str = "PCM_32"
+
+    @property
+    def channels(self) -> int:
+        return self.samples.shape[1]
+
+    @property
+    def frames(self) -> int:
+        return self.samples.shape[0]
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.frame_rate
+
+    def with_samples(self, samples: np.ndarray) -> "AudioBuffer":
+        """Возвращает буфер с теми же параметрами и новыми сэмплами."""
+        return replace(self, samples=samples)
+
+def decode_wav(wav_bytes: bytes) -> AudioBuffer:
+    """Декодирует WAV (bytes) сразу в float32 без промежуточных копий."""
+    with sf.SoundFile(io.BytesIO(wav_bytes)) as wav_in:
+        samples = wav_in.read(dtype="float32", always_2d=True)
+        return AudioBuffer(samples, wav_in.samplerate, wav_in.subtype)
+
+def encode_wav(buffer: AudioBuffer) -> bytes:
+    """Кодирует буфер в WAV (bytes) в формате исходного файла, ограничивая сэмплы диапазоном [-1, 1]."""
+    output_io = io.BytesIO()
+    samples = np.clip(buffer.samples, -1, _MAX_SAMPLE)
+    sf.write(output_io, samples, buffer.frame_rate, subtype=buffer.subtype, format="WAV")
+    return output_io.getvalue()
+
+def transcode(wav_bytes: bytes, audio_format: str) -> bytes:
+    """
+    Перекодирует WAV в один из AUDIO_FORMATS. FLAC - без потерь (24 бита),
+    для Opus сигнал предварительно передискретизируется в 48 кГц.
+    """
+    _, file_format, subtype = AUDIO_FORMATS[audio_format]
+    if file_format == "WAV":
+        return wav_bytes
+
+    buffer = decode_wav(wav_bytes)
+    samples, frame_rate = buffer.samples, buffer.frame_rate
+    if file_format == "OGG" and frame_rate != OPUS_FRAME_RATE:
+        samples = resample_poly(samples, OPUS_FRAME_RATE, frame_rate, axis=0).astype(np.float32)
+        frame_rate = OPUS_FRAME_RATE
+
+    output_io = io.BytesIO()
+    sf.write(output_io, np.clip(samples, -1, _MAX_SAMPLE), frame_rate, subtype=subtype, format=file_format)
+    return output_io.getvalue()
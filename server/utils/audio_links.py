@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from os import getenv
+
+from starlette.concurrency import run_in_threadpool
+
+from utils.audio_buffer import AUDIO_FORMATS
+from utils.render_cache import render_cache, make_key
+
+logger = logging.getLogger(__name__)
+
+AUDIO_LINK_TTL = float(getenv("AUDIO_LINK_TTL", 3 * 60 * 60))  # Секунды
+AUDIO_LINK_SWEEP_INTERVAL = float(getenv("AUDIO_LINK_SWEEP_INTERVAL", 60))  # Секунды между удалениями истёкших ссылок
+
+@dataclass
+class AudioLink:
+    key: str
+    expires: float
+    owned: bool
+
+def variant_key(key: str, audio_format: str) -> str:
+    """Ключ перекодированной версии аудио в кэше рендеров (WAV хранится под исходным ключом)."""
+    return key if audio_format == "wav" else make_key(key, audio_format)
+
+def delete_audio(key: str):
+    """Удаляет аудио и все его перекодированные версии из кэша рендеров."""
+    for audio_format in AUDIO_FORMATS:
+        render_cache.delete(variant_key(key, audio_format))
+
+def delete_audio_keys(keys: list[str]):
+    for key in keys:
+        delete_audio(key)
+
+class AudioLinks:
+    """
+    Непрозрачные идентификаторы аудио испытаний. Клиент получает случайный id,
+    а не ключ кэша: по ключу можно было бы сопоставить обработанный трек
+    с исходным (например, у "No effect" они совпадают) и узнать ответ.
+
+    Аудио, принадлежащее ссылке (`owned`), удаляется из кэша вместе с ней по истечении TTL:
+    истёкшие ссылки убирает фоновая задача (start), файлы удаляются в пуле потоков.
+    """
+
+    def __init__(self, ttl: float = AUDIO_LINK_TTL, sweep_interval: float = AUDIO_LINK_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._links: dict[str, AudioLink] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, key: str, owned: bool = False) -> str:
+        audio_id = uuid.uuid4().hex
+        self._links[audio_id] = AudioLink(key, time.time() + self.ttl, owned)
+        return audio_id
+
+    def resolve(self, audio_id: str) -> str | None:
+        link = self._links.get(audio_id)
+        if link is None or link.expires < time.time():
+            return None
+        return link.key
+
+    def url(self, key: str, owned: bool = False) -> str:
+        return f"/audio/{self.publish(key, owned)}"
+
+    def _expire(self) -> list[str]:
+        """Убирает истёкшие ссылки и возвращает ключи принадлежавшего им аудио."""
+        now = time.time()
+        owned_keys = []
+        for audio_id in [audio_id for audio_id, link in self._links.items() if link.expires < now]:
+            link = self._links.pop(audio_id)
+            if link.owned:
+                owned_keys.append(link.key)
+        return owned_keys
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                owned_keys = self._expire()
+                if owned_keys:
+                    await run_in_threadpool(delete_audio_keys, owned_keys)
+            except Exception as e:
+                logger.warning(f"Audio link sweep failed: {e!r}")
+
+audio_links = AudioLinks()
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from os import getenv
+
+import httpx
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+
+from utils.api_clients import FileApiClient, file_api
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (64, 128, 256)  # Стороны квадратных вариантов, пиксели
+AVATAR_DEFAULT_SIZE = 256
+AVATAR_JPEG_QUALITY = int(getenv("AVATAR_JPEG_QUALITY", 85))
+AVATAR_CACHE_MB = int(getenv("AVATAR_CACHE_MB", 32))
+AVATAR_VERSION_TTL = float(getenv("AVATAR_VERSION_TTL", 300))  # Секунды до проверки версии аватара в file-api
+AVATAR_DIRECTORY = "avatars"
+AVATAR_VARIANTS_DIRECTORY = "avatar_variants"
+
+def avatar_path(username: str, size: int | None = None) -> tuple[str, str]:
+    """
+    Папка и имя файла в file-api: оригинал (avatars/{username}.jpg) или вариант размера
+    (avatar_variants/{username}/{size}.jpg). Варианты лежат отдельно от оригиналов, поэтому
+    не совпадают с аватаром пользователя, чьё имя оканчивается на _{size}.
+    """
+    if size is None:
+        return AVATAR_DIRECTORY, f"{username}.jpg"
+    return f"{AVATAR_VARIANTS_DIRECTORY}/{username}", f"{size}.jpg"
+
+def make_variants(content: bytes) -> dict[int, bytes]:
+    """
+    Квадратные JPEG-варианты изображения для всех AVATAR_SIZES (обрезка по центру).
+
+    :raises ValueError: Если содержимое - не изображение.
+    """
+    try:
+        with Image.open(io.BytesIO(content)) as source:
+            image = ImageOps.exif_transpose(source).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image: {e}") from e
+
+    side = min(image.size)
+    image = ImageOps.fit(image, (side, side))
+    variants = {}
+    # От большего к меньшему: каждый вариант уменьшается из предыдущего, а не из оригинала
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        image = image.resize((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=AVATAR_JPEG_QUALITY, optimize=True, progressive=True)
+        variants[size] = buffer.getvalue()
+    return variants
+
+def content_version(content: bytes) -> str:
+    """Версия аватара - начало sha256 оригинала (совпадает с сильным ETag file-api)."""
+    return hashlib.sha256(content).hexdigest()[:16]
+
+@dataclass(frozen=True)
+class AvatarVariant:
+    content: bytes
+    etag: str
+    last_modified: str
+
+@dataclass
+class AvatarVersion:
+    version: str | None  # None - аватара нет
+    last_modified: str
+    expires_at: float
+
+class AvatarStore:
+    """
+    Аватары с вариантами размеров. Варианты создаются при загрузке и лежат в file-api
+    в отдельной папке, в памяти держатся последние запрошенные (LRU по объёму, ключ -
+    пользователь, размер, версия). URL содержит версию, поэтому ответы кэшируются браузером
+    навсегда, а после новой загрузки профиль ссылается на новый URL.
+    """
+
+    def __init__(self, client: FileApiClient, max_bytes: int = AVATAR_CACHE_MB * 1024 * 1024,
+                 version_ttl: float = AVATAR_VERSION_TTL):
+        self.client = client
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._variants: OrderedDict[tuple[str, int, str], AvatarVariant] = OrderedDict()
+        self._bytes = 0
+        self._versions: dict[str, AvatarVersion] = {}
+
+    @staticmethod
+    def etag(version: str, size: int) -> str:
+        return f'"{version}-{size}"'
+
+    @staticmethod
+    def url(username: str, version: str, size: int = AVATAR_DEFAULT_SIZE) -> str:
+        return f"/avatar/{username}/{version}/{size}.jpg"
+
+    def _remember(self, key: tuple[str, int, str], variant: AvatarVariant):
+        if key in self._variants or len(variant.content) > self.max_bytes:
+            return
+        self._variants[key] = variant
+        self._bytes += len(variant.content)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._variants.popitem(last=False)
+            self._bytes -= len(evicted.content)
+
+    def _set_version(self, username: str, version: str | None) -> AvatarVersion:
+        entry = AvatarVersion(version, formatdate(usegmt=True), time.monotonic() + self.version_ttl)
+        self._versions[username] = entry
+        return entry
+
+    async def current(self, username: str) -> AvatarVersion:
+        """Текущая версия аватара; в file-api - не чаще раза в AVATAR_VERSION_TTL."""
+        entry = self._versions.get(username)
+        if entry is not None and entry.expires_at > time.monotonic():
+            return entry
+        try:
+            etag = await self.client.get_file_etag(*avatar_path(username))
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to check avatar of {username}: {e!r}")
+            # Пока file-api недоступен, отдаём известную версию
+            return entry if entry is not None else AvatarVersion(None, formatdate(usegmt=True), 0)
+        if etag is None:
+            version = None
+        elif etag.startswith('"'):
+            version = etag.strip('"')[:16]  # Сильный ETag file-api - sha256 содержимого
+        else:
+            version = hashlib.sha256(etag.encode()).hexdigest()[:16]
+        if entry is not None and entry.version == version:
+            entry.expires_at = time.monotonic() + self.version_ttl
+            return entry
+        return self._set_version(username, version)
+
+    async def current_url(self, username: str, size: int = AVATAR_DEFAULT_SIZE) -> str | None:
+        version = (await self.current(username)).version
+        return self.url(username, version, size) if version is not None else None
+
+    async def get(self, username: str, version: str, size: int) -> AvatarVariant | None:
+        """Вариант аватара заданной версии или None, если такой версии (уже) нет."""
+        key = (username, size, version)
+        variant = self._variants.get(key)
+        if variant is not None:
+            self._variants.move_to_end(key)
+            return variant
+
+        entry = await self.current(username)
+        if entry.version != version:
+            return None
+        content = await self.client.get_file(*avatar_path(username, size))
+        if content is None:
+            # Аватар загружен до появления вариантов: создаём их из оригинала
+            original = await self.client.get_file(*avatar_path(username))
+            if original is None:
+                return None
+            try:
+                variants = await run_in_threadpool(make_variants, original)
+            except ValueError:
+                return None
+            await self._upload_variants(username, variants)
+            self._remember_variants(username, version, entry.last_modified, variants)
+            return self._variants.get(key)
+
+        variant = AvatarVariant(content, self.etag(version, size), entry.last_modified)
+        self._remember(key, variant)
+        return variant
+
+    def _remember_variants(self, username: str, version: str, last_modified: str, variants: dict[int, bytes]):
+        for size, content in variants.items():
+            self._remember((username, size, version), AvatarVariant(content, self.etag(version, size), last_modified))
+
+    async def _upload_variants(self, username: str, variants: dict[int, bytes]) -> bool:
+        results = await asyncio.gather(*(
+            self.client.upload(*avatar_path(username, size), content, "image/jpeg")
+            for size, content in variants.items()
+        ))
+        return all(results)
+
+    async def upload(self, username: str, content: bytes, content_type: str | None) -> str | None:
+        """
+        Сохраняет новый аватар: сначала варианты, затем оригинал (по нему определяется версия).
+
+        :return: Новая версия или None, если file-api не принял файлы.
+        :raises ValueError: Если содержимое - не изображение.
+        """
+        variants = await run_in_threadpool(make_variants, content)
+        if not await self._upload_variants(username, variants):
+            return None
+        if not await self.client.upload(*avatar_path(username), content, content_type):
+            return None
+        version = content_version(content)
+        entry = self._set_version(username, version)
+        self._remember_variants(username, version, entry.last_modified, variants)
+        return version
+
+avatars = AvatarStore(file_api)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from os import getenv
+from typing import Awaitable, Callable
+
+from starlette.concurrency import run_in_threadpool
+
+from utils.mongo import get_user_data
+from utils.audio_links import audio_links, delete_audio
+
+logger = logging.getLogger(__name__)
+
+CHALLENGE_BATCH_TTL = float(getenv("CHALLENGE_BATCH_TTL", 3 * 60 * 60))  # Секунды
+CHALLENGE_BATCH_CONCURRENCY = int(getenv("CHALLENGE_BATCH_CONCURRENCY", 4))  # Испытаний, готовящихся одновременно
+
+@dataclass
+class Challenge:
+    """
+    Подготовленное испытание. Аудио хранится в кэше рендеров, в памяти - только ключи.
+
+    :param fields: Поля ответа /generate-test/* кроме аудио.
+    :param audio: Поле ответа -> ключ аудио в кэше рендеров.
+    :param test_data: Данные для проверки ответа (session["test_data"] без user_id).
+    :param owned_keys: Ключи кэша, нужные только этому испытанию: удаляются вместе с пакетом.
+    """
+    fields: dict
+    audio: dict[str, str]
+    test_data: dict
+    owned_keys: list[str] = field(default_factory=list)
+
+def challenge_response(challenge: Challenge, owned: bool = False) -> dict:
+    """
+    Ответ /generate-test/*: поля испытания и ссылки на его аудио (/audio/{id}).
+
+    :param owned: Аудио удаляется вместе со ссылками (для испытаний вне пакета).
+    """
+    response = dict(challenge.fields)
+    for name, key in challenge.audio.items():
+        response[name] = audio_links.url(key, owned=owned and key in challenge.owned_keys)
+    return response
+
+ChallengeBuilder = Callable[[str], Awaitable[Challenge]]
+
+class ChallengeBatch:
+    """
+    Испытания одной сессии тестирования: все готовятся параллельно сразу после её начала,
+    не более `concurrency` одновременно, в порядке прохождения.
+    """
+
+    def __init__(self, username: str, user_id: int, test_sequence: list[str], difficulty: str):
+        self.username = username
+        self.user_id = user_id
+        self.test_sequence = test_sequence
+        self.difficulty = difficulty
+        self.created = time.time()
+        self.jobs: dict[int, asyncio.Task] = {}
+
+    def start(self, builders: dict[str, ChallengeBuilder], concurrency: int = CHALLENGE_BATCH_CONCURRENCY):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def build(builder: ChallengeBuilder) -> Challenge:
+            async with semaphore:
+                return await builder(self.difficulty)
+
+        # Тесты без серверной генерации (ритм, bpm) в пакет не попадают
+        for index, test_type in enumerate(self.test_sequence):
+            if test_type in builders:
+                self.jobs[index] = asyncio.create_task(build(builders[test_type]))
+
+    def progress(self) -> dict:
+        done = [job for job in self.jobs.values() if job.done()]
+        failed = sum(1 for job in done if job.cancelled() or job.exception() is not None)
+        return {"total": len(self.jobs), "ready": len(done) - failed, "failed": failed, "finished": len(done) == len(self.jobs)}
+
+    async def get(self, index: int, test_type: str) -> tuple[dict, dict] | None:
+        """
+        Дожидается испытания с номером `index` и возвращает (ответ, test_data).
+        None, если испытания нет в пакете или его не удалось подготовить.
+        """
+        if index >= len(self.test_sequence) or self.test_sequence[index] != test_type or index not in self.jobs:
+            return None
+        try:
+            # shield: отключение клиента не должно отменять подготовку испытания
+            challenge = await asyncio.shield(self.jobs[index])
+        except Exception as e:
+            logger.warning(f"Prepared challenge {index} ({test_type}) is unavailable: {e}")
+            return None
+
+        return challenge_response(challenge), {"user_id": self.user_id, **challenge.test_data}
+
+    async def discard(self):
+        """Отменяет незавершённые задачи и удаляет аудио, принадлежащее испытаниям пакета."""
+        owned_keys = []
+        for job in self.jobs.values():
+            if not job.done():
+                job.cancel()
+            elif not job.cancelled() and job.exception() is None:
+                owned_keys.extend(job.result().owned_keys)
+        for key in owned_keys:
+            await run_in_threadpool(delete_audio, key)
+
+class ChallengeBatches:
+    """Пакеты испытаний по пользователям: у пользователя одна активная сессия тестирования."""
+
+    def __init__(self, ttl: float = CHALLENGE_BATCH_TTL):
+        self.ttl = ttl
+        self._batches: dict[str, ChallengeBatch] = {}
+
+    async def start(self, username: str, user_id: int, test_sequence: list[str], difficulty: str,
+                    builders: dict[str, ChallengeBuilder]) -> ChallengeBatch:
+        await self.discard(username)
+        await self._expire()
+        batch = ChallengeBatch(username, user_id, test_sequence, difficulty)
+        batch.start(builders)
+        self._batches[username] = batch
+        return batch
+
+    def get_batch(self, username: str) -> ChallengeBatch | None:
+        return self._batches.get(username)
+
+    async def take(self, username: str, test_type: str) -> tuple[dict, dict] | None:
+        """Подготовленное испытание для текущего теста пользователя: (ответ, test_data) или None."""
+        batch = self._batches.get(username)
+        if batch is None:
+            return None
+        user_data = await get_user_data(username)
+        if not user_data:
+            return None
+        return await batch.get(user_data.get("current_test_index", 0), test_type)
+
+    async def discard(self, username: str):
+        batch = self._batches.pop(username, None)
+        if batch is not None:
+            await batch.discard()
+
+    async def _expire(self):
+        now = time.time()
+        for username in [name for name, batch in self._batches.items() if now - batch.created > self.ttl]:
+            await self.discard(username)
+
+challenge_batches = ChallengeBatches()
@@ -0,0 +1,135 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft
+from scipy.signal import resample_poly
+
+from utils.audio_buffer import decode_wav
+
+CONVOLUTION_BLOCK_FRAMES = 4096  # Размер блока разбиения импульсной характеристики
+MAX_IMPULSE_SECONDS = 4.0  # Ограничение длины импульсной характеристики (и хвоста реверберации)
+IR_CACHE_SIZE = 16
+
+@dataclass(frozen=True)
+class ImpulseResponse:
+    """
+    Импульсная характеристика, разбитая на блоки и переведённая в частотную область.
+
+    :param partitions: Спектры блоков формы (блоки, block_frames + 1, каналы), complex64.
+    :param block_frames: Размер блока.
+    :param frames: Длина исходной импульсной характеристики.
+    """
+    partitions: np.ndarray
+    block_frames: int
+    frames: int
+
+    @property
+    def channels(self) -> int:
+        return self.partitions.shape[2]
+
+def partition_impulse_response(ir: np.ndarray, block_frames: int = CONVOLUTION_BLOCK_FRAMES) -> ImpulseResponse:
+    """
+    Разбивает импульсную характеристику формы (кадры, каналы) на блоки
+    и считает их спектры (FFT размера 2 * block_frames).
+    """
+    n_blocks = -(-len(ir) // block_frames)
+    padded = np.zeros((n_blocks * block_frames, ir.shape[1]), dtype=np.float32)
+    padded[:len(ir)] = ir
+    blocks = padded.reshape(n_blocks, block_frames, ir.shape[1])
+    partitions = scipy.fft.rfft(blocks, n=2 * block_frames, axis=1).astype(np.complex64)
+    return ImpulseResponse(partitions, block_frames, len(ir))
+
+def convolve(samples: np.ndarray, ir: ImpulseResponse, keep_tail: bool = True) -> np.ndarray:
+    """
+    Свёртка сигнала с импульсной характеристикой методом равномерно разбитой
+    свёртки (overlap-add). Стоимость на блок входа пропорциональна числу блоков
+    импульсной характеристики, то есть фиксирована на секунду аудио.
+
+    :param samples: Сигнал формы (кадры, каналы).
+    :param ir: Импульсная характеристика: одноканальная применяется ко всем каналам.
+    :param keep_tail: Сохранять хвост реверберации после конца сигнала.
+    :return: Результат свёртки (float32).
+    """
+    block = ir.block_frames
+    n_frames, n_channels = samples.shape
+    out_frames = n_frames + ir.frames - 1 if keep_tail else n_frames
+
+    n_in_blocks = -(-n_frames // block)
+    n_out_blocks = -(-out_frames // block)
+    padded = np.zeros((n_in_blocks * block, n_channels), dtype=np.float32)
+    padded[:n_frames] = samples
+    spectra = scipy.fft.rfft(padded.reshape(n_in_blocks, block, n_channels), n=2 * block, axis=1)
+
+    # Линия задержки в частотной области: выходной блок m = сумма X[m - k] * H[k]
+    output_spectra = np.zeros((n_out_blocks, block + 1, n_channels), dtype=np.complex64)
+    for k, partition in enumerate(ir.partitions):
+        if k >= n_out_blocks:
+            break
+        count = min(n_in_blocks, n_out_blocks - k)
+        output_spectra[k:k + count] += spectra[:count] * partition
+
+    output_blocks = scipy.fft.irfft(output_spectra, n=2 * block, axis=1)
+    output = np.zeros(((n_out_blocks + 1) * block, n_channels), dtype=np.float32)
+    output[:n_out_blocks * block] += output_blocks[:, :block].reshape(-1, n_channels)
+    output[block:] += output_blocks[:, block:].reshape(-1, n_channels)
+    return output[:out_frames]
+
+@lru_cache(maxsize=IR_CACHE_SIZE)
+def synthetic_impulse_response(frame_rate: int, channels: int, decay: float, delay_ms: float,
+                               block_frames: int = CONVOLUTION_BLOCK_FRAMES) -> ImpulseResponse:
+    """
+    Синтетическая импульсная характеристика помещения: прямой звук, ранние
+    отражения с шагом `delay_ms` и затуханием `decay` на отражение, и диффузный
+    хвост из экспоненциально затухающего шума (свой на каждый канал).
+    Время реверберации RT60 следует из того же затухания: decay на каждые delay_ms.
+    Энергия характеристики нормирована к единице.
+    """
+    delay_frames = max(int(frame_rate * delay_ms / 1000), 1)
+    rt60 = min(-3 * (delay_ms / 1000) / np.log10(decay), MAX_IMPULSE_SECONDS)
+    length = max(int(rt60 * frame_rate), 10 * delay_frames + 1)
+    ir = np.zeros((length, channels), dtype=np.float32)
+
+    # Прямой звук и ранние отражения
+    ir[0] = 1.0
+    reflections = np.array([decay ** i for i in range(1, 10)])
+    for i, gain in enumerate(reflections, start=1):
+        ir[i * delay_frames] += gain
+
+    # Диффузный хвост: спад на 60 дБ за rt60, энергия равна энергии ранних отражений
+    time = np.arange(length - delay_frames) / frame_rate
+    envelope = 10 ** (-3 * time / rt60)
+    noise = np.random.default_rng(0).standard_normal((len(time), channels)) * envelope[:, None]
+    noise *= np.sqrt(np.sum(reflections ** 2) / np.mean(np.sum(noise ** 2, axis=0)))
+    ir[delay_frames:] += noise.astype(np.float32)
+
+    # Нормируем энергию, чтобы громкость сигнала после реверберации не росла
+    ir /= np.sqrt(np.sum(ir ** 2, axis=0))
+
+    return partition_impulse_response(ir, block_frames)
+
+_loaded_irs: OrderedDict[tuple[str, int], ImpulseResponse] = OrderedDict()
+
+def load_impulse_response(wav_bytes: bytes, frame_rate: int, block_frames: int = CONVOLUTION_BLOCK_FRAMES) -> ImpulseResponse:
+    """
+    Загружает импульсную характеристику из WAV (например, полученного из file-api),
+    приводит к нужной частоте дискретизации и кэширует её спектры по хэшу содержимого.
+    """
+    key = (hashlib.sha256(wav_bytes).hexdigest(), frame_rate)
+    if key in _loaded_irs:
+        _loaded_irs.move_to_end(key)
+        return _loaded_irs[key]
+
+    buffer = decode_wav(wav_bytes)
+    ir = buffer.samples
+    if buffer.frame_rate != frame_rate:
+        ir = resample_poly(ir, frame_rate, buffer.frame_rate, axis=0).astype(np.float32)
+    ir = ir[:int(MAX_IMPULSE_SECONDS * frame_rate)]
+
+    impulse_response = partition_impulse_response(ir, block_frames)
+    _loaded_irs[key] = impulse_response
+    if len(_loaded_irs) > IR_CACHE_SIZE:
+        _loaded_irs.popitem(last=False)
+    return impulse_response
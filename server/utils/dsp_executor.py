@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import getenv
+from typing import Any, Callable
+
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+DSP_WORKERS = int(getenv("DSP_WORKERS", os.cpu_count() or 1))
+DSP_MAX_QUEUE = int(getenv("DSP_MAX_QUEUE", 32))  # Задачи в очереди и в работе
+DSP_JOB_TIMEOUT = float(getenv("DSP_JOB_TIMEOUT", 30))  # Секунды
+DISCONNECT_POLL_INTERVAL = 0.5  # Секунды
+
+def _init_worker():
+    """Каждый процесс получает собственное состояние генератора случайных чисел."""
+    random.seed()
+
+def _timed_call(func: Callable, args: tuple) -> tuple[Any, float, float]:
+    """Выполняется в процессе-воркере: возвращает результат и время начала/конца вычислений."""
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time()
+
+class DSPMetrics:
+    """Счётчики задач и суммарное время ожидания в очереди и вычислений."""
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.compute_total = 0.0
+        self.compute_max = 0.0
+
+    def record(self, queue_wait: float, compute: float):
+        self.completed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.compute_total += compute
+        self.compute_max = max(self.compute_max, compute)
+
+    def snapshot(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "queue_wait_avg_ms": self.queue_wait_total / completed * 1000,
+            "queue_wait_max_ms": self.queue_wait_max * 1000,
+            "compute_avg_ms": self.compute_total / completed * 1000,
+            "compute_max_ms": self.compute_max * 1000,
+        }
+
+class DSPExecutor:
+    """
+    Пул процессов для CPU-тяжёлой обработки аудио, чтобы она не блокировала event loop.
+
+    Число задач в очереди и в работе ограничено `max_queue` (при переполнении - 503),
+    каждая задача ограничена по времени `timeout` (504). Если клиент отключился,
+    ожидающая задача отменяется; уже запущенную в процессе задачу прервать нельзя,
+    её результат просто отбрасывается. Место в очереди освобождается, только когда задача
+    действительно завершилась, поэтому зависшие после таймаута задачи тоже учитываются в `max_queue`.
+    """
+
+    def __init__(self, workers: int = DSP_WORKERS, max_queue: int = DSP_MAX_QUEUE, timeout: float = DSP_JOB_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self.metrics = DSPMetrics()
+        self._pool: ProcessPoolExecutor | None = None
+
+    def start(self):
+        # spawn вместо fork: к моменту старта в процессе уже работают потоки (motor, uvicorn)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        logger.info(f"DSP executor started with {self.workers} workers")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, func: Callable, *args, request: Request | None = None):
+        """
+        Выполняет `func(*args)` в пуле процессов и возвращает результат.
+
+        :param func: Функция уровня модуля (должна сериализоваться pickle).
+        :param request: Запрос клиента: при его отключении задача отменяется.
+        """
+        if self._pool is None:
+            raise RuntimeError("DSP executor is not started")
+        if self.pending >= self.max_queue:
+            self.metrics.rejected += 1
+            raise HTTPException(status_code=503, detail="DSP queue is full")
+
+        self.pending += 1
+        submitted = time.time()
+        try:
+            future = self._pool.submit(_timed_call, func, args)
+        except Exception:
+            self.pending -= 1
+            raise
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: self._release(loop))
+        job = asyncio.wrap_future(future)
+        watcher = asyncio.create_task(self._wait_disconnect(request)) if request is not None else None
+        try:
+            done, _ = await asyncio.wait(
+                [task for task in (job, watcher) if task is not None],
+                timeout=self.timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if job not in done:
+                # Отмена обёртки отменяет и задачу в пуле, если она ещё не начала выполняться
+                job.cancel()
+                if watcher is not None and watcher in done:
+                    self.metrics.cancelled += 1
+                    raise HTTPException(status_code=499, detail="Client disconnected")
+                self.metrics.timed_out += 1
+                raise HTTPException(status_code=504, detail="DSP job timed out")
+
+            try:
+                result, started, finished = job.result()
+            except Exception:
+                self.metrics.failed += 1
+                raise
+            self.metrics.record(queue_wait=started - submitted, compute=finished - started)
+            return result
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        """Освобождает место в очереди (вызывается из потока пула, когда задача завершилась или отменена)."""
+        try:
+            loop.call_soon_threadsafe(self._decrement_pending)
+        except RuntimeError:
+            pass  # Цикл событий уже закрыт: сервер остановлен
+
+    def _decrement_pending(self):
+        self.pending -= 1
+
+    @staticmethod
+    async def _wait_disconnect(request: Request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "max_queue": self.max_queue, **self.metrics.snapshot()}
+
+dsp_executor = DSPExecutor()
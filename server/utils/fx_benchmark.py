@@ -0,0 +1,72 @@
+import io
+import sys
+import time
+import wave
+
+import numpy as np
+
+from utils.fx_processor import (
+    apply_reverb, apply_delay, apply_distortion, apply_tremolo, apply_flanger,
+    apply_chorus, apply_vibrato, apply_compression, apply_saturation
+)
+
+EFFECTS = [
+    ("Reverb", apply_reverb, [0.6, 75]),
+    ("Delay", apply_delay, [300, 0.5]),
+    ("Distortion", apply_distortion, [2]),
+    ("Tremolo", apply_tremolo, [7, 0.6]),
+    ("Flanger", apply_flanger, [0.3, 5]),
+    ("Chorus", apply_chorus, [0.5, 5]),
+    ("Vibrato", apply_vibrato, [0.7, 0.03]),
+    ("Compression", apply_compression, [-20, 8]),
+    ("Saturation", apply_saturation, [2]),
+]
+
+def make_test_wav(duration: float = 15.0, frame_rate: int = 44100) -> bytes:
+    """Создаёт 32-битный стерео WAV с тоном и шумом — аналог тестового трека."""
+    time_axis = np.arange(int(duration * frame_rate)) / frame_rate
+    rng = np.random.default_rng(0)
+    tone = 0.4 * np.sin(2 * np.pi * 220 * time_axis) + 0.1 * rng.standard_normal(time_axis.size)
+    stereo = np.stack([tone, np.roll(tone, 100)], axis=1)
+    samples = (np.clip(stereo, -1, 1) * np.iinfo(np.int32).max).astype(np.int32)
+
+    output_io = io.BytesIO()
+    with wave.open(output_io, "wb") as wav_out:
+        wav_out.setnchannels(2)
+        wav_out.setsampwidth(4)
+        wav_out.setframerate(frame_rate)
+        wav_out.writeframes(samples.tobytes())
+    return output_io.getvalue()
+
+def wav_duration(wav_bytes: bytes) -> float:
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav_in:
+        return wav_in.getnframes() / wav_in.getframerate()
+
+def run_benchmark(wav_bytes: bytes, repeats: int = 3) -> list[tuple[str, float]]:
+    """
+    Замеряет время обработки каждым эффектом.
+
+    :return: Список (эффект, мс обработки на секунду аудио), лучшее из `repeats` запусков.
+    """
+    duration = wav_duration(wav_bytes)
+    results = []
+    for effect_name, effect_func, effect_args in EFFECTS:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            effect_func(wav_bytes, *effect_args)
+            timings.append(time.perf_counter() - started)
+        results.append((effect_name, min(timings) * 1000 / duration))
+    return results
+
+if __name__ == "__main__":
+    # Запуск из каталога server: python -m utils.fx_benchmark [путь_к_wav]
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            wav_data = f.read()
+    else:
+        wav_data = make_test_wav()
+
+    print(f"Длительность трека: {wav_duration(wav_data):.1f} с")
+    for effect_name, ms_per_second in run_benchmark(wav_data):
+        print(f"{effect_name:<12} {ms_per_second:8.1f} мс / с аудио")
@@ -1,89 +1,122 @@
 import io
 import numpy as np
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt
 from pydub import AudioSegment, effects
-import wave
-import numpy as np
-import scipy.signal as signal
-import soundfile as sf
 import random
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+
+from utils.audio_buffer import AudioBuffer, decode_wav, encode_wav
+from utils.convolution import ImpulseResponse, convolve, synthetic_impulse_response, load_impulse_response
+from utils.track_loader import StoredTrack, track_loader
+
+FILTER_CHUNK_FRAMES = 65536  # Размер фрагмента при потоковой фильтрации
+FX_VERSION = 2  # Меняется при изменении алгоритмов эффектов: входит в ключ кэша рендеров
+
+def process_eq(buffer: AudioBuffer, filter_width: float, filter_freq: float, gain: float) -> AudioBuffer:
+    """
+    Применяет полосовой фильтр или усиливает частоты.
+
+    :param buffer: Исходное аудио.
+    :param filter_width: Ширина полосового фильтра (в Гц).
+    :param filter_freq: Центральная частота фильтра (в Гц).
+    :param gain: Усиление/ослабление.
+    :return: Обработанное аудио.
+    """
+    if gain > 0:
+        processed_data = bandpass_gain(buffer.samples, filter_freq, filter_width, gain, buffer.frame_rate)
+    else:
+        processed_data = bandstop_filter(buffer.samples, filter_freq, filter_width, buffer.frame_rate)
+    return buffer.with_samples(processed_data)
+
+def load_source(source: bytes | StoredTrack) -> AudioBuffer:
+    """Аудио для обработки: декодированный WAV или трек хранилища, открытый через memmap (без копирования)."""
+    if isinstance(source, StoredTrack):
+        return track_loader.load(source)
+    return decode_wav(source)
+
+def render_stored_track(track: StoredTrack) -> bytes:
+    """Кодирует трек хранилища в WAV (исходный трек испытания)."""
+    return encode_wav(track_loader.load(track))
 
-def one_band_eq(wav_bytes: bytes, filter_width: float, filter_freq: float, gain: float) -> bytes:
+def one_band_eq(source: bytes | StoredTrack, filter_width: float, filter_freq: float, gain: float) -> bytes:
     """
     Применяет полосовой фильтр или усиливает частоты в WAV-файле.
 
-    :param wav_bytes: Байтовая строка исходного WAV-файла.
+    :param source: Байтовая строка исходного WAV-файла или трек хранилища.
     :param filter_width: Ширина полосового фильтра (в Гц).
     :param filter_freq: Центральная частота фильтра (в Гц).
     :param gain: Усиление/ослабление.
     :return: Обработанный WAV-файл в виде байтовой строки.
     """
-    # Чтение WAV-файла
-    with wave.open(io.BytesIO(wav_bytes), 'rb') as wav_in:
-        params = wav_in.getparams()
-        nchannels, sampwidth, framerate, nframes = params[:4]
-
-        # Проверяем, что ширина сэмпла совпадает с ожиданиями (4 байта = 32 бита)
-        if sampwidth != 4:
-            raise ValueError("Эта функция поддерживает только 32-битные WAV файлы.")
+    return encode_wav(process_eq(load_source(source), filter_width, filter_freq, gain))
+
+@lru_cache(maxsize=512)
+def _design_band_filter(central_freq: int, bandwidth: int, samp_rate: int, btype: str) -> np.ndarray:
+    """Проектирует фильтр Баттерворта 3-го порядка в виде секций второго порядка (float32)."""
+    nyquist = 0.5 * samp_rate
+    # Ограничиваем полосу: у частоты Найквиста и нуля фильтр вырождается
+    lowcut = max(central_freq - bandwidth / 2, 1.0)
+    highcut = min(central_freq + bandwidth / 2, nyquist * 0.99)
+    if lowcut >= highcut:
+        raise ValueError("Полоса фильтра выходит за пределы допустимых частот")
+
+    sos = butter(3, [lowcut / nyquist, highcut / nyquist], btype=btype, output='sos')
+    return sos.astype(np.float32)
+
+def design_band_filter(central_freq: float, bandwidth: float, samp_rate: int, btype: str) -> np.ndarray:
+    """
+    Возвращает коэффициенты полосового (bandpass) или режекторного (bandstop) фильтра.
+    Частоты округляются до 1 Гц, поэтому повторные запросы берут готовый фильтр из кэша.
+    """
+    return _design_band_filter(round(central_freq), max(round(bandwidth), 1), samp_rate, btype)
 
-        # Читаем аудиоданные в numpy массив
-        audio_data = np.frombuffer(wav_in.readframes(nframes), dtype=np.int32)
+def stream_sosfilt(sos: np.ndarray, chunks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+    """
+    Фильтрует сигнал по частям, передавая состояние фильтра между ними.
+    Результат совпадает с фильтрацией всего сигнала сразу, но промежуточные
+    буферы занимают память только на один фрагмент.
 
-        # Если стерео, делаем reshape для разделения каналов
-        if nchannels == 2:
-            audio_data = audio_data.reshape(-1, 2)
-    if gain > 0:
-        processed_data = bandpass_gain(audio_data, filter_freq, filter_width, gain, framerate)
-    else:
-        processed_data = bandstop_filter(audio_data, filter_freq, filter_width, framerate)
-    # Преобразуем массив обратно в WAV-байты
-    output_io = io.BytesIO()
-    with wave.open(output_io, 'wb') as wav_out:
-        wav_out.setparams(params)
-        # Уплощаем массив для записи, если он многоканальный
-        wav_out.writeframes(processed_data.astype(np.int32).tobytes())  # Преобразуем обратно в int32 перед записью
+    :param sos: Секции второго порядка.
+    :param chunks: Фрагменты сигнала формы (кадры, каналы).
+    :return: Отфильтрованные фрагменты (float32).
+    """
+    zi = None
+    for chunk in chunks:
+        if zi is None:
+            zi = np.zeros((sos.shape[0], 2, chunk.shape[1]), dtype=np.float32)
+        filtered, zi = sosfilt(sos, chunk, axis=0, zi=zi)
+        yield filtered
 
-    return output_io.getvalue()
+def _chunks(audio_data: np.ndarray, chunk_frames: int = FILTER_CHUNK_FRAMES) -> Iterator[np.ndarray]:
+    for start in range(0, len(audio_data), chunk_frames):
+        yield audio_data[start:start + chunk_frames]
 
 def bandpass_gain(audio_data: np.ndarray, central_freq: float, bandwidth: float, gain_dB: float, samp_rate: int) -> np.ndarray:
     """
     Усиливает указанную полосу частот в аудиосигнале, как в эквалайзере.
     
-    :param audio_data: numpy массив с аудиоданными (int32, двухканальный сигнал).
+    :param audio_data: numpy массив с аудиоданными (float32, кадры x каналы).
     :param central_freq: Центральная частота полосы пропускания в Гц.
     :param bandwidth: Ширина полосы частот в Гц.
     :param gain_dB: Усиление/ослабление в децибелах (положительное для усиления, отрицательное для ослабления).
     :param samp_rate: Частота дискретизации (samples per second) аудиофайла.
     :return: numpy массив с обработанным аудиосигналом (с измененной полосой частот).
     """
-    # Проектируем фильтр Баттерворта для полосы пропускания
-    lowcut = central_freq - bandwidth / 2
-    highcut = central_freq + bandwidth / 2
-
-    # Создаем фильтр Баттерворта
-    b, a = butter(3, [lowcut / (0.5 * samp_rate), highcut / (0.5 * samp_rate)], btype='bandpass')
-    
-    # Применяем фильтр к аудиоданным (по оси 0, так как каналы могут быть разные)
-    filtered_audio = lfilter(b, a, audio_data, axis=0)
+    sos = design_band_filter(central_freq, bandwidth, samp_rate, 'bandpass')
 
     # Преобразуем усиление из децибел в линейный коэффициент
-    gain = 10 ** (gain_dB / 20)
-
-    # Усиливаем или ослабляем только отфильтрованный сигнал
-    filtered_audio_with_gain = filtered_audio * gain
-
-    # Остальная часть сигнала (вне полосы частот) не изменяется
-    # Объединяем усиленную полосу с остальным сигналом
-    output_audio = audio_data + (filtered_audio_with_gain - filtered_audio)
-
-    # Ограничиваем значения для предотвращения переполнения
-    max_val = np.iinfo(np.int32).max
-    min_val = np.iinfo(np.int32).min
-    output_audio = np.clip(output_audio, min_val, max_val)
-
-    # Приводим результат обратно к типу int32
-    output_audio = output_audio.astype(np.int32)
+    gain = np.float32(10 ** (gain_dB / 20))
+
+    # Остальная часть сигнала (вне полосы частот) не изменяется:
+    # добавляем к нему отфильтрованную полосу с учётом усиления
+    output_audio = np.empty(audio_data.shape, dtype=np.float32)
+    start = 0
+    for filtered_chunk in stream_sosfilt(sos, _chunks(audio_data)):
+        end = start + len(filtered_chunk)
+        np.multiply(filtered_chunk, gain - 1, out=filtered_chunk)
+        np.add(audio_data[start:end], filtered_chunk, out=output_audio[start:end])
+        start = end
 
     return output_audio
 
@@ -91,29 +124,21 @@ def bandstop_filter(audio_data: np.ndarray, central_freq: float, bandwidth: floa
     """
     Ослабляет указанную полосу частот в аудиосигнале с использованием bandstop фильтра.
     
-    :param audio_data: numpy массив с аудиоданными (int32, двухканальный сигнал).
+    :param audio_data: numpy массив с аудиоданными (float32, кадры x каналы).
     :param central_freq: Центральная частота полосы подавления в Гц.
     :param bandwidth: Ширина полосы частот в Гц.
     :param samp_rate: Частота дискретизации (samples per second) аудиофайла.
     :return: numpy массив с обработанным аудиосигналом с подавленной полосой частот.
     """
-    # Расчет частот среза для bandstop
-    lowcut = central_freq - bandwidth / 2
-    highcut = central_freq + bandwidth / 2
+    sos = design_band_filter(central_freq, bandwidth, samp_rate, 'bandstop')
 
-    # Проектируем фильтр Баттерворта типа bandstop
-    b, a = butter(3, [lowcut / (0.5 * samp_rate), highcut / (0.5 * samp_rate)], btype='bandstop')
-    
-    # Применяем фильтр к аудиоданным (по оси 0, так как каналы могут быть разные)
-    filtered_audio = lfilter(b, a, audio_data, axis=0)
-
-    # Ограничиваем значения для предотвращения переполнения
-    max_val = np.iinfo(np.int32).max
-    min_val = np.iinfo(np.int32).min
-    output_audio = np.clip(filtered_audio, min_val, max_val)
+    output_audio = np.empty(audio_data.shape, dtype=np.float32)
+    start = 0
+    for filtered_chunk in stream_sosfilt(sos, _chunks(audio_data)):
+        output_audio[start:start + len(filtered_chunk)] = filtered_chunk
+        start += len(filtered_chunk)
 
-    # Возвращаем отфильтрованный сигнал
-    return output_audio.astype(np.int32)
+    return output_audio
 
 def normalize_wav_bytes(wav_bytes: bytes, target_dBFS=-14.0) -> bytes:
     """
@@ -140,326 +165,339 @@ def normalize_wav_bytes(wav_bytes: bytes, target_dBFS=-14.0) -> bytes:
         print(f"Ошибка при обработке аудио: {e}")
         return None
 
-def bytes_to_audiosegment(audio_bytes: bytes) -> AudioSegment:
-    """Конвертирует байты в объект AudioSegment"""
-    return AudioSegment.from_file(io.BytesIO(audio_bytes), format="wav")
+# 🎶 1. Реверберация (Reverb)
+def process_convolution_reverb(buffer: AudioBuffer, impulse_response: ImpulseResponse, mix: float = 1.0) -> AudioBuffer:
+    """
+    Свёрточная реверберация: свёртка с импульсной характеристикой помещения.
+    Хвост реверберации сохраняется, поэтому результат длиннее исходного.
 
-def audiosegment_to_bytes(audio: AudioSegment) -> bytes:
-    """Конвертирует объект AudioSegment обратно в байты"""
-    buffer = io.BytesIO()
-    audio.export(buffer, format="wav")
-    return buffer.getvalue()
+    :param buffer: Исходное аудио
+    :param impulse_response: Импульсная характеристика (в частотной области)
+    :param mix: Доля обработанного сигнала (1 - только свёртка)
+    :return: Обработанное аудио
+    """
+    wet = convolve(buffer.samples, impulse_response)
+    if mix < 1:
+        wet *= np.float32(mix)
+        wet[:buffer.frames] += buffer.samples * np.float32(1 - mix)
+    return buffer.with_samples(wet)
 
-# 🎶 1. Реверберация (Reverb)
-def apply_reverb(audio_bytes: bytes, decay: float = 0.4, delay_ms: int = 50) -> bytes:
+def process_reverb(buffer: AudioBuffer, decay: float = 0.4, delay_ms: int = 50) -> AudioBuffer:
     """
-    Добавляет эффект реверберации (Reverb) к аудиофайлу.
-    :param audio_bytes: Байтовая строка аудиофайла (WAV)
+    Добавляет эффект реверберации (Reverb) - пресет свёрточной реверберации
+    с синтетической импульсной характеристикой.
+    :param buffer: Исходное аудио
     :param decay: Степень затухания (0.2-0.8), чем выше, тем больше эхо.
     :param delay_ms: Задержка отражения (10-100 мс), влияет на размер помещения.
-    :return: Обработанный аудиофайл в байтах
+    :return: Обработанное аудио
     """
-    audio = bytes_to_audiosegment(audio_bytes)
-    frame_rate = audio.frame_rate
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-
-    # Преобразуем задержку из мс в количество сэмплов
-    delay_samples = int(frame_rate * delay_ms / 1000)
-
-    # Создаем пустой массив для отражений
-    reverb_samples = np.zeros(len(samples) + delay_samples * 10)  # 10 отражений
-
-    # Добавляем оригинальный сигнал
-    reverb_samples[:len(samples)] += samples
+    impulse_response = synthetic_impulse_response(buffer.frame_rate, buffer.channels, decay, delay_ms)
+    return process_convolution_reverb(buffer, impulse_response)
 
-    # Добавляем затухающие отражения
-    for i in range(1, 10):
-        reverb_samples[i * delay_samples:i * delay_samples + len(samples)] += samples * (decay ** i)
-
-    # Обрезаем до оригинального размера
-    reverb_samples = reverb_samples[:len(samples)]
-
-    # Ограничиваем значения
-    max_value = np.iinfo(np.int32).max
-    reverb_samples = np.clip(reverb_samples, -max_value, max_value).astype(np.int32)
+def apply_reverb(audio_bytes: bytes, decay: float = 0.4, delay_ms: int = 50) -> bytes:
+    """Добавляет эффект реверберации к WAV-файлу (см. `process_reverb`)."""
+    return encode_wav(process_reverb(decode_wav(audio_bytes), decay, delay_ms))
 
-    # Преобразуем массив обратно в аудио
-    processed_audio = audio._spawn(reverb_samples.tobytes())
-    return audiosegment_to_bytes(processed_audio)
+def apply_convolution_reverb(audio_bytes: bytes, ir_bytes: bytes, mix: float = 1.0) -> bytes:
+    """Свёрточная реверберация WAV-файла с импульсной характеристикой из WAV (например, из file-api)."""
+    buffer = decode_wav(audio_bytes)
+    impulse_response = load_impulse_response(ir_bytes, buffer.frame_rate)
+    return encode_wav(process_convolution_reverb(buffer, impulse_response, mix))
 
 # 🎶 2. Дилей (Delay)
-def apply_delay(audio_bytes: bytes, delay_ms: int = 300, decay: float = 0.5) -> bytes:
-    # Преобразуем байты в объект AudioSegment
-    audio = bytes_to_audiosegment(audio_bytes)
-    # Вычисляем количество сэмплов для задержки
-    delay_samples = int(audio.frame_rate * delay_ms / 1000)
-    # Получаем сэмплы аудио как массив
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32) 
-    # Создаем массив для задержанных сэмплов
-    delayed_samples = np.zeros(len(samples) + delay_samples)
-    # Копируем оригинальные сэмплы в начало
+def process_delay(buffer: AudioBuffer, delay_ms: int = 300, decay: float = 0.5) -> AudioBuffer:
+    # Вычисляем количество кадров для задержки
+    delay_samples = int(buffer.frame_rate * delay_ms / 1000)
+    samples = buffer.samples
+    # Создаем массив для задержанных сэмплов и копируем оригинальные сэмплы в начало
+    delayed_samples = np.zeros((len(samples) + delay_samples, buffer.channels), dtype=np.float32)
     delayed_samples[:len(samples)] = samples
     # Добавляем сэмплы с задержкой с учетом коэффициента затухания
-    delayed_samples[delay_samples:] += samples * decay
-    # Ограничиваем сэмплы в диапазоне допустимых значений для 16-битных аудиоформатов
-    max_value = np.iinfo(np.int32).max
-    delayed_samples = np.clip(delayed_samples, -max_value, max_value)
-    # Преобразуем сэмплы обратно в целочисленные значения
-    processed_samples = delayed_samples.astype(np.int32)
-    # Создаем новый объект AudioSegment из обработанных сэмплов
-    processed_audio = audio._spawn(processed_samples.tobytes())
-    # Преобразуем аудио обратно в байты и возвращаем
-    return audiosegment_to_bytes(processed_audio)
+    delayed_samples[delay_samples:] += samples * np.float32(decay)
+    return buffer.with_samples(delayed_samples)
+
+def apply_delay(audio_bytes: bytes, delay_ms: int = 300, decay: float = 0.5) -> bytes:
+    """Добавляет эффект дилея к WAV-файлу (см. `process_delay`)."""
+    return encode_wav(process_delay(decode_wav(audio_bytes), delay_ms, decay))
 
 # 🎶 3. Сатурация (Saturation) – мягкое аналоговое насыщение
+def process_saturation(buffer: AudioBuffer, amount: float = 0.5) -> AudioBuffer:
+    # Сатурация через гиперболический тангенс
+    return buffer.with_samples(np.tanh(buffer.samples * np.float32(amount)))
+
 def apply_saturation(audio_bytes: bytes, amount: float = 0.5) -> bytes:
-    audio = bytes_to_audiosegment(audio_bytes)
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    max_value = np.iinfo(np.int32).max  # Для 32-битного аудио
-    samples /= max_value
-
-    processed_samples = np.tanh(samples * amount)  # Сатурация через гиперболический тангенс
-    saturated_samples = (processed_samples * np.iinfo(audio.array_type).max).astype(audio.array_type)
-
-    samples *= max_value
-    saturated_samples = np.clip(saturated_samples, -max_value, max_value)
-    # Преобразуем сэмплы обратно в целочисленные значения
-    processed_samples = saturated_samples.astype(np.int32)
-    # Создаем новый объект AudioSegment из обработанных сэмплов
-    processed_audio = audio._spawn(processed_samples.tobytes())
-    # Преобразуем аудио обратно в байты и возвращаем
-    return audiosegment_to_bytes(processed_audio)
+    """Добавляет сатурацию к WAV-файлу (см. `process_saturation`)."""
+    return encode_wav(process_saturation(decode_wav(audio_bytes), amount))
+
+# 🎶 4. Дисторшн (Distortion)
+def process_distortion(buffer: AudioBuffer, gain: float = 10) -> AudioBuffer:
+    # Применяем усиление (гейн) и жесткое ограничение перегруза (ограничиваем в диапазоне [-1, 1])
+    return buffer.with_samples(np.clip(buffer.samples * np.float32(gain), -1, 1))
 
 def apply_distortion(audio_bytes: bytes, gain: float = 10) -> bytes:
-    # Преобразуем байты в объект AudioSegment
-    audio = bytes_to_audiosegment(audio_bytes)
-    
-    # Получаем сэмплы аудио как массив
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-
-    max_value = np.iinfo(np.int32).max  # Для 32-битного аудио
-
-    samples /= max_value
-    #
-    ## Применяем усиление (гейн)
-    samples *= gain
-    #print(samples)
-    ## Применяем жесткое ограничение перегруза (ограничиваем в диапазоне [-1, 1])
-    samples = np.clip(samples, -1, 1)
-    samples *= max_value
-    
-    # Преобразуем сэмплы обратно в целочисленные значения с учетом максимума для 32-битного формата
-    distorted_samples = np.clip(samples, -max_value, max_value)
-    # Преобразуем сэмплы обратно в целочисленные значения
-    processed_samples = distorted_samples.astype(np.int32)
-    
-    # Создаем новый объект AudioSegment из обработанных сэмплов
-    processed_audio = audio._spawn(processed_samples.tobytes())
-    
-    # Возвращаем аудио в формате байтов
-    return audiosegment_to_bytes(processed_audio)
+    """Добавляет дисторшн к WAV-файлу (см. `process_distortion`)."""
+    return encode_wav(process_distortion(decode_wav(audio_bytes), gain))
 
 # 🎶 5. Компрессия (Compression)
-def apply_compression(audio_bytes: bytes, threshold: float = -20, ratio: float = 4) -> bytes:
-    audio = bytes_to_audiosegment(audio_bytes)
+def process_compression(buffer: AudioBuffer, threshold: float = -20, ratio: float = 4) -> AudioBuffer:
+    # Компрессор pydub работает с целочисленным PCM: собираем сегмент из сырых сэмплов,
+    # без разбора WAV-контейнера
+    max_value = np.iinfo(np.int32).max
+    pcm = (np.clip(buffer.samples, -1, 1) * np.float64(max_value)).astype(np.int32)
+    audio = AudioSegment(data=pcm.tobytes(), sample_width=4, frame_rate=buffer.frame_rate, channels=buffer.channels)
     compressed_audio = effects.compress_dynamic_range(audio, threshold=threshold, ratio=ratio)
-    return audiosegment_to_bytes(compressed_audio)
 
-# 🎶 6. Модуляция – Хорус (Chorus)
-def apply_chorus(audio_bytes: bytes, rate_hz: float = 1.5, depth_ms: int = 25) -> bytes:
+    compressed_samples = np.frombuffer(compressed_audio.raw_data, dtype=np.int32).reshape(-1, buffer.channels)
+    return buffer.with_samples((compressed_samples / max_value).astype(np.float32))
+
+def apply_compression(audio_bytes: bytes, threshold: float = -20, ratio: float = 4) -> bytes:
+    """Добавляет компрессию к WAV-файлу (см. `process_compression`)."""
+    return encode_wav(process_compression(decode_wav(audio_bytes), threshold, ratio))
+
+def _delay_taps(read_pos: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Добавляет эффект хорус (chorus) к аудиофайлу.
-    :param audio_bytes: Байтовая строка аудиофайла (WAV)
-    :param rate_hz: Частота модуляции задержки (0.5 - 3 Гц)
-    :param depth_ms: Глубина модуляции задержки (обычно 20-30 мс)
-    :return: Обработанный аудиофайл в байтах
+    Предрасчитывает индексы и веса линейной интерполяции для чтения в дробных позициях.
+
+    Индексы относятся к сигналу с одним нулевым кадром в начале,
+    поэтому позиции до начала сигнала читают тишину.
     """
-    audio = bytes_to_audiosegment(audio_bytes)
-    frame_rate = audio.frame_rate
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    
-    # Переводим задержку в сэмплы
-    max_delay_samples = int((depth_ms / 1000) * frame_rate)
+    index = np.floor(read_pos).astype(np.int64)
+    frac = (read_pos - index).astype(np.float32)[:, None]
+    left = np.clip(index + 1, 0, None)
+    right = np.clip(index + 2, 0, None)
+    return left, right, frac
+
+def _read_delayed(padded: np.ndarray, taps: tuple[np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+    """Читает сигнал (с нулевым кадром в начале) по предрасчитанным отводам."""
+    left, right, frac = taps
+    left_samples = padded[left]
+    return left_samples + (padded[right] - left_samples) * frac
+
+def _feedback_comb(delayed: np.ndarray, delay_samples: np.ndarray, feedback: float) -> np.ndarray:
+    """
+    Решает рекуррентность обратной связи y[i] = delayed[i] + feedback * y[i - d[i]].
 
-    # Генерируем сигнал модуляции (синусоидальный LFO)
-    time = np.arange(len(samples))
-    lfo = np.sin(2 * np.pi * rate_hz * time / frame_rate)  # LFO-генератор (модулирует задержку)
+    Вместо цикла по сэмплам используется «перескакивание указателей»: за каждый
+    проход каждый сэмпл накапливает вдвое больше отражений, поэтому после r проходов
+    учтено 2 ** r отражений, а остаток не превышает feedback ** (2 ** r).
 
-    # Рассчитываем изменяющуюся задержку (LFO изменяет время задержки)
-    modulated_delay = ((lfo + 1) / 2) * max_delay_samples  # Диапазон: [0, max_delay_samples]
+    :param delayed: Задержанный сигнал формы (кадры, каналы).
+    :param delay_samples: Целочисленная задержка обратной связи для каждого кадра.
+    :param feedback: Коэффициент обратной связи.
+    :return: Сигнал с обратной связью той же формы.
+    """
+    n_frames = delayed.shape[0]
+    time = np.arange(n_frames)
+
+    # Кадр n_frames - нулевой «сток»: туда указывают кадры без обратной связи
+    # (задержка меньше сэмпла, иначе выход зависел бы сам от себя, или источник до начала сигнала)
+    source = time - delay_samples
+    has_feedback = (delay_samples >= 1) & (source >= 0)
+    source = np.append(np.where(has_feedback, source, n_frames), n_frames)
+    gain = np.append(np.where(has_feedback, feedback, 0), 0).astype(np.float32)
+
+    wet = np.zeros((n_frames + 1, delayed.shape[1]), dtype=np.float32)
+    wet[:n_frames] = delayed
+
+    # Не больше log2(n) проходов: к этому моменту все цепочки доходят до «стока»
+    tolerance = np.finfo(np.float32).eps
+    for _ in range(int(np.ceil(np.log2(n_frames + 1))) + 1):
+        if gain.max() <= tolerance:
+            break
+        wet = wet + gain[:, None] * wet[source]
+        gain = gain * gain[source]
+        source = source[source]
+
+    return wet[:n_frames]
+
+def modulated_delay(samples: np.ndarray, frame_rate: int, rate_hz: float, depth_ms: float,
+                    feedback: float = 0.0) -> np.ndarray:
+    """
+    Векторизованная модулируемая линия задержки (основа хоруса и флэнджера).
+
+    Задержка меняется синусоидальным LFO в диапазоне [0, depth_ms] и читается
+    с дробной точностью (линейная интерполяция). Обратная связь идёт через
+    задержку, округлённую до целого числа сэмплов.
+
+    :param samples: Сигнал формы (кадры, каналы), float32.
+    :param frame_rate: Частота дискретизации.
+    :param rate_hz: Частота LFO.
+    :param depth_ms: Максимальная задержка в мс.
+    :param feedback: Коэффициент обратной связи (0 - без обратной связи).
+    :return: Задержанный (wet) сигнал той же формы.
+    """
+    n_frames, n_channels = samples.shape
+    max_delay_samples = depth_ms / 1000 * frame_rate
 
-    # Создаём новый массив с задержкой
-    delayed_samples = np.zeros_like(samples)
-    for i in range(len(samples)):
-        delay = int(modulated_delay[i])  # Получаем текущую задержку в сэмплах
-        if i - delay >= 0:
-            delayed_samples[i] = samples[i - delay]  # Задержанный сигнал
+    time = np.arange(n_frames)
+    lfo = np.sin(2 * np.pi * rate_hz * time / frame_rate)
+    modulated_delay_samples = (lfo + 1) / 2 * max_delay_samples  # Диапазон: [0, max_delay_samples]
 
-    # Смешиваем оригинальный и задержанный сигнал (50/50)
-    chorus_samples = (samples + delayed_samples) / 2
+    # Буфер с нулевым кадром в начале: чтение до начала сигнала даёт тишину
+    padded = np.zeros((n_frames + 1, n_channels), dtype=np.float32)
+    padded[1:] = samples
+    delayed = _read_delayed(padded, _delay_taps(time - modulated_delay_samples))
 
-    # Ограничение значений
-    max_value = np.iinfo(np.int32).max
-    chorus_samples = np.clip(chorus_samples, -max_value, max_value).astype(np.int32)
+    if feedback == 0 or n_frames == 0:
+        return delayed
+    return _feedback_comb(delayed, np.rint(modulated_delay_samples).astype(np.int64), feedback)
 
-    # Преобразуем массив обратно в аудио
-    processed_audio = audio._spawn(chorus_samples.tobytes())
-    return audiosegment_to_bytes(processed_audio)
+# 🎶 6. Модуляция – Хорус (Chorus)
+def process_chorus(buffer: AudioBuffer, rate_hz: float = 1.5, depth_ms: int = 25) -> AudioBuffer:
+    """
+    Добавляет эффект хорус (chorus).
+    :param buffer: Исходное аудио
+    :param rate_hz: Частота модуляции задержки (0.5 - 3 Гц)
+    :param depth_ms: Глубина модуляции задержки (обычно 20-30 мс)
+    :return: Обработанное аудио
+    """
+    delayed_samples = modulated_delay(buffer.samples, buffer.frame_rate, rate_hz, depth_ms)
+
+    # Смешиваем оригинальный и задержанный сигнал (50/50)
+    return buffer.with_samples((buffer.samples + delayed_samples) / 2)
+
+def apply_chorus(audio_bytes: bytes, rate_hz: float = 1.5, depth_ms: int = 25) -> bytes:
+    """Добавляет эффект хорус к WAV-файлу (см. `process_chorus`)."""
+    return encode_wav(process_chorus(decode_wav(audio_bytes), rate_hz, depth_ms))
 
 # 🎶 7. Модуляция – Флэнджер (Flanger)
-def apply_flanger(audio_bytes: bytes, rate_hz: float = 0.5, depth_ms: int = 10, feedback: float = 0.5) -> bytes:
+def process_flanger(buffer: AudioBuffer, rate_hz: float = 0.5, depth_ms: int = 10, feedback: float = 0.5) -> AudioBuffer:
     """
-    Добавляет эффект флэнджер (flanger) к аудиофайлу.
-    :param audio_bytes: Байтовая строка аудиофайла (WAV)
+    Добавляет эффект флэнджер (flanger).
+    :param buffer: Исходное аудио
     :param rate_hz: Частота модуляции задержки (0.1 - 3 Гц)
     :param depth_ms: Глубина модуляции задержки (обычно 5-15 мс)
     :param feedback: Коэффициент обратной связи (0 - без обратной связи, 1 - сильный резонанс)
-    :return: Обработанный аудиофайл в байтах
+    :return: Обработанное аудио
     """
-    audio = bytes_to_audiosegment(audio_bytes)
-    frame_rate = audio.frame_rate
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    
-    # Переводим глубину задержки в сэмплы
-    max_delay_samples = int((depth_ms / 1000) * frame_rate)
-
-    # Генерируем сигнал модуляции (LFO) для изменения задержки
-    time = np.arange(len(samples))
-    lfo = np.sin(2 * np.pi * rate_hz * time / frame_rate)  # Генератор низкой частоты
-
-    # Рассчитываем изменяющуюся задержку (LFO изменяет время задержки)
-    modulated_delay = ((lfo + 1) / 2) * max_delay_samples  # Диапазон: [0, max_delay_samples]
-
-    # Создаём массив для обработанных сэмплов
-    delayed_samples = np.zeros_like(samples)
-    
-    # Применяем задержку и обратную связь
-    for i in range(len(samples)):
-        delay = int(modulated_delay[i])  # Текущее значение задержки в сэмплах
-        if i - delay >= 0:
-            delayed_samples[i] = samples[i - delay] + delayed_samples[i - delay] * feedback  # Задержанный сигнал с обратной связью
+    # Задержанный сигнал с обратной связью
+    delayed_samples = modulated_delay(buffer.samples, buffer.frame_rate, rate_hz, depth_ms, feedback)
 
     # Смешиваем оригинальный и задержанный сигнал
-    flanger_samples = (samples + delayed_samples) / 2
+    return buffer.with_samples((buffer.samples + delayed_samples) / 2)
 
-    # Ограничение значений
-    max_value = np.iinfo(np.int32).max
-    flanger_samples = np.clip(flanger_samples, -max_value, max_value).astype(np.int32)
-
-    # Преобразуем массив обратно в аудио
-    processed_audio = audio._spawn(flanger_samples.tobytes())
-    return audiosegment_to_bytes(processed_audio)
+def apply_flanger(audio_bytes: bytes, rate_hz: float = 0.5, depth_ms: int = 10, feedback: float = 0.5) -> bytes:
+    """Добавляет эффект флэнджер к WAV-файлу (см. `process_flanger`)."""
+    return encode_wav(process_flanger(decode_wav(audio_bytes), rate_hz, depth_ms, feedback))
 
 # 🎶 8. Модуляция – Тремоло по громкости
-def apply_tremolo(audio_bytes: bytes, rate_hz: float = 5, depth: float = 0.5) -> bytes:
-    audio = bytes_to_audiosegment(audio_bytes)
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    mod_signal = 1 - (depth * (1 + np.sin(2 * np.pi * np.arange(len(samples)) * rate_hz / audio.frame_rate)) / 2)
-    tremolo_samples = samples * mod_signal
+def process_tremolo(buffer: AudioBuffer, rate_hz: float = 5, depth: float = 0.5) -> AudioBuffer:
+    time = np.arange(buffer.frames)
+    mod_signal = 1 - (depth * (1 + np.sin(2 * np.pi * time * rate_hz / buffer.frame_rate)) / 2)
+    return buffer.with_samples(buffer.samples * mod_signal.astype(np.float32)[:, None])
 
-    max_value = np.iinfo(np.int32).max
-    tremolo_samples = np.clip(tremolo_samples, -max_value, max_value)
-    # Преобразуем сэмплы обратно в целочисленные значения
-    processed_samples = tremolo_samples.astype(np.int32)
-    # Создаем новый объект AudioSegment из обработанных сэмплов
-    processed_audio = audio._spawn(processed_samples.tobytes())
-    # Преобразуем аудио обратно в байты и возвращаем
-    return audiosegment_to_bytes(processed_audio)
+def apply_tremolo(audio_bytes: bytes, rate_hz: float = 5, depth: float = 0.5) -> bytes:
+    """Добавляет тремоло к WAV-файлу (см. `process_tremolo`)."""
+    return encode_wav(process_tremolo(decode_wav(audio_bytes), rate_hz, depth))
 
 # 🎶 9. Модуляция – Тремоло по высоте (Vibrato)
-def apply_vibrato(audio_bytes: bytes, rate_hz: float = 5, depth_semitones: float = 0.5) -> bytes:
+def process_vibrato(buffer: AudioBuffer, rate_hz: float = 5, depth_semitones: float = 0.5) -> AudioBuffer:
     """
-    Добавляет эффект частотного вибрато (Frequency Vibrato) к аудиофайлу.
-    :param audio_bytes: Байтовая строка аудиофайла (WAV)
+    Добавляет эффект частотного вибрато (Frequency Vibrato).
+    :param buffer: Исходное аудио
     :param rate_hz: Частота модуляции вибрато (3-8 Гц)
     :param depth_semitones: Глубина модуляции (обычно 0.1 - 1.5 полутонов)
-    :return: Обработанный аудиофайл в байтах
+    :return: Обработанное аудио
     """
-    audio = bytes_to_audiosegment(audio_bytes)
-    frame_rate = audio.frame_rate
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-
     # Генерируем сигнал модуляции (LFO) для изменения высоты звука
-    time = np.arange(len(samples))
-    vibrato_signal = np.sin(2 * np.pi * rate_hz * time / frame_rate) * depth_semitones
+    time = np.arange(buffer.frames)
+    vibrato_signal = np.sin(2 * np.pi * rate_hz * time / buffer.frame_rate) * depth_semitones
 
     # Преобразуем глубину модуляции в коэффициент изменения частоты
     pitch_factor = 2 ** (vibrato_signal / 12)  # Перевод полутонов в коэффициент частоты
 
-    # Применяем изменение частоты с интерполяцией
-    indices = np.arange(len(samples)) * pitch_factor
-    indices = np.clip(indices, 0, len(samples) - 1)  # Ограничиваем диапазон индексов
-    vibrato_samples = np.interp(indices, np.arange(len(samples)), samples)
+    # Применяем изменение частоты с интерполяцией (по каждому каналу)
+    indices = np.clip(time * pitch_factor, 0, buffer.frames - 1)  # Ограничиваем диапазон индексов
+    vibrato_samples = np.empty_like(buffer.samples)
+    for channel in range(buffer.channels):
+        vibrato_samples[:, channel] = np.interp(indices, time, buffer.samples[:, channel])
 
-    # Ограничение значений
-    max_value = np.iinfo(np.int32).max
-    vibrato_samples = np.clip(vibrato_samples, -max_value, max_value).astype(np.int32)
+    return buffer.with_samples(vibrato_samples)
 
-    # Преобразуем массив обратно в аудио
-    processed_audio = audio._spawn(vibrato_samples.tobytes())
-    return audiosegment_to_bytes(processed_audio)
+def apply_vibrato(audio_bytes: bytes, rate_hz: float = 5, depth_semitones: float = 0.5) -> bytes:
+    """Добавляет вибрато к WAV-файлу (см. `process_vibrato`)."""
+    return encode_wav(process_vibrato(decode_wav(audio_bytes), rate_hz, depth_semitones))
+
+DIFFICULTY_PARAMS = {
+    "easy": {
+        "reverb_decay": 0.8, "reverb_delay": 100,
+        "delay_ms": 500, "delay_decay": 0.7,
+        "distortion_gain": 3,
+        "tremolo_rate": 5, "tremolo_depth": 0.8,
+        "vibrato_rate": 1.0, "vibrato_depth": 0.08,
+        "flanger_rate": 0.5, "flanger_depth": 8,
+        "chorus_rate": 0.7, "chorus_depth": 7,
+        "compression_th": -40, "compression_ratio" : 16,
+        "saturation": 3
+    },
+    "medium": {
+        "reverb_decay": 0.6, "reverb_delay": 75,
+        "delay_ms": 300, "delay_decay": 0.5,
+        "distortion_gain": 2,
+        "tremolo_rate": 7, "tremolo_depth": 0.6,
+        "vibrato_rate": 0.7, "vibrato_depth": 0.03,
+        "flanger_rate": 0.3, "flanger_depth": 5,
+        "chorus_rate": 0.5, "chorus_depth": 5,
+        "compression_th": -20, "compression_ratio" : 8,
+        "saturation": 2
+    },
+    "hard": {
+        "reverb_decay": 0.4, "reverb_delay": 50,
+        "delay_ms": 100, "delay_decay": 0.3,
+        "distortion_gain": 1.5,
+        "tremolo_rate": 10, "tremolo_depth": 0.3,
+        "vibrato_rate": 0.5, "vibrato_depth": 0.01,
+        "flanger_rate": 0.1, "flanger_depth": 2,
+        "chorus_rate": 1, "chorus_depth": 2,
+        "compression_th": -10, "compression_ratio" : 4,
+        "saturation": 1
+    }
+}
+
+def get_effects(difficulty: str = "medium") -> list[tuple[str, Callable, list]]:
+    """Возвращает список эффектов (название, стадия обработки, аргументы) для уровня сложности."""
+    def process_no_effect(buffer: AudioBuffer) -> AudioBuffer:
+        return buffer
+
+    params = DIFFICULTY_PARAMS.get(difficulty, DIFFICULTY_PARAMS["medium"])
+    return [
+        ("Reverb", process_reverb, [params["reverb_decay"], params["reverb_delay"]]), #OK
+        ("Delay", process_delay, [params["delay_ms"], params["delay_decay"]]), #OK
+        ("Distortion", process_distortion, [params["distortion_gain"]]), #OK
+        ("Tremolo", process_tremolo, [params["tremolo_rate"], params["tremolo_depth"]]), #OK
+        ("Flanger", process_flanger, [params["flanger_rate"], params["flanger_depth"]]), #OK
+        ("Chorus", process_chorus, [params["chorus_rate"], params["chorus_depth"]]), #OK
+        ("Vibrato", process_vibrato, [params["vibrato_rate"], params["vibrato_depth"]]), #OK
+        ("Compression", process_compression, [params["compression_th"], params["compression_ratio"]]), #SUPER
+        ("Saturation", process_saturation, [params["saturation"]]), #OK
+        ("No effect", process_no_effect, [])
+    ]
+
+EFFECT_NAMES = [effect_name for effect_name, _, _ in get_effects()]
+
+def get_effect(effect_name: str, difficulty: str = "medium") -> tuple[Callable, list]:
+    """Возвращает стадию обработки и её аргументы для эффекта с учетом сложности."""
+    for name, effect_func, effect_args in get_effects(difficulty):
+        if name == effect_name:
+            return effect_func, effect_args
+    raise ValueError(f"Неизвестный эффект: {effect_name}")
+
+def apply_effect(source: bytes | StoredTrack, effect_name: str, difficulty: str = "medium") -> bytes:
+    """
+    Применяет эффект по названию к аудиофайлу (или треку хранилища) с учетом сложности.
+    WAV декодируется и кодируется ровно один раз, без эффекта возвращается исходный файл.
+    """
+    effect_func, effect_args = get_effect(effect_name, difficulty)
+    if effect_name == "No effect" and not isinstance(source, StoredTrack):
+        return source
+
+    return encode_wav(effect_func(load_source(source), *effect_args))
 
 # 🎵 Применение случайного эффекта с учетом сложности
 def apply_random_effect(audio_bytes: bytes, difficulty: str = "medium") -> tuple[bytes, str]:
     """Применяет случайный эффект к аудиофайлу с разными уровнями сложности."""
-    def apply_no_effect(audio_bytes: bytes) -> bytes:
-        return audio_bytes
-
-    difficulty_params = {
-        "easy": {
-            "reverb_decay": 0.8, "reverb_delay": 100,
-            "delay_ms": 500, "delay_decay": 0.7,
-            "distortion_gain": 3,
-            "tremolo_rate": 5, "tremolo_depth": 0.8,
-            "vibrato_rate": 1.0, "vibrato_depth": 0.08,
-            "flanger_rate": 0.5, "flanger_depth": 8,
-            "chorus_rate": 0.7, "chorus_depth": 7,
-            "compression_th": -40, "compression_ratio" : 16,
-            "saturation": 3
-        },
-        "medium": {
-            "reverb_decay": 0.6, "reverb_delay": 75,
-            "delay_ms": 300, "delay_decay": 0.5,
-            "distortion_gain": 2,
-            "tremolo_rate": 7, "tremolo_depth": 0.6,
-            "vibrato_rate": 0.7, "vibrato_depth": 0.03,
-            "flanger_rate": 0.3, "flanger_depth": 5,
-            "chorus_rate": 0.5, "chorus_depth": 5,
-            "compression_th": -20, "compression_ratio" : 8,
-            "saturation": 2
-        },
-        "hard": {
-            "reverb_decay": 0.4, "reverb_delay": 50,
-            "delay_ms": 100, "delay_decay": 0.3,
-            "distortion_gain": 1.5,
-            "tremolo_rate": 10, "tremolo_depth": 0.3,
-            "vibrato_rate": 0.5, "vibrato_depth": 0.01,
-            "flanger_rate": 0.1, "flanger_depth": 2,
-            "chorus_rate": 1, "chorus_depth": 2,
-            "compression_th": -10, "compression_ratio" : 4,
-            "saturation": 1
-        }
-    }
-    
-    params = difficulty_params.get(difficulty, difficulty_params["medium"])
-    effects_list = [
-        ("Reverb", apply_reverb, [params["reverb_decay"]]), #OK
-        ("Delay", apply_delay, [params["delay_ms"], params["delay_decay"]]), #OK
-        ("Distortion", apply_distortion, [params["distortion_gain"]]), #OK
-        ("Tremolo", apply_tremolo, [params["tremolo_rate"], params["tremolo_depth"]]), #OK
-        ("Flanger", apply_flanger, [params["flanger_rate"], params["flanger_depth"]]), #OK
-        ("Chorus", apply_chorus, [params["chorus_rate"], params["chorus_depth"]]), #OK
-        ("Vibrato", apply_vibrato, [params["vibrato_rate"], params["vibrato_depth"]]), #OK
-        ("Compression", apply_compression, [params["compression_th"], params["compression_ratio"]]), #SUPER
-        ("Saturation", apply_saturation, [params["saturation"]]), #OK
-        ("No effect", apply_no_effect, [])
-    ]
-    
-    effect_name, effect_func, effect_args = random.choice(effects_list)
-    
-    modified_audio = effect_func(audio_bytes, *effect_args)
-    
-    return modified_audio, effect_name
+    effect_name = random.choice(EFFECT_NAMES)
+    return apply_effect(audio_bytes, effect_name, difficulty), effect_name
 
 if __name__ == "__main__":
     # Пример использования
@@ -1,74 +1,147 @@
 import io
+import logging
+import os
+import threading
+
+import numpy as np
 import pretty_midi
-import subprocess
 import soundfile as sf
 
 from utils.structures import Note, Chord  # Импортируем Note и Chord
+from utils.sample_bank import SampleBank
+
+logger = logging.getLogger(__name__)
 
 SF2_PATH = "utils/FluidR3_GM.sf2"  # Путь к soundfont
+SAMPLE_RATE = 44100
+RELEASE_TAIL = 0.5  # Секунды после последней ноты: естественное затухание вместо обрыва
+VELOCITY = 100
+PROGRAM = 0  # Grand Piano
 
-def midi_to_wav(midi_data: bytes) -> bytes:
-    """Конвертирует MIDI (bytes) в WAV (bytes)."""
-    midi_file = "temp.mid"
-    wav_file = "temp.wav"
+class SynthEngine:
+    """
+    Синтезатор FluidSynth внутри процесса (pyfluidsynth) вместо запуска fluidsynth на каждый рендер.
+    Soundfont загружается один раз при первом рендере, звук пишется сразу в память.
 
-    with open(midi_file, "wb") as f:
-        f.write(midi_data)
+    Синтезатор хранит состояние (звучащие голоса, хвост реверберации), поэтому рендеры
+    идут по очереди под блокировкой; после каждого состояние сбрасывается.
+    """
 
-    subprocess.run([
-        "fluidsynth", "-ni", SF2_PATH, midi_file, "-F", wav_file, "-r", "44100"
-    ], check=True)
+    def __init__(self, sf2_path: str = SF2_PATH, sample_rate: int = SAMPLE_RATE):
+        self.sf2_path = sf2_path
+        self.sample_rate = sample_rate
+        self._synth = None
+        self._sfid = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import fluidsynth  # libfluidsynth нужна только для рендера
+
+        synth = fluidsynth.Synth(samplerate=float(self.sample_rate))
+        sfid = synth.sfload(self.sf2_path)
+        if sfid == -1:
+            synth.delete()
+            raise RuntimeError(f"Failed to load soundfont {self.sf2_path}")
+        self._synth, self._sfid = synth, sfid
+
+    def render(self, notes: list[tuple[int, float, float]], velocity: int = VELOCITY, program: int = PROGRAM) -> np.ndarray:
+        """
+        Рендерит ноты в стерео int16.
+
+        :param notes: Список (MIDI-номер, начало, конец) в секундах.
+        :param program: Инструмент General MIDI (0 - Grand Piano).
+        :return: Массив формы (кадры, 2).
+        """
+        # В один момент времени сначала снимаются ноты, потом нажимаются новые
+        events = sorted([(start, 1, pitch) for pitch, start, _ in notes] + [(end, 0, pitch) for pitch, _, end in notes])
+        total_frames = round((max(end for _, _, end in notes) + RELEASE_TAIL) * self.sample_rate)
+
+        with self._lock:
+            if self._synth is None:
+                self._load()
+            synth = self._synth
+            synth.program_select(0, self._sfid, 0, program)
+
+            chunks = []
+            position = 0
+            try:
+                for time, note_on, pitch in events:
+                    frame = round(time * self.sample_rate)
+                    if frame > position:
+                        chunks.append(synth.get_samples(frame - position))
+                        position = frame
+                    if note_on:
+                        synth.noteon(0, pitch, velocity)
+                    else:
+                        synth.noteoff(0, pitch)
+                chunks.append(synth.get_samples(total_frames - position))
+            finally:
+                # Голоса и хвост реверберации не должны попасть в следующий рендер
+                synth.system_reset()
+
+        return np.concatenate(chunks).astype(np.int16).reshape(-1, 2)
+
+synth_engine = SynthEngine()
+
+def _soundfont_version() -> tuple:
+    stat = os.stat(SF2_PATH) if os.path.exists(SF2_PATH) else None
+    return (SF2_PATH, stat.st_size, stat.st_mtime_ns) if stat else (SF2_PATH,)
+
+sample_bank = SampleBank(pitches=range(Note.MIN_MIDI, Note.MAX_MIDI + 1), sample_rate=SAMPLE_RATE, tail=RELEASE_TAIL, version=(VELOCITY, PROGRAM, *_soundfont_version()))
+
+def prepare_sample_bank():
+    """Открывает банк нот или собирает его синтезатором (при первом запуске). Блокирующая."""
+    try:
+        sample_bank.build(synth_engine.render)
+    except Exception as e:
+        logger.warning(f"Sample bank is unavailable, notes will be synthesized: {e!r}")
+
+def render_wav(notes: list[tuple[int, float, float]], use_bank: bool = True) -> bytes:
+    """
+    WAV из нот: сложением буферов банка, а пока банк не готов - синтезатором.
 
+    :param use_bank: False - только синтезатором (вызывающий уже решил, чем рендерить, см. SampleBank.covers).
+    """
+    audio = sample_bank.mix(notes) if use_bank else None
+    if audio is None:
+        audio = synth_engine.render(notes)
     wav_bytes = io.BytesIO()
-    data, samplerate = sf.read(wav_file, dtype="int16")
-    sf.write(wav_bytes, data, samplerate, format="WAV")
-
+    sf.write(wav_bytes, audio, SAMPLE_RATE, format="WAV", subtype="PCM_16")
     return wav_bytes.getvalue()
 
+def midi_to_wav(midi_data: bytes) -> bytes:
+    """Конвертирует MIDI (bytes) в WAV (bytes)."""
+    midi = pretty_midi.PrettyMIDI(io.BytesIO(midi_data))
+    notes = [(note.pitch, note.start, note.end) for instrument in midi.instruments for note in instrument.notes]
+    return render_wav(notes)
+
+def notes_events(notes: list[Note]) -> list[tuple[int, float, float]]:
+    """Ноты, звучащие одновременно 2 секунды: (MIDI-номер, начало, конец)."""
+    return sorted((note_to_midi(note), 0.0, 2.0) for note in notes)
+
+def chords_events(chords: list[Chord]) -> list[tuple[int, float, float]]:
+    """Аккорды по 1 секунде подряд: (MIDI-номер, начало, конец)."""
+    return sorted(
+        (note_to_midi(note), float(index), index + 1.0)
+        for index, chord in enumerate(chords)
+        for note in chord.notes
+    )
+
 def get_notes_wav(notes: list[Note]) -> bytes:
     """
     Создаёт WAV-файл из массива нот (все звучат одновременно 2 секунды).
     """
-    midi = pretty_midi.PrettyMIDI()
-    instrument = pretty_midi.Instrument(program=0)  # Grand Piano
-
-    for note in notes:
-        midi_note = note_to_midi(note)
-        instrument.notes.append(pretty_midi.Note(
-            velocity=100, pitch=midi_note, start=0.0, end=2.0
-        ))
-
-    midi.instruments.append(instrument)
-    midi_bytes = io.BytesIO()
-    midi.write(midi_bytes)
-    return midi_to_wav(midi_bytes.getvalue())
+    return render_wav(notes_events(notes))
 
 def get_chords_wav(chords: list[Chord]) -> bytes:
     """
     Создаёт WAV-файл из массива аккордов (каждый звучит 1 секунду).
     """
-    midi = pretty_midi.PrettyMIDI()
-    instrument = pretty_midi.Instrument(program=0)  # Grand Piano
-    start_time = 0.0
-
-    for chord in chords:
-        for note in chord.notes:
-            midi_note = note_to_midi(note)
-            instrument.notes.append(pretty_midi.Note(
-                velocity=100, pitch=midi_note, start=start_time, end=start_time + 1.0
-            ))
-        start_time += 1.0
-
-    midi.instruments.append(instrument)
-    midi_bytes = io.BytesIO()
-    midi.write(midi_bytes)
-    return midi_to_wav(midi_bytes.getvalue())
+    return render_wav(chords_events(chords))
 
 def note_to_midi(note: Note) -> int:
     """Конвертирует объект Note в MIDI-номер."""
-    note_map = {"C": 0, "C#": 1, "D": 2, "D#": 3, "E": 4, "F": 5, "F#": 6, "G": 7, "G#": 8, "A": 9, "A#": 10, "B": 11}
-    octave_index = Note.OCTAVES.index(note.octave)
-    return 12 * (octave_index + 1) + note_map[note.name]
+    return note.midi
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from os import getenv
+from pathlib import Path
+
+RENDER_CACHE_DIR = getenv("RENDER_CACHE_DIR", "cache/renders")
+RENDER_CACHE_MEMORY_MB = int(getenv("RENDER_CACHE_MEMORY_MB", 256))
+# Объём постоянных записей на диске: сверх него удаляются давно не запрошенные
+RENDER_CACHE_DISK_MB = int(getenv("RENDER_CACHE_DISK_MB", 2048))
+# Временные рендеры (нужны одной ссылке на аудио): очищаются при запуске сервера
+RENDER_TEMP_DIR = getenv("RENDER_TEMP_DIR", "cache/render_temp")
+
+def make_key(*parts) -> str:
+    """Строит ключ кэша (sha256) из частей, сериализуемых в JSON."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+class RenderCache:
+    """
+    Кэш обработанного аудио с адресацией по содержимому: все записи лежат на диске,
+    самые востребованные дополнительно держатся в памяти. Оба уровня - LRU с ограничением
+    по объёму: на диске вытесняются давно не запрошенные записи (в том числе рендеры
+    старых версий эффектов, ключи которых больше не строятся). Порядок использования
+    на диске переживает перезапуск через mtime файлов.
+
+    Временные записи (`temporary=True`, например рендер с уникальными параметрами одного
+    испытания) лежат в отдельной папке, которая очищается при запуске: ссылки на них живут
+    только в памяти процесса, и после перезапуска такие файлы никому не нужны.
+
+    Методы блокирующие (дисковый ввод-вывод), из async-кода их вызывают через threadpool.
+    """
+
+    def __init__(self, directory: str = RENDER_CACHE_DIR, max_memory_bytes: int = RENDER_CACHE_MEMORY_MB * 1024 * 1024,
+                 temp_directory: str = RENDER_TEMP_DIR, max_disk_bytes: int = RENDER_CACHE_DISK_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.temp_directory = Path(temp_directory)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        # Постоянные записи на диске: ключ -> размер, от давно запрошенных к недавним.
+        # Папка сканируется при первом обращении, а не при импорте
+        self._disk: OrderedDict[str, int] | None = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str, temporary: bool = False) -> Path:
+        # Шардируем по первым символам ключа, чтобы не держать тысячи файлов в одной папке
+        return (self.temp_directory if temporary else self.directory) / key[:2] / key
+
+    def _find(self, key: str) -> Path | None:
+        for temporary in (False, True):
+            path = self._path(key, temporary)
+            if path.exists():
+                return path
+        return None
+
+    def is_temporary(self, key: str) -> bool:
+        return self._path(key, temporary=True).exists()
+
+    def clear_temporary(self):
+        """Удаляет временные записи (вызывается при запуске, пока ссылок на них нет)."""
+        shutil.rmtree(self.temp_directory, ignore_errors=True)
+
+    def _disk_index(self) -> OrderedDict[str, int]:
+        """Индекс постоянных записей (вызывается под self._lock)."""
+        if self._disk is None:
+            entries = []
+            for path in self.directory.glob("??/*"):
+                if path.suffix == ".tmp":
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, path.name, stat.st_size))
+            entries.sort()
+            self._disk = OrderedDict((key, size) for _, key, size in entries)
+            self._disk_bytes = sum(self._disk.values())
+        return self._disk
+
+    def _touch(self, key: str):
+        """Отмечает использование постоянной записи (вызывается под self._lock)."""
+        disk = self._disk_index()
+        if key in disk:
+            disk.move_to_end(key)
+
+    def _forget(self, key: str):
+        """Убирает запись из памяти и индекса диска (вызывается под self._lock)."""
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        size = self._disk_index().pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            if len(data) > self.max_memory_bytes:
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._touch(key)
+                self.memory_hits += 1
+                return data
+
+        path = self._find(key)
+        try:
+            if path is None:
+                raise FileNotFoundError(key)
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # Запись могли вытеснить между поиском и чтением
+            self.misses += 1
+            return None
+        if path.parent.parent == self.directory:
+            with self._lock:
+                self._touch(key)
+            os.utime(path)
+        self.disk_hits += 1
+        self._remember(key, data)
+        return data
+
+    def path(self, key: str) -> Path | None:
+        """
+        Файл записи на диске (для отдачи частями без загрузки в память) или None.
+        Считается обращением: запись становится недавно использованной.
+        """
+        path = self._find(key)
+        if path is None:
+            self.misses += 1
+            return None
+        if path.parent.parent == self.directory:
+            with self._lock:
+                self._touch(key)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+        self.disk_hits += 1
+        return path
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._find(key) is not None
+
+    def put(self, key: str, data: bytes, temporary: bool = False):
+        path = self._path(key, temporary)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем: читатель не увидит недописанный файл
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        if not temporary:
+            self._evict(self._account(key, len(data)))
+        self._remember(key, data)
+
+    def _account(self, key: str, size: int) -> list[str]:
+        """Учитывает новую постоянную запись и возвращает ключи, вытесняемые сверх max_disk_bytes."""
+        with self._lock:
+            disk = self._disk_index()
+            self._disk_bytes += size - disk.pop(key, 0)
+            disk[key] = size
+            evicted = []
+            while self._disk_bytes > self.max_disk_bytes and len(disk) > 1:
+                evicted_key = next(iter(disk))
+                self._forget(evicted_key)
+                evicted.append(evicted_key)
+            self.evictions += len(evicted)
+            return evicted
+
+    def _evict(self, keys: list[str]):
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        requests = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / requests if requests else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk or ()),
+            "disk_bytes": self._disk_bytes,
+            "evictions": self.evictions,
+        }
+
+    def delete(self, key: str):
+        with self._lock:
+            self._forget(key)
+        for temporary in (False, True):
+            self._path(key, temporary).unlink(missing_ok=True)
+
+render_cache = RenderCache()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from os import getenv
+from pathlib import Path
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from utils.api_clients import db_api
+
+logger = logging.getLogger(__name__)
+
+RESULT_BUFFER_SIZE = int(getenv("RESULT_BUFFER_SIZE", 50))  # Результатов, при которых сброс идёт сразу
+RESULT_BUFFER_INTERVAL = float(getenv("RESULT_BUFFER_INTERVAL", 2))  # Секунды между сбросами
+RESULT_SPOOL_PATH = getenv("RESULT_SPOOL_PATH", "cache/result_spool.jsonl")
+# Результаты, которые db-api отклонил, - для разбора вручную
+RESULT_QUARANTINE_PATH = getenv("RESULT_QUARANTINE_PATH", "cache/result_quarantine.jsonl")
+# Сбоев 500 подряд, после которых пачка считается некорректной и разбирается по частям (503 повторяется всегда)
+RESULT_MAX_ATTEMPTS = int(getenv("RESULT_MAX_ATTEMPTS", 5))
+
+class RetryLater(Exception):
+    """Временный сбой доставки: пачка остаётся в очереди."""
+
+class ResultBuffer:
+    """
+    Отложенная запись результатов тестов: результаты копятся и уходят в db-api
+    одним запросом /tests/batch - по количеству или по таймеру.
+
+    Доставка не реже одного раза: результат сначала дописывается в журнал на диске
+    и удаляется из него только после успешной записи в БД, а при старте журнал
+    перечитывается. Повторная отправка безопасна - у каждого результата свой
+    idempotency_key, и db-api пропускает уже записанные.
+
+    Если db-api отклоняет пачку (4xx или 500 дольше max_attempts попыток), она делится
+    пополам, пока не останутся отдельные результаты: корректные записываются, отклонённые
+    уходят в карантин и не задерживают очередь.
+    """
+
+    def __init__(self, spool_path: str = RESULT_SPOOL_PATH, max_size: int = RESULT_BUFFER_SIZE,
+                 interval: float = RESULT_BUFFER_INTERVAL, quarantine_path: str = RESULT_QUARANTINE_PATH,
+                 max_attempts: int = RESULT_MAX_ATTEMPTS):
+        self.spool_path = Path(spool_path)
+        self.quarantine_path = Path(quarantine_path)
+        self.max_size = max_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._failures = 0  # Сбоев 500 подряд
+        self._pending: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        # Дозапись и перезапись журнала идут в пуле потоков: перезапись не должна потерять дописанную строку
+        self._spool_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.spool_path.exists():
+            with open(self.spool_path) as spool:
+                self._pending = [json.loads(line) for line in spool if line.strip()]
+            if self._pending:
+                logger.info(f"Recovered {len(self._pending)} unsent test results")
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def add(self, user_id: int, type_id: int, score: int, difficulty: str):
+        """Ставит результат в очередь на запись."""
+        if not 1 <= score <= 100:
+            # db-api такие результаты не принимает: в пачке они блокировали бы запись остальных
+            logger.warning(f"Dropping test result with score {score} out of range 1..100")
+            return
+        result = {
+            "user_id": user_id,
+            "type_id": type_id,
+            "score": score,
+            "difficulty": difficulty,
+            "idempotency_key": str(uuid.uuid4()),
+        }
+        async with self._spool_lock:
+            await run_in_threadpool(self._append_spool, result)
+            self._pending.append(result)
+        if len(self._pending) >= self.max_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Отправляет накопленные результаты. При временной ошибке они остаются в очереди до следующей попытки."""
+        async with self._flush_lock:
+            batch = list(self._pending)
+            if not batch:
+                return
+            try:
+                rejected = await self._send(batch)
+            except RetryLater as e:
+                logger.warning(f"Failed to flush {len(batch)} test results, will retry: {e.__cause__!r}")
+                return
+            self._failures = 0
+            if rejected:
+                logger.error(f"Moving {len(rejected)} rejected test results to {self.quarantine_path}")
+                await run_in_threadpool(self._quarantine, rejected)
+
+            async with self._spool_lock:
+                # Пока шла отправка, могли прийти новые результаты: оставляем их
+                self._pending = self._pending[len(batch):]
+                await run_in_threadpool(self._rewrite_spool, list(self._pending))
+
+    async def _send(self, batch: list[dict]) -> list[dict]:
+        """
+        Записывает пачку, при отказе db-api - по половинам.
+
+        :return: Результаты, которые db-api не принял.
+        :raises RetryLater: Если db-api или БД временно недоступны.
+        """
+        try:
+            await db_api.add_test_results(batch)
+            return []
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+            if status_code >= 500:
+                if status_code == 503:
+                    raise RetryLater() from e
+                self._failures += 1
+                if self._failures < self.max_attempts:
+                    raise RetryLater() from e
+            if len(batch) == 1:
+                logger.error(f"db-api rejected test result {batch[0]['idempotency_key']}: {e.response.text}")
+                return batch
+        except Exception as e:
+            raise RetryLater() from e
+
+        # Уже записанные половины при повторе пропускаются по idempotency_key
+        middle = len(batch) // 2
+        return await self._send(batch[:middle]) + await self._send(batch[middle:])
+
+    def _quarantine(self, results: list[dict]):
+        with open(self.quarantine_path, "a") as quarantine:
+            quarantine.writelines(json.dumps(result) + "\n" for result in results)
+
+    def _append_spool(self, result: dict):
+        with open(self.spool_path, "a") as spool:
+            spool.write(json.dumps(result) + "\n")
+
+    def _rewrite_spool(self, results: list[dict]):
+        tmp_path = self.spool_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as spool:
+            spool.writelines(json.dumps(result) + "\n" for result in results)
+        os.replace(tmp_path, self.spool_path)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Например, диск заполнен: журнал не переписан, результаты остаются в очереди
+                logger.warning(f"Test result flush failed: {e!r}")
+
+result_buffer = ResultBuffer()
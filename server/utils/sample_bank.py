@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+from os import getenv
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from utils.render_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_BANK_DIR = getenv("SAMPLE_BANK_DIR", "cache/sample_bank")
+
+NoteEvent = tuple[int, float, float]  # (MIDI-номер, начало, конец) в секундах
+
+class SampleBank:
+    """
+    Банк заранее отрендеренных нот: по стерео-буферу int16 на каждую MIDI-ноту и длительность.
+    Каждая длительность - отдельный .npy-файл, открытый через memmap: данные не копируются
+    в память процесса, страницы общие для всех воркеров и остаются в page cache.
+
+    Синтезатор линеен, поэтому ноты, звучащие вместе, можно рендерить по отдельности
+    и складывать - испытание собирается сложением готовых массивов без синтеза.
+    """
+
+    def __init__(self, directory: str = SAMPLE_BANK_DIR, pitches: range = range(12, 120),
+                 durations: tuple[float, ...] = (1.0, 2.0), sample_rate: int = 44100, tail: float = 0.5,
+                 version: tuple = ()):
+        """
+        :param pitches: MIDI-ноты банка (по умолчанию все ноты девяти октав Note.OCTAVES).
+        :param tail: Секунды затухания после конца ноты, входящие в буфер.
+        :param version: Параметры рендера (soundfont, инструмент, громкость): при их изменении банк пересобирается.
+        """
+        self.directory = Path(directory)
+        self.pitches = pitches
+        self.durations = durations
+        self.sample_rate = sample_rate
+        self.tail = tail
+        self.version = make_key(pitches.start, pitches.stop, durations, sample_rate, tail, *version)[:16]
+        self._banks: dict[float, np.ndarray] | None = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._banks is not None
+
+    def _path(self, duration: float) -> Path:
+        return self.directory / f"{self.version}-{duration:g}s.npy"
+
+    def _frames(self, duration: float) -> int:
+        return round((duration + self.tail) * self.sample_rate)
+
+    def load(self) -> bool:
+        """Открывает банк с диска, если он уже собран с текущими параметрами."""
+        paths = {duration: self._path(duration) for duration in self.durations}
+        if not all(path.exists() for path in paths.values()):
+            return False
+        # np.asarray: обычный ndarray поверх той же отображённой памяти, без накладных расходов np.memmap
+        self._banks = {duration: np.asarray(np.load(path, mmap_mode="r")) for duration, path in paths.items()}
+        return True
+
+    def build(self, render: Callable[[list[NoteEvent]], np.ndarray]):
+        """
+        Собирает банк (если его ещё нет на диске) и открывает его.
+
+        :param render: Рендер нот в массив int16 формы (кадры, 2), например SynthEngine.render.
+        """
+        with self._build_lock:
+            if self.ready or self.load():
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for duration in self.durations:
+                path = self._path(duration)
+                if path.exists():
+                    continue
+                tmp_path = path.with_suffix(".tmp")
+                bank = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int16,
+                                                 shape=(len(self.pitches), self._frames(duration), 2))
+                for index, pitch in enumerate(self.pitches):
+                    bank[index] = render([(pitch, 0.0, duration)])
+                bank.flush()
+                del bank
+                os.replace(tmp_path, path)  # Недособранный банк никогда не виден под итоговым именем
+            self.load()
+            logger.info(f"Sample bank {self.version} is ready: {len(self.pitches)} notes x {len(self.durations)} durations")
+
+    def _duration(self, length: float) -> float | None:
+        return next((d for d in self.durations if abs(length - d) < 1e-6), None)
+
+    def covers(self, notes: list[NoteEvent]) -> bool:
+        """Банк готов и в нём есть все ноты и длительности: mix соберёт их без синтезатора."""
+        return self.ready and bool(notes) and all(
+            pitch in self.pitches and self._duration(end - start) is not None for pitch, start, end in notes
+        )
+
+    def mix(self, notes: list[NoteEvent]) -> np.ndarray | None:
+        """
+        Собирает звучание нот из банка.
+
+        :return: Массив int16 формы (кадры, 2) или None, если банк не готов или в нём нет
+                 какой-то ноты/длительности (тогда нужен обычный рендер).
+        """
+        banks = self._banks
+        if banks is None or not self.covers(notes):
+            return None
+
+        placed = []
+        for pitch, start, end in notes:
+            duration = self._duration(end - start)
+            placed.append((banks[duration][pitch - self.pitches.start], round(start * self.sample_rate)))
+
+        total_frames = round((max(end for _, _, end in notes) + self.tail) * self.sample_rate)
+        mix = np.zeros((total_frames, 2), dtype=np.int32)
+        for samples, offset in placed:
+            length = min(len(samples), total_frames - offset)
+            mix[offset:offset + length] += samples[:length]
+        return np.clip(mix, -32768, 32767).astype(np.int16)
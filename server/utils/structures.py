@@ -1,42 +1,127 @@
 import random
 
 class Note:
+    """
+    Нота - неизменяемое значение, хранящее только MIDI-номер (C субконтроктавы = 12).
+    Имя и октава берутся из таблиц по номеру, транспонирование - сложение.
+    Экземпляры заранее созданы для всех нот девяти октав и переиспользуются,
+    равенство и хэш - по MIDI-номеру, поэтому ноты можно использовать как ключи кэшей.
+    """
     NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
     OCTAVES = ["субконтроктава", "контроктава", "большая", "малая", "первая", "вторая", "третья", "четвертая", "пятая"]
+    MIN_MIDI = 12
+    MAX_MIDI = 12 * len(OCTAVES) + 11
+
+    _NOTE_INDEX = {name: index for index, name in enumerate(NOTES)}
+    _OCTAVE_INDEX = {octave: index for index, octave in enumerate(OCTAVES)}
+    _BY_MIDI: tuple["Note", ...] = ()
+
+    __slots__ = ("midi",)
 
-    def __init__(self, name: str, octave: str):
-        if name not in self.NOTES or octave not in self.OCTAVES:
+    def __new__(cls, name: str, octave: str):
+        note_index = cls._NOTE_INDEX.get(name)
+        octave_index = cls._OCTAVE_INDEX.get(octave)
+        if note_index is None or octave_index is None:
             raise ValueError("Некорректные нота или октава")
-        self.name = name
-        self.octave = octave
+        return cls._BY_MIDI[12 * (octave_index + 1) + note_index - cls.MIN_MIDI]
+
+    @classmethod
+    def from_midi(cls, midi: int) -> "Note":
+        if not cls.MIN_MIDI <= midi <= cls.MAX_MIDI:
+            raise ValueError("Нота вне допустимого диапазона октав")
+        return cls._BY_MIDI[midi - cls.MIN_MIDI]
+
+    @property
+    def name(self) -> str:
+        return self.NOTES[self.midi % 12]
+
+    @property
+    def octave(self) -> str:
+        return self.OCTAVES[self.midi // 12 - 1]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Note is immutable")
+
+    def __reduce__(self):
+        return Note.from_midi, (self.midi,)
+
+    def __eq__(self, other):
+        return isinstance(other, Note) and self.midi == other.midi
+
+    def __lt__(self, other: "Note"):
+        return self.midi < other.midi
+
+    def __hash__(self):
+        return hash(self.midi)
 
     def __repr__(self):
         return f"{self.name} ({self.octave})"
 
     def transpose(self, semitones: int):
         """Сдвигает ноту на заданное количество полутонов."""
-        index = self.NOTES.index(self.name) + semitones
-        octave_index = self.OCTAVES.index(self.octave) + index // 12
-        index %= 12
-
-        if 0 <= octave_index < len(self.OCTAVES):
-            return Note(self.NOTES[index], self.OCTAVES[octave_index])
-        else:
+        midi = self.midi + semitones
+        if not self.MIN_MIDI <= midi <= self.MAX_MIDI:
             raise ValueError("Транспозиция выходит за допустимый диапазон октав")
+        return self._BY_MIDI[midi - self.MIN_MIDI]
+
+def _make_note(midi: int) -> Note:
+    note = object.__new__(Note)
+    object.__setattr__(note, "midi", midi)
+    return note
+
+Note._BY_MIDI = tuple(_make_note(midi) for midi in range(Note.MIN_MIDI, Note.MAX_MIDI + 1))
 
 class Chord:
+    """Аккорд - неизменяемый кортеж нот; равенство и хэш по нотам."""
+
+    __slots__ = ("notes",)
+
     def __init__(self, root: Note, intervals: list[int]):
         """Создает аккорд на основе основной ноты и списка интервалов (в полутонах)."""
-        self.notes = [root] + [root.transpose(interval) for interval in intervals]
+        object.__setattr__(self, "notes", (root, *(root.transpose(interval) for interval in intervals)))
+
+    @classmethod
+    def from_notes(cls, notes) -> "Chord":
+        chord = object.__new__(cls)
+        object.__setattr__(chord, "notes", tuple(notes))
+        return chord
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Chord is immutable")
+
+    def __reduce__(self):
+        return Chord.from_notes, (self.notes,)
+
+    def __eq__(self, other):
+        return isinstance(other, Chord) and self.notes == other.notes
+
+    def __hash__(self):
+        return hash(self.notes)
 
     def __repr__(self):
         return " - ".join(map(str, self.notes))
 
     def transpose(self, semitones: int):
-        """Транспонирует аккорд на указанное число полутонов."""
-        self.notes = [note.transpose(semitones) for note in self.notes]
-        return self
-    
+        """Возвращает аккорд, транспонированный на указанное число полутонов."""
+        return Chord.from_notes(note.transpose(semitones) for note in self.notes)
+
+# Мажорные и минорные ступени (в полутонах) и правильные трезвучия на них
+KEY_STEPS = {
+    "M": ([0, 2, 4, 5, 7, 9], [[4, 7], [3, 7], [3, 7], [4, 7], [4, 7], [3, 7]]),  # I, ii, iii, IV, V, vi
+    "m": ([0, 3, 5, 7, 8, 10], [[3, 7], [4, 7], [3, 7], [3, 7], [4, 7], [4, 7]]),  # i, III, iv, v, VI, vii
+}
+
+# Аккорды тональности зависят только от звука тоники, лада и средней тесситуры: считаем их один раз
+_KEY_CHORDS = {
+    (pitch_class, middle_octave, scale_type): tuple(
+        Chord(Note(Note.NOTES[(pitch_class + step) % 12], middle_octave), intervals)
+        for step, intervals in zip(*KEY_STEPS[scale_type])
+    )
+    for pitch_class in range(12)
+    for middle_octave in ("малая", "первая")
+    for scale_type in KEY_STEPS
+}
+
 def get_key_chords(root: Note, scale_type: str) -> list[Chord]:
     """
     Возвращает 6 аккордов, входящих в заданную тональность.
@@ -48,28 +133,13 @@ def get_key_chords(root: Note, scale_type: str) -> list[Chord]:
     if scale_type not in ("M", "m"):
         raise ValueError("Тональность должна быть 'M' (мажор) или 'm' (минор).")
 
-    # Мажорные и минорные ступени (в полутонах)
-    major_steps = [0, 2, 4, 5, 7, 9]  # I, ii, iii, IV, V, vi
-    minor_steps = [0, 3, 5, 7, 8, 10]  # i, III, iv, v, VI, vii
-
-    # Правильные трезвучия в тональности:
-    major_chords = [[4, 7], [3, 7], [3, 7], [4, 7], [4, 7], [3, 7]]
-    minor_chords = [[3, 7], [4, 7], [3, 7], [3, 7], [4, 7], [4, 7]]
-
-    steps = major_steps if scale_type == "M" else minor_steps
-    chords_intervals = major_chords if scale_type == "M" else minor_chords
-
     # Определяем октаву, чтобы аккорды были в средней тесситуре
     middle_octave = "малая" if root.octave in Note.OCTAVES[:4] else "первая"
+    return list(_KEY_CHORDS[(root.midi % 12, middle_octave, scale_type)])
 
-    # Создаём список аккордов
-    chords = []
-    for step, intervals in zip(steps, chords_intervals):
-        chord_root = root.transpose(step)
-        chord_root.octave = middle_octave  # Переводим в среднюю тесситуру
-        chords.append(Chord(chord_root, intervals))
-
-    return chords
+# Средняя тесситура (малая и первая октавы) и интервалы от 0 (прима) до 24 (квинтдецима)
+INTERVAL_OCTAVES = ["малая", "первая"]
+MAX_INTERVAL = 24
 
 def generate_random_interval() -> tuple[Note, Note, int]:
     """
@@ -77,14 +147,11 @@ def generate_random_interval() -> tuple[Note, Note, int]:
     
     :return: Кортеж (первая нота, вторая нота, интервал в полутонах)
     """
-    # Средняя тесситура (малая и первая октавы)
-    middle_octaves = ["малая", "первая"]
-
     # Выбираем случайную ноту в средней тесситуре
-    root_note = Note(random.choice(Note.NOTES), random.choice(middle_octaves))
+    root_note = Note(random.choice(Note.NOTES), random.choice(INTERVAL_OCTAVES))
 
-    # Выбираем случайный интервал от 0 (прима) до 24 (квинтдецима)
-    semitones = random.randint(0, 24)
+    # Выбираем случайный интервал
+    semitones = random.randint(0, MAX_INTERVAL)
 
     try:
         # Получаем вторую ноту путем транспозиции
@@ -94,6 +161,17 @@ def generate_random_interval() -> tuple[Note, Note, int]:
         # Если транспозиция выходит за пределы октав, пробуем снова
         return generate_random_interval()
 
+def all_intervals():
+    """Перебирает все испытания interval, которые может выдать generate_random_interval: ([нота, нота], полутоны)."""
+    for octave in INTERVAL_OCTAVES:
+        for name in Note.NOTES:
+            root_note = Note(name, octave)
+            for semitones in range(MAX_INTERVAL + 1):
+                try:
+                    yield [root_note, root_note.transpose(semitones)], semitones
+                except ValueError:
+                    continue
+
 def generate_chord_progression(n: int) -> tuple[list[Chord], list[int]]:
     """
     Генерирует последовательность из `n` аккордов в одной случайной тональности.
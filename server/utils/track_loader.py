@@ -0,0 +1,94 @@
+import json
+import os
+import random
+import threading
+from dataclasses import dataclass
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+
+from utils.audio_buffer import AudioBuffer
+from utils.render_cache import make_key
+
+# Хранилище предобработанных треков file-api (fs/track_store), смонтированное на этом же хосте.
+# Пустое значение - треки берутся по сети из file-api
+TRACK_STORE_DIR = getenv("TRACK_STORE_DIR", "")
+STORED_TRACK_SUBTYPE = "PCM_16"  # Сжатая копия в хранилище 16-битная: точнее кодировать незачем
+
+@dataclass(frozen=True)
+class StoredTrack:
+    """Ссылка на трек хранилища: передаётся в процессы DSP вместо содержимого трека."""
+    name: str
+    frames: int
+    sample_rate: int
+    source_size: int
+    source_mtime_ns: int
+    settings_key: str
+
+    @property
+    def key(self) -> str:
+        """Хэш версии трека для ключей кэша рендеров (меняется при перезаписи или новой предобработке)."""
+        return make_key("track_store", self.name, self.source_size, self.source_mtime_ns, self.settings_key)
+
+class TrackLoader:
+    """
+    Открывает предобработанные треки (float32, формат .npy) через memmap только для чтения.
+    Сэмплы не декодируются и не копируются: все процессы DSP читают одни и те же страницы
+    из page cache, поэтому N воркеров не держат N копий треков.
+
+    Каждый процесс открывает трек один раз и держит отображение, пока файл не заменят.
+    """
+
+    def __init__(self, directory: str = TRACK_STORE_DIR):
+        self.directory = Path(directory) if directory else None
+        self._lock = threading.Lock()
+        self._index_mtime_ns: int | None = None
+        self._tracks: list[StoredTrack] = []
+        self._arrays: dict[str, tuple[int, np.ndarray]] = {}  # Имя -> (inode файла, отображение)
+
+    def tracks(self) -> list[StoredTrack]:
+        """Треки хранилища; индекс перечитывается, только когда file-api его обновил."""
+        if self.directory is None:
+            return []
+        index_path = self.directory / "index.json"
+        try:
+            mtime_ns = os.stat(index_path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if mtime_ns != self._index_mtime_ns:
+                try:
+                    with open(index_path) as f:
+                        items = json.load(f)
+                except (OSError, ValueError):
+                    return self._tracks
+                self._tracks = [
+                    StoredTrack(item["name"], item["frames"], item["sample_rate"], item["source_size"],
+                                item["source_mtime_ns"], make_key(item["settings"]))
+                    for item in items
+                ]
+                self._index_mtime_ns = mtime_ns
+            return self._tracks
+
+    def random(self) -> StoredTrack | None:
+        tracks = self.tracks()
+        return random.choice(tracks) if tracks else None
+
+    def open(self, track: StoredTrack) -> np.ndarray:
+        """Сэмплы трека формы (кадры, каналы) - массив только для чтения поверх memmap."""
+        path = self.directory / f"{track.name}.npy"
+        inode = os.stat(path).st_ino
+        with self._lock:
+            cached = self._arrays.get(track.name)
+            if cached is not None and cached[0] == inode:
+                return cached[1]
+            # np.asarray: обычный ndarray поверх той же отображённой памяти, без накладных расходов np.memmap
+            array = np.asarray(np.load(path, mmap_mode="r"))
+            self._arrays[track.name] = (inode, array)
+            return array
+
+    def load(self, track: StoredTrack) -> AudioBuffer:
+        return AudioBuffer(self.open(track), track.sample_rate, STORED_TRACK_SUBTYPE)
+
+track_loader = TrackLoader()
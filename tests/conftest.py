@@ -0,0 +1,13 @@
+import os
+import sys
+from pathlib import Path
+
+# Модули file-api импортируются как в контейнере (main.py рядом с ними), поэтому папка сервиса
+# должна быть в sys.path: локально она рядом с tests, в образе тестов - внутри /app
+for base in (Path(__file__).parent, Path(__file__).parent.parent):
+    if (base / "files_storage").is_dir():
+        sys.path.insert(0, str(base / "files_storage"))
+        break
+
+# Предобработка загруженных треков запускает пул процессов: в тестах API она не нужна
+os.environ.setdefault("TRACK_STORE_AUTO_INGEST", "0")
@@ -1,7 +1,15 @@
+import io
 import os
 from pathlib import Path
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from files_storage.main import app, STORAGE_DIR, TESTING_TRACKS_DIR
+from files_storage.streaming import iter_tracks
+from files_storage.track_store import PipelineSettings, ingest_track
+from utils.http_range import parse_range
+import numpy as np
+import soundfile as sf
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -38,6 +46,33 @@ def test_get_file():
     assert filename in response.headers["content-disposition"]
 
 
+def test_get_file_range():
+    """Тест получения части файла по заголовку Range."""
+    content = (Path(TESTING_TRACKS_DIR) / "track_1.wav").read_bytes()
+    response = client.get("/file/?directory=testing_tracks&filename=track_1.wav", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 100-199/1024"
+    assert response.content == content[100:200]
+
+    response = client.get("/file/?directory=testing_tracks&filename=track_1.wav", headers={"Range": "bytes=2000-"})
+    assert response.status_code == 416
+
+
+def test_parse_range():
+    """Тест общего разбора Range (server и file-api): суффикс, открытый конец, ошибки и 416."""
+    assert parse_range("bytes=-100", 1024) == (924, 1023)
+    assert parse_range("bytes=-5000", 1024) == (0, 1023)
+    assert parse_range("bytes=1000-", 1024) == (1000, 1023)
+    assert parse_range("bytes=1000-5000", 1024) == (1000, 1023)
+    for header in ("bytes=0-1,5-6", "items=0-1", "bytes=5-3", "bytes=-", "bytes=--5", "bytes=a-"):
+        assert parse_range(header, 1024) is None
+    for header in ("bytes=1024-", "bytes=-0"):
+        with pytest.raises(HTTPException) as error:
+            parse_range(header, 1024)
+        assert error.value.status_code == 416
+        assert error.value.headers["Content-Range"] == "bytes */1024"
+
+
 def test_get_file_not_found():
     """Тест получения несуществующего файла."""
     response = client.get("/file/?directory=testing_tracks&filename=nonexistent.wav")
@@ -68,6 +103,21 @@ def test_get_random_file_no_files():
     setup_module(None)
 
 
+# Тесты для метода list_files
+def test_list_files():
+    """Тест получения списка файлов директории."""
+    response = client.get("/list-files/?directory=testing_tracks")
+    assert response.status_code == 200
+    assert response.json()["files"] == [f"track_{i}.wav" for i in range(1, 6)]
+
+
+def test_list_files_directory_not_found():
+    """Тест получения списка файлов несуществующей директории."""
+    response = client.get("/list-files/?directory=nonexistent")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Directory not found"
+
+
 # Тесты для метода send_tracks
 def test_send_tracks():
     """Тест успешной отправки случайных треков."""
@@ -83,6 +133,15 @@ def test_send_tracks_with_filter():
     assert response.headers["content-type"] == "application/octet-stream"
 
 
+def test_send_tracks_framing():
+    """Тест разбора потока нескольких треков на отдельные файлы."""
+    response = client.get("/send-tracks/?count=10")
+    tracks = dict(iter_tracks(io.BytesIO(response.content)))
+    assert response.headers["x-track-count"] == "5"
+    assert sorted(tracks) == [f"track_{i}.wav" for i in range(1, 6)]
+    assert tracks["track_2.wav"] == (Path(TESTING_TRACKS_DIR) / "track_2.wav").read_bytes()
+
+
 def test_send_tracks_filter_no_match():
     """Тест отправки треков с фильтром, который не совпадает."""
     response = client.get("/send-tracks/?count=2&filter=nonexistent")
@@ -110,3 +169,83 @@ def test_send_tracks_no_files():
 
     # Восстанавливаем тестовые файлы
     setup_module(None)
+
+
+# Тесты для каталога треков
+def test_tracks_paging_and_prefix():
+    """Тест постраничного списка треков с фильтром по префиксу."""
+    response = client.get("/tracks/?offset=1&limit=2")
+    assert response.status_code == 200
+    assert response.json()["total"] == 5
+    assert [track["name"] for track in response.json()["tracks"]] == ["track_2.wav", "track_3.wav"]
+
+    response = client.get("/tracks/?prefix=track_4")
+    assert [track["name"] for track in response.json()["tracks"]] == ["track_4.wav"]
+    assert response.json()["tracks"][0]["size"] == 1024
+
+
+def test_random_file_with_tag():
+    """Тест выбора случайного файла по тегу из имени."""
+    with open(Path(TESTING_TRACKS_DIR) / "bass_line_01.wav", "wb") as f:
+        f.write(os.urandom(512))
+
+    response = client.get("/random-file/?directory=testing_tracks&tag=bass")
+    assert response.status_code == 200
+    assert "bass_line_01.wav" in response.headers["content-disposition"]
+
+    response = client.get("/random-file/?directory=testing_tracks&tag=drums")
+    assert response.status_code == 404
+
+    (Path(TESTING_TRACKS_DIR) / "bass_line_01.wav").unlink()
+
+
+def test_uploaded_file_in_catalog():
+    """Тест: загруженный файл сразу виден в каталоге."""
+    response = client.post("/upload/?directory=testing_tracks", files={"file": ("track_6.wav", os.urandom(256))})
+    assert response.status_code == 200
+
+    response = client.get("/tracks/?prefix=track_6")
+    assert response.json()["total"] == 1
+
+    (Path(TESTING_TRACKS_DIR) / "track_6.wav").unlink()
+    response = client.get("/list-files/?directory=testing_tracks")
+    assert response.json()["files"] == [f"track_{i}.wav" for i in range(1, 6)]
+
+
+def test_upload_deduplicates_content():
+    """Тест: одинаковое содержимое хранится один раз и отдаётся с ETag из sha256."""
+    content = os.urandom(300)
+    first = client.post("/upload/?directory=testing_tracks", files={"file": ("dup.wav", content)}).json()
+    again = client.post("/upload/?directory=testing_tracks", files={"file": ("dup.wav", content)}).json()
+    copy = client.post("/upload/?directory=testing_tracks", files={"file": ("copy.wav", content)}).json()
+    assert first["path"] == again["path"]
+    assert os.path.samefile(first["path"], copy["path"])
+
+    response = client.get("/file/?directory=testing_tracks&filename=dup.wav")
+    assert response.headers["etag"] == f'"{first["sha256"]}"'
+
+    for filename in ("dup.wav", "copy.wav"):
+        assert client.delete(f"/file/?directory=testing_tracks&filename={filename}").status_code == 200
+    assert client.get("/list-files/?directory=testing_tracks").json()["files"] == [f"track_{i}.wav" for i in range(1, 6)]
+
+
+def test_blob_index_not_exposed():
+    """Тест: служебная папка блобов и пути вне хранилища недоступны через API."""
+    for url in ("/file/?directory=.blobs&filename=index.db", "/file/?directory=testing_tracks&filename=../.blobs/index.db",
+                "/list-files/?directory=.blobs", "/random-file/?directory=.blobs", "/tracks/?directory=.blobs",
+                "/list-files/?directory=/etc"):
+        assert client.get(url).status_code == 400
+
+
+def test_track_preprocessing(tmp_path):
+    """Тест предобработки: формат хранилища, обрезка, громкость и сжатая копия."""
+    t = np.arange(48000 * 20) / 48000
+    sf.write(tmp_path / "sine.wav", 0.05 * np.sin(2 * np.pi * 440 * t), 48000, subtype="PCM_16")
+
+    track = ingest_track(str(tmp_path / "sine.wav"), str(tmp_path), PipelineSettings())
+    samples = np.load(tmp_path / "sine.wav.npy", mmap_mode="r")
+    assert samples.dtype == np.float32 and samples.shape == (44100 * 15, 2)
+    assert track.duration == 15.0
+    assert abs(track.rms_dBFS + 14) < 0.5
+    assert abs(track.spectral_centroid - 440) < 50
+    assert sf.info(tmp_path / "sine.wav.flac").frames == 44100 * 15
@@ -0,0 +1,129 @@
+import hashlib
+import os
+from os import getenv
+from pathlib import Path
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException
+from starlette.responses import Response
+
+RANGE_CHUNK_SIZE = int(getenv("STREAM_CHUNK_SIZE", 256 * 1024))  # Байт на одно чтение файла
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Разбирает заголовок Range с одним диапазоном байт (RFC 9110): `bytes=first-last`,
+    `bytes=first-` (до конца) или `bytes=-suffix` (последние suffix байт).
+    Общий для server и file-api.
+
+    :param range_header: Значение заголовка Range.
+    :param size: Размер содержимого в байтах.
+    :return: (начало, конец включительно) или None, если заголовок не поддерживается или
+             записан с ошибкой (несколько диапазонов, другие единицы, last < first) - тогда
+             отдаётся всё содержимое.
+    :raises HTTPException: 416, если диапазон корректен, но вне содержимого.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start, _, end = ranges.strip().partition("-")
+    if not (start.isdigit() or start == "") or not (end.isdigit() or end == "") or start == end == "":
+        return None
+
+    if start:
+        first, last = int(start), int(end) if end else size - 1
+        if end and last < first:
+            return None
+    else:
+        suffix = int(end)
+        first, last = max(size - suffix, 0), size - 1
+        if suffix == 0:
+            first = size  # Пустой суффикс неудовлетворим
+
+    if first >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return first, min(last, size - 1)
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def weak_etag(stat: os.stat_result) -> str:
+    """Слабый ETag по времени изменения и размеру файла."""
+    return f'W/"{hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest()}"'
+
+class RangeFileResponse(Response):
+    """
+    Файл с поддержкой Range (206/416), If-Range и ETag/If-None-Match. Общий для server и file-api.
+
+    Файл открывается в конструкторе (блокирующий вызов - из sync-обработчика или через
+    threadpool): если его удалят или вытеснят из кэша после этого, ответ всё равно будет
+    отдан целиком. Содержимое не загружается в память: если сервер поддерживает расширение
+    ASGI zerocopysend, файл отдаётся через sendfile, иначе читаются только нужные байты
+    кусками по RANGE_CHUNK_SIZE.
+
+    :param etag: ETag ответа; если не задан - слабый, по времени изменения и размеру.
+                 If-Range учитывается только для сильного ETag.
+    :param filename: Имя для Content-Disposition (attachment) или None.
+    :param headers: Дополнительные заголовки (например, Cache-Control).
+    :raises FileNotFoundError: Если файла нет.
+    """
+
+    def __init__(self, path: Path, media_type: str = "application/octet-stream", range_header: str | None = None,
+                 if_range: str | None = None, if_none_match: str | None = None, etag: str | None = None,
+                 filename: str | None = None, headers: dict | None = None):
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        size = stat.st_size
+        etag = etag or weak_etag(stat)
+        response_headers = {name.lower(): value for name, value in (headers or {}).items()}
+        response_headers.update({"accept-ranges": "bytes", "etag": etag})
+        if filename is not None:
+            response_headers["content-disposition"] = content_disposition(filename)
+
+        self.offset, self.count = 0, size
+        status_code = 200
+        try:
+            if if_none_match == etag:
+                status_code, self.count = 304, 0
+            elif range_header and (if_range is None or (if_range == etag and not etag.startswith("W/"))):
+                byte_range = parse_range(range_header, size)
+                if byte_range is not None:
+                    first, last = byte_range
+                    self.offset, self.count = first, last - first + 1
+                    status_code = 206
+                    response_headers["content-range"] = f"bytes {first}-{last}/{size}"
+        except HTTPException:
+            self.file.close()
+            raise
+
+        super().__init__(status_code=status_code, media_type=media_type, headers=response_headers)
+        if status_code != 304:
+            self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if self.count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.file, "offset": self.offset,
+                            "count": self.count, "more_body": False})
+                return
+
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, self.file.fileno(), min(RANGE_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break  # Файл укоротили во время отправки
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(self.file.close)
@@ -1,3 +1,5 @@
+from uuid import UUID
+
 from pydantic import BaseModel, EmailStr, Field
 
 class UserUpdate(BaseModel):
@@ -29,4 +31,5 @@ class Test(BaseModel):
     user_id: int
     type_id: int
     score: int = Field(..., ge=1, le=100)
-    difficulty: str
\ No newline at end of file
+    difficulty: str
+    idempotency_key: UUID | None = None
\ No newline at end of file